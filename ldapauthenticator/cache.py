@@ -0,0 +1,405 @@
+"""
+Small in-memory caches, used by LDAPAuthenticator to avoid repeating
+requests to the LDAP server with results that rarely change.
+"""
+
+import asyncio
+import copy
+import hashlib
+import hmac
+import math
+import os
+import time
+from collections import Counter, OrderedDict
+from functools import partial
+
+_missing = object()
+
+
+class TTLCache:
+    """
+    A dict-like cache holding up to `maxsize` items for `ttl` seconds each,
+    evicting the least recently used item when full.
+
+    A `maxsize` or `ttl` of 0 disables the cache, so that nothing is stored.
+
+    The number of lookups that found a fresh item and those that didn't are
+    counted in `hits` and `misses`.
+    """
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        # key -> (expiry time, value), the most recently used last
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return self.get(key, _missing, count=False) is not _missing
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key, default=None, count=True):
+        """
+        Returns the value stored for `key`, or `default` if there is none or
+        it has expired.
+        """
+        item = self._items.get(key)
+        if item is not None:
+            expires, value = item
+            if self.timer() < expires:
+                self._items.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+            del self._items[key]
+        if count:
+            self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores `value` for `key`, for `ttl` seconds if provided instead of the
+        cache's default.
+        """
+        if not self.enabled:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self._items[key] = (self.timer() + ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def replace(self, key, value):
+        """
+        Replaces the value stored for `key`, if any, keeping its expiry time.
+        """
+        item = self._items.get(key)
+        if item is not None:
+            self._items[key] = (item[0], value)
+
+    def items(self):
+        """
+        Returns a list of the (key, value) pairs stored, including expired
+        ones.
+        """
+        return [(key, value) for key, (_, value) in self._items.items()]
+
+    def pop(self, key, default=None):
+        """
+        Removes and returns the value stored for `key`, regardless of it
+        having expired.
+        """
+        item = self._items.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        """
+        Removes all items.
+        """
+        self._items.clear()
+
+
+class CredentialCache:
+    """
+    Remembers the auth models of successful logins for `ttl` seconds, for up
+    to `maxsize` usernames, so that logging in again with the same password
+    doesn't require the LDAP server.
+
+    Passwords are never stored, only a salted scrypt hash of them. As
+    computing it is deliberately slow, it is computed in a worker thread so
+    that the event loop isn't blocked, by calling the coroutine function
+    `run` with a blocking function if provided, such as LDAPAuthenticator's
+    `_run_in_thread`, or otherwise in the event loop's default executor.
+    """
+
+    scrypt_params = {"n": 2**14, "r": 8, "p": 1}
+    salt_size = 16
+
+    def __init__(self, maxsize, ttl, run=None):
+        self._cache = TTLCache(maxsize, ttl)
+        self._run = run
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, username):
+        return username in self._cache
+
+    @property
+    def enabled(self):
+        return self._cache.enabled
+
+    async def _hash(self, password, salt):
+        func = partial(
+            hashlib.scrypt, password.encode("utf-8"), salt=salt, **self.scrypt_params
+        )
+        if self._run is None:
+            return await asyncio.get_running_loop().run_in_executor(None, func)
+        return await self._run(func)
+
+    async def get(self, username, password):
+        """
+        Returns a copy of the auth model remembered for `username` if it was
+        remembered with the same `password`, or None.
+        """
+        entry = self._cache.get(username, count=False)
+        if entry is not None:
+            salt, digest, auth_model = entry
+            if hmac.compare_digest(await self._hash(password, salt), digest):
+                self.hits += 1
+                return copy.deepcopy(auth_model)
+        self.misses += 1
+        return None
+
+    async def set(self, username, password, auth_model):
+        """
+        Remembers the auth model of a successful login with `password`.
+        """
+        if not self.enabled:
+            return
+        salt = os.urandom(self.salt_size)
+        digest = await self._hash(password, salt)
+        self._cache.set(username, (salt, digest, copy.deepcopy(auth_model)))
+
+    def pop(self, username):
+        """
+        Forgets the login remembered for `username`.
+        """
+        self._cache.pop(username)
+
+    def usernames(self, name):
+        """
+        Returns the usernames of the logins remembered with an auth model
+        for the JupyterHub user `name`.
+        """
+        return [
+            username
+            for username, (_, _, auth_model) in self._cache.items()
+            if auth_model["name"] == name
+        ]
+
+    def update(self, name, auth_model):
+        """
+        Replaces the auth model remembered for the JupyterHub user `name`,
+        such as after checking the user again, keeping the logins' hashes
+        and expiry times.
+        """
+        for username, (salt, digest, remembered) in self._cache.items():
+            if remembered["name"] == name:
+                self._cache.replace(username, (salt, digest, copy.deepcopy(auth_model)))
+
+    def clear(self):
+        """
+        Forgets all remembered logins.
+        """
+        self._cache.clear()
+
+
+class TemplateOrder:
+    """
+    Learns which of multiple templates, such as `bind_dn_template` entries,
+    succeed for each username, to order them with the likely one first.
+
+    The template that last succeeded is remembered for up to `maxsize`
+    usernames, the least recently used forgotten first, and tried first.
+    The remaining templates are ordered by how often they have succeeded
+    overall, and then as configured.
+
+    `logins` counts the recorded successes, and `first_attempt_logins` those
+    succeeding with the first template tried.
+    """
+
+    def __init__(self, maxsize):
+        self._last = TTLCache(maxsize, math.inf)
+        self.successes = Counter()
+        self.logins = 0
+        self.first_attempt_logins = 0
+
+    @property
+    def first_attempt_rate(self):
+        """
+        The fraction of recorded successes with the first template tried.
+        """
+        return self.first_attempt_logins / self.logins if self.logins else 0.0
+
+    def order(self, username, templates):
+        """
+        Returns `templates` in the order they should be tried for `username`.
+        """
+        last = self._last.get(username)
+        return sorted(templates, key=lambda t: (t != last, -self.successes[t]))
+
+    def succeeded(self, username, template, attempt):
+        """
+        Records that `template` succeeded for `username`, as the `attempt`th
+        template tried, counting from 0.
+        """
+        self._last.set(username, template)
+        self.successes[template] += 1
+        self.logins += 1
+        if attempt == 0:
+            self.first_attempt_logins += 1
+
+    def failed(self, username):
+        """
+        Forgets the template remembered for `username`, as none succeeded.
+        """
+        self._last.pop(username)
+
+
+class Singleflight:
+    """
+    Lets concurrent calls of the same operation, identified by a key, share
+    the result of a single call in progress instead of each making it.
+
+    `shared` counts the calls that shared the result of a call in progress.
+    """
+
+    def __init__(self):
+        self._in_progress = {}
+        self.shared = 0
+
+    async def run(self, key, func, *args, **kwargs):
+        """
+        Returns the result of awaiting `func(*args, **kwargs)`, or of a call
+        with the same `key` already in progress. Callers sharing a result get
+        a copy of it, so that modifying it doesn't affect other callers.
+        """
+        task = self._in_progress.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._in_progress[key] = task
+            task.add_done_callback(partial(self._done, key))
+        # shielded, so that a caller being cancelled doesn't cancel the call
+        # for the others
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result) if shared else result
+
+    def _done(self, key, task):
+        if self._in_progress.get(key) is task:
+            del self._in_progress[key]
+
+
+class TokenBuckets:
+    """
+    A token bucket per key, holding up to `capacity` tokens and refilled at
+    `capacity` tokens per `period` seconds, limiting how often something can
+    happen for each key, such as failed logins per username.
+
+    Buckets that aren't full are held for up to `maxsize` keys, the least
+    recently used dropped first. A bucket not taken from for `period` seconds
+    is full again, and is dropped.
+    """
+
+    def __init__(self, capacity, period, maxsize=10000, timer=time.monotonic):
+        self.capacity = capacity
+        self.period = period
+        self.timer = timer
+        # key -> (tokens, time they were counted)
+        self._buckets = TTLCache(maxsize, period, timer=timer)
+
+    @property
+    def enabled(self):
+        return self.capacity > 0 and self.period > 0
+
+    def _tokens(self, key, now):
+        bucket = self._buckets.get(key, count=False)
+        if bucket is None:
+            return self.capacity
+        tokens, counted = bucket
+        refilled = (now - counted) * self.capacity / self.period
+        return min(tokens + refilled, self.capacity)
+
+    def empty(self, key):
+        """
+        Returns True if the bucket for `key` has less than one token left.
+        """
+        return self.enabled and self._tokens(key, self.timer()) < 1
+
+    def take(self, key):
+        """
+        Takes a token from the bucket for `key`, if there is one.
+        """
+        if not self.enabled:
+            return
+        now = self.timer()
+        tokens = max(self._tokens(key, now) - 1, 0)
+        self._buckets.set(key, (tokens, now))
+
+
+class Batcher:
+    """
+    Collects keys submitted within `delay` seconds of the first, up to
+    `max_size` of them, and processes them together with one call of the
+    coroutine function `func`, taking a list of keys and returning a dict
+    mapping keys to results.
+
+    Submissions of a key already waiting share its result. `batches` counts
+    the calls of `func`, and `shared` the submissions that shared another's
+    result.
+    """
+
+    def __init__(self, func, delay, max_size):
+        self._func = func
+        self.delay = delay
+        self.max_size = max(max_size, 1)
+        # key -> future of its result
+        self._pending = {}
+        self._timer = None
+        self.batches = 0
+        self.shared = 0
+
+    async def submit(self, key):
+        """
+        Returns the result for `key`, once the batch it is part of has been
+        processed. Callers sharing a result get a copy of it.
+        """
+        future = self._pending.get(key)
+        shared = future is not None
+        if shared:
+            self.shared += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = self._pending[key] = loop.create_future()
+            if len(self._pending) >= self.max_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.delay, self._flush)
+        # shielded, so that a caller being cancelled doesn't cancel the
+        # result for the others
+        result = await asyncio.shield(future)
+        return copy.deepcopy(result) if shared else result
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            asyncio.ensure_future(self._process(batch))
+
+    async def _process(self, batch):
+        self.batches += 1
+        try:
+            results = await self._func(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
@@ -0,0 +1,982 @@
+"""
+Connections to an LDAP server, as used by LDAPAuthenticator.
+
+Two implementations share the same awaitable interface:
+
+- `SyncConnection` wraps a bound ldap3 Connection, running its blocking
+  operations either directly or in a thread pool.
+- `AsyncioConnection` talks LDAP directly on the asyncio event loop, so many
+  concurrent logins can be served without a thread each. Messages are encoded
+  and decoded with ldap3's protocol helpers.
+"""
+
+import asyncio
+import ssl
+import weakref
+from collections import Counter, namedtuple
+
+import ldap3
+from ldap3.core.exceptions import (
+    LDAPBindError,
+    LDAPSessionTerminatedByServerError,
+    LDAPSocketOpenError,
+    LDAPSocketReceiveError,
+    LDAPStartTLSError,
+)
+from ldap3.core.tls import Tls, check_hostname
+from ldap3.operation.bind import bind_operation, bind_response_to_dict_fast
+from ldap3.operation.compare import compare_operation
+from ldap3.operation.extended import (
+    extended_operation,
+    extended_response_to_dict_fast,
+)
+from ldap3.operation.search import (
+    search_operation,
+    search_result_entry_response_to_dict_fast,
+)
+from ldap3.operation.unbind import unbind_operation
+from ldap3.protocol.convert import build_controls_list
+from ldap3.protocol.rfc2696 import paged_search_control
+from ldap3.protocol.rfc4511 import LDAPMessage, MessageID, ProtocolOp
+from ldap3.strategy.base import BaseStrategy
+from ldap3.utils.asn1 import decode_message_fast, encode, ldap_result_to_dict_fast
+
+from .groups import normalize_dn
+from .tracing import Tracer, filter_template
+
+START_TLS_OID = "1.3.6.1.4.1.1466.20037"
+PAGED_RESULTS_OID = "1.2.840.113556.1.4.319"
+
+# protocolOp tags of the responses handled by AsyncioConnection
+_BIND_RESPONSE = 1
+_SEARCH_RESULT_ENTRY = 4
+_SEARCH_RESULT_DONE = 5
+_SEARCH_RESULT_REFERENCE = 19
+_EXTENDED_RESPONSE = 24
+
+_COMPARE_TRUE = 6
+
+SearchEntry = namedtuple("SearchEntry", ["dn", "attributes"])
+SearchEntry.__doc__ = """
+An entry returned by a search, with `attributes` being a dict mapping
+attribute names to lists of values.
+"""
+
+
+class FetchedEntries:
+    """
+    The attributes of entries already fetched during a login, so that later
+    steps needing attributes of the same entries don't need to search for
+    them again.
+
+    Entries are only reused for attributes that were explicitly requested
+    when fetching them, as attributes without values may be missing from
+    the entries returned.
+    """
+
+    def __init__(self):
+        # normalized DN -> [(set of requested attribute names, attributes)]
+        self._entries = {}
+
+    def add(self, entry, requested):
+        """
+        Records a SearchEntry fetched with the `requested` attribute names.
+        """
+        requested = {name.lower() for name in requested}
+        if requested & {"*", "+"}:
+            # unclear which attributes are expected to be included
+            return
+        self._entries.setdefault(normalize_dn(entry.dn), []).append(
+            (requested, entry.attributes)
+        )
+
+    def get(self, dn, names):
+        """
+        Returns a dict with the `names` attributes of the entry with DN `dn`,
+        or None if they haven't all been fetched.
+        """
+        wanted = {name.lower() for name in names}
+        for requested, attributes in self._entries.get(normalize_dn(dn), []):
+            if wanted <= requested:
+                return {
+                    name: values
+                    for name, values in attributes.items()
+                    if name.lower() in wanted
+                }
+        return None
+
+
+class ConnectionStats:
+    """
+    Counts the connections tracked with `track`:
+
+    - `opened`, all connections tracked.
+    - `open`, those not yet unbound.
+    - `in_use`, those open and not idle, where `idle` is an optional
+      function returning the number of open connections that are idle, such
+      as those in a pool.
+    - `leaked`, those garbage collected without having been unbound. Their
+      sockets are closed when they are collected.
+
+    `operations` counts the LDAP operations passed to `count`, such as
+    "search" requests made with tracked connections, also calling
+    `on_operation` with each if provided.
+
+    If `log` is provided, leaked connections and searches with tracked
+    connections ending with a result other than success are logged to it.
+    """
+
+    def __init__(self, idle=None, on_operation=None, log=None):
+        self._idle = idle
+        self.on_operation = on_operation
+        self.log = log
+        self.opened = 0
+        self.open = 0
+        self.leaked = 0
+        self.operations = Counter()
+
+    def count(self, operation):
+        """
+        Counts an LDAP operation, such as "bind", "search" or "compare".
+        """
+        self.operations[operation] += 1
+        if self.on_operation is not None:
+            self.on_operation(operation)
+
+    @property
+    def in_use(self):
+        return self.open - (self._idle() if self._idle else 0)
+
+    def track(self, conn):
+        """
+        Starts counting a newly opened connection as open, until it is
+        unbound or garbage collected.
+        """
+        self.opened += 1
+        self.open += 1
+        conn._finalizer = weakref.finalize(conn, self._collected, conn._close_leaked)
+        conn._finalizer.atexit = False
+        conn._stats = self
+
+    def untrack(self, conn):
+        """
+        Stops counting a connection as open, as it is being unbound.
+        """
+        if conn._finalizer.detach() is not None:
+            self.open -= 1
+
+    def _collected(self, close):
+        self.open -= 1
+        self.leaked += 1
+        if self.log:
+            self.log.warning("LDAP connection garbage collected without being unbound")
+        if close is not None:
+            close()
+
+
+async def paged_search(
+    conn,
+    search_base,
+    search_filter,
+    search_scope=ldap3.SUBTREE,
+    attributes=None,
+    page_size=500,
+):
+    """
+    Searches with the simple paged results control, yielding the entries
+    found a page of up to `page_size` entries at a time, so that large
+    results are neither limited by the server's size limit nor held in
+    memory at once.
+    """
+    cookie = None
+    while True:
+        entries, cookie = await conn.search_page(
+            search_base,
+            search_filter,
+            search_scope=search_scope,
+            attributes=attributes,
+            page_size=page_size,
+            cookie=cookie,
+        )
+        yield entries
+        if not cookie:
+            return
+
+
+class _Connection:
+    """
+    The parts shared by SyncConnection and AsyncioConnection.
+
+    Connections are async context managers, unbinding them when exited.
+    """
+
+    _stats = None
+    _tracer = Tracer()
+    # a function closing the connection's socket when garbage collected
+    # without being unbound, that must not reference the connection itself
+    _close_leaked = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.unbind()
+
+    def _untrack(self):
+        if self._stats is not None:
+            self._stats.untrack(self)
+
+    def _count(self, operation):
+        if self._stats is not None:
+            self._stats.count(operation)
+
+    def _check_result(self, operation, result):
+        """
+        Logs a warning if `result`, the result of an LDAP operation as a dict
+        like ldap3's `Connection.result`, isn't success, as a search ended by
+        sizeLimitExceeded, insufficientAccessRights or a referral would
+        otherwise look like one without entries.
+        """
+        if not result or result["result"] == 0:
+            return
+        if self._stats is not None and self._stats.log:
+            self._stats.log.warning(
+                "LDAP %s on %s ended with %s%s",
+                operation,
+                self.server,
+                result["description"],
+                f" - {result['message']}" if result.get("message") else "",
+            )
+
+    def _trace(
+        self, operation, base=None, scope=None, search_filter=None, attribute=None
+    ):
+        """
+        Returns a context manager for the span of an LDAP operation, as
+        described in `ldapauthenticator.tracing`.
+        """
+        attributes = None
+        if self._tracer.enabled:
+            attributes = {"ldap.server": self.server}
+            if base is not None:
+                attributes["ldap.base"] = base
+            if scope is not None:
+                attributes["ldap.scope"] = str(scope).lower()
+            if search_filter is not None:
+                attributes["ldap.filter"] = filter_template(search_filter)
+            if attribute is not None:
+                attributes["ldap.attribute"] = attribute
+        return self._tracer.span(f"ldap.{operation}", attributes)
+
+
+class CoalescingConnection:
+    """
+    Wraps a connection, or a ConnectionPool, so that concurrent identical
+    searches and compares share one request to the LDAP server, via the
+    Singleflight object `singleflight`.
+
+    Requests are only shared among connections with the same `identity`,
+    such as the DN they are bound as, as the results depend on what it is
+    permitted to read.
+    """
+
+    def __init__(self, conn, singleflight, identity):
+        self.conn = conn
+        self.singleflight = singleflight
+        self.identity = identity
+
+    @property
+    def concurrent(self):
+        return getattr(self.conn, "concurrent", False)
+
+    async def search(
+        self, search_base, search_filter, search_scope=ldap3.SUBTREE, attributes=None
+    ):
+        """
+        Returns a list of SearchEntry.
+        """
+        key = (
+            self.identity,
+            "search",
+            search_base,
+            search_scope,
+            search_filter,
+            tuple(attributes) if attributes is not None else None,
+        )
+        return await self.singleflight.run(
+            key,
+            self.conn.search,
+            search_base=search_base,
+            search_filter=search_filter,
+            search_scope=search_scope,
+            attributes=attributes,
+        )
+
+    async def compare(self, dn, attribute, value):
+        """
+        Returns True if `value` is among the values of the entry's
+        `attribute`.
+        """
+        key = (self.identity, "compare", dn, attribute, value)
+        return await self.singleflight.run(key, self.conn.compare, dn, attribute, value)
+
+
+class SyncConnection(_Connection):
+    """
+    Wraps a bound ldap3 Connection.
+
+    `run` is a coroutine function called with a blocking function and its
+    arguments, responsible for running it, for example in a thread pool.
+    """
+
+    def __init__(self, connection, run):
+        self.connection = connection
+        self._run = run
+
+    @property
+    def closed(self):
+        return self.connection.closed
+
+    @property
+    def bound_dn(self):
+        return self.connection.user
+
+    @property
+    def result(self):
+        """The result of the last operation, as a dict."""
+        return self.connection.result
+
+    @property
+    def server(self):
+        return f"{self.connection.server.host}:{self.connection.server.port}"
+
+    def _bytes_received(self):
+        """
+        The bytes received on the connection so far, if counted by ldap3
+        as configured by its `collect_usage` option, or 0.
+        """
+        usage = self.connection.usage
+        return usage.bytes_received if usage is not None else 0
+
+    @property
+    def session_reused(self):
+        """True if TLS was established by resuming a previous session."""
+        return getattr(self.connection.socket, "session_reused", False)
+
+    async def search(
+        self, search_base, search_filter, search_scope=ldap3.SUBTREE, attributes=None
+    ):
+        """
+        Returns a list of SearchEntry.
+        """
+
+        def _search():
+            self.connection.search(
+                search_base=search_base,
+                search_scope=search_scope,
+                search_filter=search_filter,
+                attributes=attributes,
+            )
+            return [
+                SearchEntry(entry.entry_dn, entry.entry_attributes_as_dict)
+                for entry in self.connection.entries
+            ]
+
+        self._count("search")
+        with self._trace("search", search_base, search_scope, search_filter) as span:
+            received = self._bytes_received()
+            entries = await self._run(_search)
+            span.set_attribute("ldap.entries", len(entries))
+            span.set_attribute("ldap.bytes", self._bytes_received() - received)
+        self._check_result("search", self.result)
+        return entries
+
+    async def search_page(
+        self,
+        search_base,
+        search_filter,
+        search_scope=ldap3.SUBTREE,
+        attributes=None,
+        page_size=500,
+        cookie=None,
+    ):
+        """
+        Returns a page of up to `page_size` SearchEntry, and the cookie to
+        pass to get the next page, or None if it was the last one.
+        """
+
+        def _search_page():
+            self.connection.search(
+                search_base=search_base,
+                search_scope=search_scope,
+                search_filter=search_filter,
+                attributes=attributes,
+                paged_size=page_size,
+                paged_cookie=cookie,
+            )
+            entries = [
+                SearchEntry(entry.entry_dn, entry.entry_attributes_as_dict)
+                for entry in self.connection.entries
+            ]
+            control = self.connection.result.get("controls", {}).get(PAGED_RESULTS_OID)
+            return entries, control["value"]["cookie"] if control else None
+
+        self._count("search")
+        with self._trace("search", search_base, search_scope, search_filter) as span:
+            received = self._bytes_received()
+            entries, cookie = await self._run(_search_page)
+            span.set_attribute("ldap.entries", len(entries))
+            span.set_attribute("ldap.bytes", self._bytes_received() - received)
+        self._check_result("search", self.result)
+        return entries, cookie or None
+
+    async def compare(self, dn, attribute, value):
+        """
+        Returns True if `value` is among the values of the entry's
+        `attribute`.
+        """
+        self._count("compare")
+        with self._trace("compare", base=dn, attribute=attribute) as span:
+            received = self._bytes_received()
+            result = await self._run(self.connection.compare, dn, attribute, value)
+            span.set_attribute("ldap.bytes", self._bytes_received() - received)
+        return result
+
+    async def unbind(self):
+        self._untrack()
+        tls = self.connection.server.tls
+        if isinstance(tls, SessionResumingTls) and isinstance(
+            self.connection.socket, ssl.SSLSocket
+        ):
+            # with TLS 1.3, the session to resume is received after the
+            # handshake
+            tls.save_session(self.connection.socket)
+        with self._trace("unbind"):
+            await self._run(self.connection.unbind)
+
+
+class _LDAPProtocol(asyncio.Protocol):
+    """
+    Splits the byte stream from the server into LDAP messages and hands them
+    to the request they respond to.
+
+    TLS is implemented here on top of a plain transport rather than by
+    asyncio, as asyncio doesn't support resuming a previous TLS session.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.closed = None
+        self.ssl_object = None
+        self._buffer = bytearray()
+        self._requests = {}
+        self._incoming = None
+        self._outgoing = None
+        self._handshake = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        if self.ssl_object is None:
+            self._message_data_received(data)
+            return
+        self._incoming.write(data)
+        if not self._handshake.done():
+            self._do_handshake()
+            if not self._handshake.done():
+                return
+        chunks = []
+        try:
+            while True:
+                chunk = self.ssl_object.read(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except ssl.SSLWantReadError:
+            pass
+        except ssl.SSLError as e:
+            self._flush()
+            self._abort(LDAPSessionTerminatedByServerError(f"TLS error: {e}"))
+            return
+        self._flush()
+        if chunks:
+            self._message_data_received(b"".join(chunks))
+
+    def _message_data_received(self, data):
+        self._buffer.extend(data)
+        while True:
+            size = BaseStrategy.compute_ldap_message_size(self._buffer)
+            if size == -1 or len(self._buffer) < size:
+                return
+            message = decode_message_fast(bytes(self._buffer[:size]))
+            del self._buffer[:size]
+            if message["messageID"] == 0:
+                # an unsolicited notification, only ever sent by a server
+                # about to close the connection
+                self._fail_all(
+                    LDAPSessionTerminatedByServerError("session terminated by server")
+                )
+                continue
+            request = self._requests.get(message["messageID"])
+            if request is not None:
+                request.bytes_received += size
+                request.message_received(message)
+                if request.future.done():
+                    del self._requests[message["messageID"]]
+
+    def connection_lost(self, exc):
+        self.closed = LDAPSessionTerminatedByServerError(
+            f"session terminated by server{f': {exc}' if exc else ''}"
+        )
+        if self._handshake is not None and not self._handshake.done():
+            self._handshake.set_exception(
+                ssl.SSLError(f"connection lost during TLS handshake: {exc}")
+            )
+        self._fail_all(self.closed)
+
+    def _abort(self, exc):
+        self.closed = exc
+        self._fail_all(exc)
+        self.transport.abort()
+
+    def _fail_all(self, exc):
+        requests, self._requests = self._requests, {}
+        for request in requests.values():
+            if not request.future.done():
+                request.future.set_exception(exc)
+
+    async def start_tls(self, context, server_hostname=None, session=None):
+        """
+        Performs a TLS handshake, resuming `session` if possible, after which
+        all data sent and received is encrypted.
+        """
+        self._incoming = ssl.MemoryBIO()
+        self._outgoing = ssl.MemoryBIO()
+        self.ssl_object = context.wrap_bio(
+            self._incoming,
+            self._outgoing,
+            server_side=False,
+            server_hostname=server_hostname,
+            session=session,
+        )
+        self._handshake = asyncio.get_running_loop().create_future()
+        self._do_handshake()
+        await self._handshake
+
+    def _do_handshake(self):
+        try:
+            self.ssl_object.do_handshake()
+        except ssl.SSLWantReadError:
+            self._flush()
+            return
+        except ssl.SSLError as e:
+            self._flush()
+            self._handshake.set_exception(e)
+            return
+        self._flush()
+        self._handshake.set_result(None)
+
+    def _flush(self):
+        data = self._outgoing.read()
+        if data and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def write(self, data):
+        if self.ssl_object is None:
+            self.transport.write(data)
+        else:
+            self.ssl_object.write(data)
+            self._flush()
+
+    def send(self, message_id, data, request):
+        if self.closed:
+            raise self.closed
+        self._requests[message_id] = request
+        self.write(data)
+
+
+class _Request:
+    """
+    Collects the response messages to one request, resolving `future` once
+    the final one has been received.
+    """
+
+    def __init__(self, loop):
+        self.future = loop.create_future()
+        self.entries = []
+        self.bytes_received = 0
+
+    def message_received(self, message):
+        operation = message["protocolOp"]
+        payload = message["payload"]
+        if operation == _SEARCH_RESULT_ENTRY:
+            self.entries.append(
+                search_result_entry_response_to_dict_fast(payload, None, None, False)
+            )
+        elif operation == _SEARCH_RESULT_REFERENCE:
+            pass  # referrals are not followed
+        else:
+            if operation == _BIND_RESPONSE:
+                result = bind_response_to_dict_fast(payload)
+            elif operation == _EXTENDED_RESPONSE:
+                result = extended_response_to_dict_fast(payload)
+            else:
+                result = ldap_result_to_dict_fast(payload)
+            result["controls"] = {}
+            for control in message["controls"] or []:
+                oid, control = BaseStrategy.decode_control_fast(control[3])
+                result["controls"][oid] = control
+            if not self.future.done():
+                self.future.set_result(result)
+
+
+def ssl_context_from_tls(tls):
+    """
+    Returns an ssl.SSLContext configured like ldap3 configures one from a
+    ldap3 Tls object when wrapping a socket.
+    """
+    if tls.version is None:
+        context = ssl.create_default_context(
+            purpose=ssl.Purpose.SERVER_AUTH,
+            cafile=tls.ca_certs_file,
+            capath=tls.ca_certs_path,
+            cadata=tls.ca_certs_data,
+        )
+    else:
+        context = ssl.SSLContext(tls.version)
+        if tls.ca_certs_file or tls.ca_certs_path or tls.ca_certs_data:
+            context.load_verify_locations(
+                tls.ca_certs_file, tls.ca_certs_path, tls.ca_certs_data
+            )
+        elif tls.validate != ssl.CERT_NONE:
+            context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    if tls.certificate_file:
+        context.load_cert_chain(
+            tls.certificate_file,
+            keyfile=tls.private_key_file,
+            password=tls.private_key_password,
+        )
+    context.check_hostname = False
+    context.verify_mode = tls.validate
+    for option in tls.ssl_options:
+        context.options |= option
+    if tls.ciphers:
+        try:
+            context.set_ciphers(tls.ciphers)
+        except ssl.SSLError:
+            pass
+    return context
+
+
+class SessionResumingTls(Tls):
+    """
+    A ldap3 Tls object building its SSLContext once, and resuming the TLS
+    session of a previous connection when establishing TLS for a new one, so
+    that the full TLS handshake can be skipped.
+
+    It is used both by ldap3 Connection objects, for which it replaces the
+    ldap3 implementation of wrapping sockets, and by AsyncioConnection.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.ssl_context = ssl_context_from_tls(self)
+        self.session = None
+
+    def save_session(self, ssl_object):
+        """
+        Remembers the TLS session of a SSLSocket or SSLObject, to be resumed
+        by the next connection.
+        """
+        session = getattr(ssl_object, "session", None)
+        if session is not None:
+            self.session = session
+
+    def wrap_socket(self, connection, do_handshake=False):
+        """
+        Adds TLS to the socket of a ldap3 Connection.
+        """
+        wrapped_socket = self.ssl_context.wrap_socket(
+            connection.socket,
+            server_side=False,
+            do_handshake_on_connect=do_handshake,
+            server_hostname=self.sni,
+            session=self.session,
+        )
+        if do_handshake:
+            if self.validate in (ssl.CERT_REQUIRED, ssl.CERT_OPTIONAL):
+                check_hostname(wrapped_socket, connection.server.host, self.valid_names)
+            self.save_session(wrapped_socket)
+        connection.socket = wrapped_socket
+
+
+class AsyncioConnection(_Connection):
+    """
+    A connection to an LDAP server driven by the asyncio event loop.
+
+    Use the `open` classmethod to create one. Several operations can be in
+    flight on the same connection at the same time.
+
+    If a response doesn't arrive within `receive_timeout` seconds, the
+    connection is aborted, failing all operations in flight on it.
+
+    Like ldap3's `Connection.result`, `result` is the result of the last
+    operation completed, as a dict.
+    """
+
+    concurrent = True
+
+    def __init__(self, host, protocol, receive_timeout=None, port=None):
+        self.host = host
+        self.port = port
+        self._protocol = protocol
+        self.receive_timeout = receive_timeout
+        self._message_id = 0
+        self._tls = None
+        self.bound_dn = None
+        self.result = None
+
+    @property
+    def _close_leaked(self):
+        return self._protocol.transport.close
+
+    @property
+    def server(self):
+        return f"{self.host}:{self.port}"
+
+    @property
+    def closed(self):
+        return (
+            self._protocol.closed is not None or self._protocol.transport.is_closing()
+        )
+
+    @property
+    def session_reused(self):
+        """True if TLS was established by resuming a previous session."""
+        ssl_object = self._protocol.ssl_object
+        return ssl_object is not None and ssl_object.session_reused
+
+    @classmethod
+    async def open(
+        cls,
+        host,
+        port,
+        tls=None,
+        use_ssl=False,
+        connect_timeout=None,
+        receive_timeout=None,
+        tracer=None,
+    ):
+        """
+        Opens a connection to host:port, directly establishing TLS configured
+        by the SessionResumingTls object `tls` if use_ssl is True, within
+        `connect_timeout` seconds.
+
+        Its operations are traced by `tracer` if provided, a tracer from
+        `ldapauthenticator.tracing`.
+
+        Raises LDAPSocketOpenError if the connection can't be established.
+        """
+        tracer = tracer or cls._tracer
+        loop = asyncio.get_running_loop()
+        attributes = {"ldap.server": f"{host}:{port}"} if tracer.enabled else None
+        with tracer.span("ldap.connect", attributes):
+            try:
+                _, protocol = await asyncio.wait_for(
+                    loop.create_connection(_LDAPProtocol, host, port), connect_timeout
+                )
+            except asyncio.TimeoutError:
+                raise LDAPSocketOpenError(
+                    f"socket connection error while opening: timed out after {connect_timeout}s"
+                )
+            except OSError as e:
+                raise LDAPSocketOpenError(f"socket connection error while opening: {e}")
+        conn = cls(host, protocol, receive_timeout=receive_timeout, port=port)
+        conn._tracer = tracer
+        if use_ssl:
+            try:
+                with conn._trace("tls"):
+                    await conn._establish_tls(tls, timeout=connect_timeout)
+            except (OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+                protocol.transport.close()
+                raise LDAPSocketOpenError(
+                    f"socket ssl wrapping error: {e or 'handshake timed out'}"
+                )
+        return conn
+
+    async def _establish_tls(self, tls, timeout=None):
+        await asyncio.wait_for(
+            self._protocol.start_tls(
+                tls.ssl_context, server_hostname=tls.sni, session=tls.session
+            ),
+            timeout,
+        )
+        self._tls = tls
+        if tls.validate in (ssl.CERT_REQUIRED, ssl.CERT_OPTIONAL):
+            check_hostname(self._protocol.ssl_object, self.host, tls.valid_names)
+        tls.save_session(self._protocol.ssl_object)
+
+    async def _request(self, message_type, request, controls=None, span=None):
+        self._message_id += 1
+        message_id = self._message_id
+        message = LDAPMessage()
+        message["messageID"] = MessageID(message_id)
+        message["protocolOp"] = ProtocolOp().setComponentByName(message_type, request)
+        message_controls = build_controls_list(controls)
+        if message_controls is not None:
+            message["controls"] = message_controls
+        pending = _Request(asyncio.get_running_loop())
+        self._protocol.send(message_id, encode(message), pending)
+        try:
+            result = await asyncio.wait_for(pending.future, self.receive_timeout)
+        except asyncio.TimeoutError:
+            # the connection can't be trusted to be in sync with the server
+            # anymore
+            error = LDAPSocketReceiveError(
+                f"no response received within {self.receive_timeout}s"
+            )
+            self._protocol._abort(error)
+            raise error
+        if span is not None:
+            span.set_attribute("ldap.bytes", pending.bytes_received)
+        self.result = result
+        return result, pending.entries
+
+    async def start_tls(self, tls):
+        """
+        Upgrades the connection to TLS configured by the SessionResumingTls
+        object `tls` using the StartTLS extended operation.
+        """
+        with self._trace("tls"):
+            result, _ = await self._request(
+                "extendedReq", extended_operation(START_TLS_OID)
+            )
+            if result["result"] != 0:
+                raise LDAPStartTLSError(f"startTLS failed - {result['description']}")
+            try:
+                await self._establish_tls(tls, timeout=self.receive_timeout)
+            except (OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+                raise LDAPStartTLSError(
+                    f"wrap socket error: {e or 'handshake timed out'}"
+                )
+
+    async def bind(self, user=None, password=None):
+        """
+        Performs a simple bind, or an anonymous bind if user isn't provided.
+
+        Raises LDAPBindError if the server rejects the bind.
+        """
+        authentication = ldap3.SIMPLE if user else ldap3.ANONYMOUS
+        request = bind_operation(3, authentication, user, password, auto_encode=True)
+        with self._trace("bind") as span:
+            result, _ = await self._request("bindRequest", request, span=span)
+            span.set_attribute("ldap.result", result["description"])
+        if result["result"] != 0:
+            raise LDAPBindError(
+                f"automatic bind not successful - {result['description']}"
+            )
+        self.bound_dn = user
+
+    async def search(
+        self, search_base, search_filter, search_scope=ldap3.SUBTREE, attributes=None
+    ):
+        """
+        Returns a list of SearchEntry.
+        """
+        _, entries = await self._search(
+            search_base, search_filter, search_scope, attributes
+        )
+        return entries
+
+    async def search_page(
+        self,
+        search_base,
+        search_filter,
+        search_scope=ldap3.SUBTREE,
+        attributes=None,
+        page_size=500,
+        cookie=None,
+    ):
+        """
+        Returns a page of up to `page_size` SearchEntry, and the cookie to
+        pass to get the next page, or None if it was the last one.
+        """
+        result, entries = await self._search(
+            search_base,
+            search_filter,
+            search_scope,
+            attributes,
+            controls=[paged_search_control(False, page_size, cookie)],
+        )
+        control = result["controls"].get(PAGED_RESULTS_OID)
+        return entries, (control["value"]["cookie"] or None) if control else None
+
+    async def _search(
+        self, search_base, search_filter, search_scope, attributes, controls=None
+    ):
+        if not attributes:
+            attributes = [ldap3.NO_ATTRIBUTES]
+        elif attributes == ldap3.ALL_ATTRIBUTES:
+            attributes = [ldap3.ALL_ATTRIBUTES]
+        request = search_operation(
+            search_base,
+            search_filter,
+            search_scope,
+            ldap3.DEREF_ALWAYS,
+            attributes,
+            0,
+            0,
+            False,
+            True,
+            True,
+            None,
+            None,
+            False,
+        )
+        self._count("search")
+        with self._trace("search", search_base, search_scope, search_filter) as span:
+            result, entries = await self._request(
+                "searchRequest", request, controls, span=span
+            )
+            span.set_attribute("ldap.entries", len(entries))
+        self._check_result("search", result)
+        return result, [
+            SearchEntry(
+                entry["dn"],
+                {name: list(values) for name, values in entry["attributes"].items()},
+            )
+            for entry in entries
+        ]
+
+    async def compare(self, dn, attribute, value):
+        """
+        Returns True if `value` is among the values of the entry's
+        `attribute`.
+        """
+        request = compare_operation(dn, attribute, value, True)
+        self._count("compare")
+        with self._trace("compare", base=dn, attribute=attribute) as span:
+            result, _ = await self._request("compareRequest", request, span=span)
+        return result["result"] == _COMPARE_TRUE
+
+    async def unbind(self):
+        """
+        Sends an unbind request and closes the connection.
+        """
+        self._untrack()
+        if self._tls is not None:
+            # with TLS 1.3, the session to resume is received after the
+            # handshake
+            self._tls.save_session(self._protocol.ssl_object)
+        transport = self._protocol.transport
+        with self._trace("unbind"):
+            if not self.closed:
+                self._message_id += 1
+                message = LDAPMessage()
+                message["messageID"] = MessageID(self._message_id)
+                message["protocolOp"] = ProtocolOp().setComponentByName(
+                    "unbindRequest", unbind_operation()
+                )
+                self._protocol.write(encode(message))
+            transport.close()
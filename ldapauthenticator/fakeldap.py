@@ -0,0 +1,887 @@
+"""
+An in-process stand-in for an LDAP server, for tests, benchmarks and load
+tests.
+
+`FakeLDAPServer` serves a small in-memory directory over a real TCP socket
+speaking the LDAP wire protocol, so both of LDAPAuthenticator's client modes,
+StartTLS and LDAPS can be exercised without Docker or network access. It
+implements the subset of LDAPv3 that LDAPAuthenticator relies on: simple
+binds, searches (including paged results and ranged attribute retrieval),
+compare, StartTLS and WhoAmI. ldap3's mock strategies aren't used, as they
+can't serve the "asyncio" client mode, which speaks LDAP on its own.
+"""
+
+import datetime
+import itertools
+import re
+import socket
+import socketserver
+import ssl
+import tempfile
+import threading
+import time
+
+from ldap3.utils.dn import parse_dn
+
+START_TLS_OID = "1.3.6.1.4.1.1466.20037"
+WHO_AM_I_OID = "1.3.6.1.4.1.4203.1.11.3"
+PAGED_RESULTS_OID = "1.2.840.113556.1.4.319"
+IN_CHAIN_OID = "1.2.840.113556.1.4.1941"
+
+PLANETEXPRESS_BASE_DN = "dc=planetexpress,dc=com"
+_PEOPLE = "ou=people," + PLANETEXPRESS_BASE_DN
+
+# LDAP result codes used by the server
+SUCCESS = 0
+OPERATIONS_ERROR = 1
+PROTOCOL_ERROR = 2
+COMPARE_FALSE = 5
+COMPARE_TRUE = 6
+NO_SUCH_ATTRIBUTE = 16
+NO_SUCH_OBJECT = 32
+INVALID_DN_SYNTAX = 34
+INVALID_CREDENTIALS = 49
+UNWILLING_TO_PERFORM = 53
+
+
+def planetexpress_entries():
+    """
+    Returns (dn, attributes) pairs mirroring the data of the
+    rroemhild/docker-test-openldap image that the test suite is written
+    against.
+    """
+    people = [
+        {
+            "cn": "Hubert J. Farnsworth",
+            "sn": "Farnsworth",
+            "description": "Human",
+            "displayName": "Professor Farnsworth",
+            "employeeType": ["Owner", "Founder"],
+            "givenName": "Hubert",
+            "mail": ["professor@planetexpress.com", "hubert@planetexpress.com"],
+            "ou": "Office Management",
+            "title": "Professor",
+            "uid": "professor",
+        },
+        {
+            "cn": "Philip J. Fry",
+            "sn": "Fry",
+            "description": "Human",
+            "displayName": "Fry",
+            "employeeType": "Delivery boy",
+            "givenName": "Philip",
+            "mail": "fry@planetexpress.com",
+            "ou": "Delivering Crew",
+            "uid": "fry",
+        },
+        {
+            "cn": "John A. Zoidberg",
+            "sn": "Zoidberg",
+            "description": "Decapodian",
+            "displayName": "Zoidberg",
+            "employeeType": "Doctor",
+            "givenName": "John",
+            "mail": "zoidberg@planetexpress.com",
+            "ou": "Staff",
+            "title": "Ph. D.",
+            "uid": "zoidberg",
+        },
+        {
+            "cn": "Hermes Conrad",
+            "sn": "Conrad",
+            "description": "Human",
+            "employeeType": ["Bureaucrat", "Accountant"],
+            "givenName": "Hermes",
+            "mail": "hermes@planetexpress.com",
+            "ou": "Office Management",
+            "uid": "hermes",
+        },
+        {
+            "cn": "Turanga Leela",
+            "sn": "Turanga",
+            "description": "Mutant",
+            "employeeType": ["Captain", "Pilot"],
+            "givenName": "Leela",
+            "mail": "leela@planetexpress.com",
+            "ou": "Delivering Crew",
+            "uid": "leela",
+        },
+        {
+            "cn": "Bender Bending Rodríguez",
+            "sn": "Rodríguez",
+            "description": "Robot",
+            "employeeType": "Ship's Robot",
+            "givenName": "Bender",
+            "mail": "bender@planetexpress.com",
+            "ou": "Delivering Crew",
+            "uid": "bender",
+        },
+        {
+            "cn": "Amy Wong",
+            "sn": "Kroker",
+            "description": "Human",
+            "employeeType": "Intern",
+            "givenName": "Amy",
+            "mail": "amy@planetexpress.com",
+            "ou": "Intern",
+            "uid": "amy",
+        },
+    ]
+    groups = {
+        "admin_staff": ["Hubert J. Farnsworth", "Hermes Conrad"],
+        "ship_crew": ["Turanga Leela", "Philip J. Fry", "Bender Bending Rodríguez"],
+    }
+
+    entries = [
+        (
+            PLANETEXPRESS_BASE_DN,
+            {"objectClass": ["top", "dcObject", "organization"], "dc": "planetexpress"},
+        ),
+        (_PEOPLE, {"objectClass": ["top", "organizationalUnit"], "ou": "people"}),
+        (
+            f"cn=admin,{PLANETEXPRESS_BASE_DN}",
+            {
+                "objectClass": ["simpleSecurityObject", "organizationalRole"],
+                "cn": "admin",
+                "userPassword": "GoodNewsEveryone",
+            },
+        ),
+    ]
+    for person in people:
+        attributes = {
+            "objectClass": ["top", "person", "organizationalPerson", "inetOrgPerson"],
+            "userPassword": person["uid"],
+            **person,
+        }
+        entries.append((f"cn={person['cn']},{_PEOPLE}", attributes))
+    for group, members in groups.items():
+        entries.append(
+            (
+                f"cn={group},{_PEOPLE}",
+                {
+                    "objectClass": ["top", "Group"],
+                    "cn": group,
+                    "member": [f"cn={cn},{_PEOPLE}" for cn in members],
+                },
+            )
+        )
+    return entries
+
+
+def normalize_dn(dn):
+    """
+    Returns a DN in a form where equal DNs compare equal as strings.
+    """
+    return ",".join(
+        f"{attr.lower()}={' '.join(value.split()).lower()}"
+        for attr, value, _ in parse_dn(dn, escape=False, strip=True)
+    )
+
+
+def _normalize_value(value):
+    if isinstance(value, bytes):
+        try:
+            value = value.decode("utf-8")
+        except UnicodeDecodeError:
+            return value
+    return " ".join(value.split()).lower()
+
+
+# --- BER encoding and decoding ----------------------------------------------
+#
+# Only definite lengths are supported, which is all LDAP allows.
+#
+
+
+def ber_read(data, offset=0):
+    """
+    Reads one TLV from data at offset, returning (tag, value, next_offset).
+    """
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        n = length & 0x7F
+        length = int.from_bytes(data[offset : offset + n], "big")
+        offset += n
+    return tag, data[offset : offset + length], offset + length
+
+
+def ber_children(value):
+    children = []
+    offset = 0
+    while offset < len(value):
+        tag, child, offset = ber_read(value, offset)
+        children.append((tag, child))
+    return children
+
+
+def ber_message_size(data):
+    """
+    Returns the size of the first complete BER element in data, or None if
+    more data is needed to tell.
+    """
+    if len(data) < 2:
+        return None
+    length = data[1]
+    if not length & 0x80:
+        return 2 + length
+    n = length & 0x7F
+    if len(data) < 2 + n:
+        return None
+    return 2 + n + int.from_bytes(data[2 : 2 + n], "big")
+
+
+def ber(tag, value):
+    if isinstance(value, (list, tuple)):
+        value = b"".join(value)
+    length = len(value)
+    if length < 0x80:
+        header = bytes([tag, length])
+    else:
+        length_bytes = length.to_bytes((length.bit_length() + 7) // 8, "big")
+        header = bytes([tag, 0x80 | len(length_bytes)]) + length_bytes
+    return header + value
+
+
+def ber_int(value, tag=0x02):
+    length = max(1, (value.bit_length() + 8) // 8)
+    return ber(tag, value.to_bytes(length, "big", signed=True))
+
+
+def ber_str(value, tag=0x04):
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return ber(tag, value)
+
+
+def _decode_int(value):
+    return int.from_bytes(value, "big", signed=True)
+
+
+def _decode_filter(tag, value):
+    """
+    Decodes a BER encoded search filter into nested tuples.
+    """
+    if tag == 0xA0:
+        return ("and", [_decode_filter(*c) for c in ber_children(value)])
+    if tag == 0xA1:
+        return ("or", [_decode_filter(*c) for c in ber_children(value)])
+    if tag == 0xA2:
+        return ("not", _decode_filter(*ber_children(value)[0]))
+    if tag in (0xA3, 0xA5, 0xA6, 0xA8):
+        (_, attr), (_, assertion) = ber_children(value)
+        kind = {0xA3: "eq", 0xA5: "ge", 0xA6: "le", 0xA8: "eq"}[tag]
+        return (kind, attr.decode(), assertion)
+    if tag == 0xA4:
+        (_, attr), (_, substrings) = ber_children(value)
+        parts = [(t & 0x1F, v) for t, v in ber_children(substrings)]
+        return ("substrings", attr.decode(), parts)
+    if tag == 0x87:
+        return ("present", value.decode())
+    if tag == 0xA9:
+        rule = attr = None
+        assertion = b""
+        for t, v in ber_children(value):
+            if t == 0x81:
+                rule = v.decode()
+            elif t == 0x82:
+                attr = v.decode()
+            elif t == 0x83:
+                assertion = v
+        return ("extensible", attr, rule, assertion)
+    raise ValueError(f"unsupported filter tag {tag:#x}")
+
+
+class _Entry:
+    def __init__(self, dn, attributes):
+        self.dn = dn
+        self.normalized_dn = normalize_dn(dn) if dn else ""
+        # attribute name (lowercase) -> (name, [bytes values])
+        self.attributes = {}
+        for name, values in attributes.items():
+            self.set(name, values)
+        for attr, value, _ in parse_dn(dn, escape=False) if dn else []:
+            if attr.lower() not in self.attributes:
+                self.set(attr, [value])
+
+    def set(self, name, values):
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        values = [v if isinstance(v, bytes) else str(v).encode("utf-8") for v in values]
+        if values:
+            self.attributes[name.lower()] = (name, values)
+        else:
+            self.attributes.pop(name.lower(), None)
+
+    def get(self, name):
+        return self.attributes.get(name.lower(), (name, []))[1]
+
+
+class FakeDirectory:
+    """
+    The directory data and LDAP semantics of a `FakeLDAPServer`, without any
+    networking.
+    """
+
+    def __init__(self, entries=None):
+        self.lock = threading.RLock()
+        self.entries = {}
+        self._usn = itertools.count(1)
+        for dn, attributes in planetexpress_entries() if entries is None else entries:
+            self.add(dn, attributes)
+
+    def _stamp(self, entry):
+        entry.set("entryUSN", [str(next(self._usn))])
+        entry.set(
+            "modifyTimestamp",
+            [datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M%S.%fZ")],
+        )
+
+    def add(self, dn, attributes):
+        with self.lock:
+            entry = _Entry(dn, attributes)
+            self._stamp(entry)
+            self.entries[entry.normalized_dn] = entry
+            return entry
+
+    def modify(self, dn, attributes):
+        """
+        Replaces the given attributes' values of an existing entry.
+        """
+        with self.lock:
+            entry = self.entries[normalize_dn(dn)]
+            for name, values in attributes.items():
+                entry.set(name, values)
+            self._stamp(entry)
+
+    def delete(self, dn):
+        with self.lock:
+            self.entries.pop(normalize_dn(dn), None)
+
+    def get(self, dn):
+        return self.entries.get(normalize_dn(dn))
+
+    def bind(self, dn, password):
+        if not dn and not password:
+            return SUCCESS  # anonymous
+        entry = self.get(dn) if dn else None
+        if entry is None or password.encode("utf-8") not in entry.get("userPassword"):
+            return INVALID_CREDENTIALS
+        return SUCCESS
+
+    def compare(self, dn, attr, value):
+        entry = self.get(dn)
+        if entry is None:
+            return NO_SUCH_OBJECT
+        values = entry.get(attr)
+        if not values:
+            return NO_SUCH_ATTRIBUTE
+        return COMPARE_TRUE if self._equals(attr, values, value) else COMPARE_FALSE
+
+    def _equals(self, attr, values, assertion):
+        if attr.lower() in ("member", "uniquemember", "memberof", "entrydn"):
+            try:
+                assertion = normalize_dn(assertion.decode("utf-8"))
+                return any(normalize_dn(v.decode("utf-8")) == assertion for v in values)
+            except Exception:
+                return False
+        assertion = _normalize_value(assertion)
+        return any(_normalize_value(v) == assertion for v in values)
+
+    def member_of(self, entry):
+        """
+        Computes the memberOf values of an entry, like OpenLDAP's memberof
+        overlay does.
+        """
+        return [
+            group.dn
+            for group in self.entries.values()
+            if self._equals("member", group.get("member"), entry.dn.encode("utf-8"))
+        ]
+
+    def _values(self, entry, attr):
+        if attr.lower() == "memberof":
+            return [dn.encode("utf-8") for dn in self.member_of(entry)]
+        if attr.lower() == "entrydn":
+            return [entry.dn.encode("utf-8")]
+        return entry.get(attr)
+
+    def _in_chain(self, entry, attr, target):
+        """
+        Evaluates LDAP_MATCHING_RULE_IN_CHAIN for member and memberOf.
+        """
+        target = normalize_dn(target)
+        if attr.lower() == "memberof":
+            # is entry a (nested) member of the group target?
+            start = entry.normalized_dn
+        else:
+            # is target a (nested) member of the group entry?
+            start = target
+            target = entry.normalized_dn
+        seen = set()
+        frontier = [start]
+        while frontier:
+            current = frontier.pop()
+            for group in self.entries.values():
+                if group.normalized_dn in seen:
+                    continue
+                members = {normalize_dn(v.decode("utf-8")) for v in group.get("member")}
+                if current in members:
+                    if group.normalized_dn == target:
+                        return True
+                    seen.add(group.normalized_dn)
+                    frontier.append(group.normalized_dn)
+        return False
+
+    def matches(self, entry, ldap_filter):
+        kind = ldap_filter[0]
+        if kind == "and":
+            return all(self.matches(entry, f) for f in ldap_filter[1])
+        if kind == "or":
+            return any(self.matches(entry, f) for f in ldap_filter[1])
+        if kind == "not":
+            return not self.matches(entry, ldap_filter[1])
+        if kind == "present":
+            return bool(self._values(entry, ldap_filter[1]))
+        if kind == "eq":
+            _, attr, assertion = ldap_filter
+            return self._equals(attr, self._values(entry, attr), assertion)
+        if kind in ("ge", "le"):
+            _, attr, assertion = ldap_filter
+            assertion = _normalize_value(assertion)
+            for value in self._values(entry, attr):
+                value = _normalize_value(value)
+                if value.isdigit() and assertion.isdigit():
+                    value, assertion_ = int(value), int(assertion)
+                else:
+                    assertion_ = assertion
+                if (value >= assertion_) if kind == "ge" else (value <= assertion_):
+                    return True
+            return False
+        if kind == "substrings":
+            _, attr, parts = ldap_filter
+            pattern = ""
+            for position, value in parts:
+                value = re.escape(_normalize_value(value))
+                pattern += value if position == 0 else ".*" + value
+            if parts and parts[-1][0] != 2:
+                pattern += ".*"
+            regex = re.compile(pattern, re.DOTALL)
+            return any(
+                regex.fullmatch(_normalize_value(v)) for v in self._values(entry, attr)
+            )
+        if kind == "extensible":
+            _, attr, rule, assertion = ldap_filter
+            if rule == IN_CHAIN_OID:
+                return self._in_chain(entry, attr, assertion.decode("utf-8"))
+            return self._equals(attr, self._values(entry, attr), assertion)
+        return False
+
+    def search(self, base, scope, ldap_filter, attributes, size_limit=0):
+        """
+        Returns (result_code, [(dn, [(attribute name, values)])]).
+        """
+        with self.lock:
+            if not base:
+                return SUCCESS, [("", self.root_dse())] if scope == 0 else []
+            base_entry = self.get(base)
+            if base_entry is None:
+                return NO_SUCH_OBJECT, []
+            base_dn = base_entry.normalized_dn
+            if scope == 0:
+                candidates = [base_entry]
+            else:
+                candidates = []
+                for entry in self.entries.values():
+                    dn = entry.normalized_dn
+                    if dn == base_dn:
+                        if scope == 2:
+                            candidates.append(entry)
+                    elif dn.endswith("," + base_dn):
+                        relative = dn[: -len(base_dn) - 1]
+                        if scope == 2 or len(parse_dn(relative)) == 1:
+                            candidates.append(entry)
+            results = []
+            for entry in candidates:
+                if self.matches(entry, ldap_filter):
+                    results.append((entry.dn, self._select(entry, attributes)))
+            if size_limit:
+                results = results[:size_limit]
+            return SUCCESS, results
+
+    def _select(self, entry, attributes):
+        requested = [a for a in attributes if a != "1.1"]
+        if "1.1" in attributes and not requested:
+            return []
+        selected = []
+        names = requested or ["*"]
+        for name in names:
+            if name == "*":
+                selected.extend(
+                    (n, v)
+                    for key, (n, v) in entry.attributes.items()
+                    if key not in ("entryusn", "modifytimestamp")
+                )
+            elif name == "+":
+                selected.extend(
+                    (n, v)
+                    for key, (n, v) in entry.attributes.items()
+                    if key in ("entryusn", "modifytimestamp")
+                )
+            else:
+                attr, _, option = name.partition(";")
+                values = self._values(entry, attr)
+                if not values:
+                    continue
+                stored_name = entry.attributes.get(attr.lower(), (attr, None))[0]
+                if option.lower().startswith("range="):
+                    low, _, high = option[len("range=") :].partition("-")
+                    low = int(low)
+                    high = len(values) - 1 if high == "*" else int(high)
+                    if high >= len(values) - 1:
+                        tag = f"{stored_name};range={low}-*"
+                    else:
+                        tag = f"{stored_name};range={low}-{high}"
+                    selected.append((tag, values[low : high + 1]))
+                else:
+                    selected.append((stored_name, values))
+        return selected
+
+    def root_dse(self):
+        """
+        The root DSE, announcing what this server supports. No schema is
+        published, so clients don't spend a round trip fetching one.
+        """
+        return [
+            ("namingContexts", [PLANETEXPRESS_BASE_DN.encode()]),
+            ("supportedLDAPVersion", [b"3"]),
+            ("supportedControl", [PAGED_RESULTS_OID.encode()]),
+            ("supportedExtension", [START_TLS_OID.encode(), WHO_AM_I_OID.encode()]),
+            ("vendorName", [b"ldapauthenticator"]),
+        ]
+
+
+def _self_signed_certificate(directory):
+    """
+    Writes a throwaway self-signed certificate and key to directory, and
+    returns their paths.
+    """
+    try:
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.x509.oid import NameOID
+    except ImportError:
+        raise ImportError(
+            "The LDAP stand-in requires the cryptography package, installed "
+            "with: pip install 'jupyterhub-ldapauthenticator[loadtest]'"
+        ) from None
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = f"{directory}/cert.pem"
+    key_path = f"{directory}/key.pem"
+    with open(cert_path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    return cert_path, key_path
+
+
+def _result(tag, code, message="", extra=b""):
+    return ber(tag, [ber_int(code, 0x0A), ber_str(""), ber_str(message), extra])
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """
+    Serves one client connection.
+    """
+
+    def setup(self):
+        self.fake = self.server.fake
+        self.directory = self.fake.directory
+        self.sock = self.request
+        # responses are sent as several small messages
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = b""
+        self.bound_dn = ""
+        self.paged = {}
+        self.fake._count("connections_opened")
+
+    def finish(self):
+        self.fake._count("connections_closed")
+
+    def handle(self):
+        try:
+            if self.sock.recv(1, socket.MSG_PEEK) == b"\x16":
+                # a TLS ClientHello, i.e. LDAPS
+                self.sock = self.fake.ssl_context.wrap_socket(
+                    self.sock, server_side=True
+                )
+            while True:
+                message = self._read_message()
+                if message is None or not self._dispatch(message):
+                    return
+        except (OSError, ssl.SSLError):
+            return
+
+    def _read_message(self):
+        while True:
+            size = ber_message_size(self.buffer)
+            if size is not None and len(self.buffer) >= size:
+                data, self.buffer = self.buffer[:size], self.buffer[size:]
+                return data
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                return None
+            self.buffer += chunk
+
+    def _send(self, message_id, operation, controls=b""):
+        data = ber(0x30, [ber_int(message_id), operation, controls])
+        self.fake._count("bytes_sent", len(data))
+        self.sock.sendall(data)
+
+    def _dispatch(self, data):
+        _, message, _ = ber_read(data)
+        children = ber_children(message)
+        message_id = _decode_int(children[0][1])
+        tag, request = children[1]
+        controls = {}
+        if len(children) > 2 and children[2][0] == 0xA0:
+            for _, control in ber_children(children[2][1]):
+                parts = ber_children(control)
+                oid = parts[0][1].decode()
+                value = parts[-1][1] if parts[-1][0] == 0x04 and len(parts) > 1 else b""
+                controls[oid] = value
+
+        operation = {
+            0x60: "bind",
+            0x42: "unbind",
+            0x63: "search",
+            0x6E: "compare",
+            0x50: "abandon",
+            0x77: "extended",
+        }.get(tag, "unknown")
+        self.fake._record(operation)
+
+        if operation == "unbind":
+            return False
+        if operation == "abandon":
+            return True
+        if operation == "bind":
+            _, name, auth = ber_children(request)
+            dn = name[1].decode("utf-8")
+            if auth[0] != 0x80:
+                code = UNWILLING_TO_PERFORM
+            else:
+                code = self.directory.bind(dn, auth[1].decode("utf-8"))
+            if code == SUCCESS:
+                self.bound_dn = dn
+            self._send(message_id, _result(0x61, code))
+        elif operation == "search":
+            self._search(message_id, request, controls)
+        elif operation == "compare":
+            (_, dn), (_, ava) = ber_children(request)
+            (_, attr), (_, value) = ber_children(ava)
+            code = self.directory.compare(dn.decode("utf-8"), attr.decode(), value)
+            self._send(message_id, _result(0x6F, code))
+        elif operation == "extended":
+            parts = ber_children(request)
+            name = parts[0][1].decode()
+            if name == START_TLS_OID:
+                self._send(
+                    message_id, _result(0x78, SUCCESS, extra=ber_str(name, 0x8A))
+                )
+                self.sock = self.fake.ssl_context.wrap_socket(
+                    self.sock, server_side=True
+                )
+            elif name == WHO_AM_I_OID:
+                identity = f"dn:{self.bound_dn}" if self.bound_dn else ""
+                self._send(
+                    message_id,
+                    _result(0x78, SUCCESS, extra=ber_str(identity, 0x8B)),
+                )
+            else:
+                self._send(message_id, _result(0x78, PROTOCOL_ERROR, name))
+        else:
+            self._send(
+                message_id,
+                _result(0x78, PROTOCOL_ERROR, "operation not supported"),
+            )
+        return True
+
+    def _search(self, message_id, request, controls):
+        parts = ber_children(request)
+        base = parts[0][1].decode("utf-8")
+        scope = _decode_int(parts[1][1])
+        size_limit = _decode_int(parts[3][1])
+        try:
+            ldap_filter = _decode_filter(*parts[6])
+        except ValueError as e:
+            self._send(message_id, _result(0x65, PROTOCOL_ERROR, str(e)))
+            return
+        attributes = [v.decode() for _, v in ber_children(parts[7][1])]
+        code, results = self.directory.search(
+            base, scope, ldap_filter, attributes, size_limit
+        )
+
+        response_controls = b""
+        if PAGED_RESULTS_OID in controls:
+            (_, size), (_, cookie) = ber_children(
+                ber_read(controls[PAGED_RESULTS_OID])[1]
+            )
+            size = _decode_int(size)
+            offset = self.paged.pop(cookie, 0) if cookie else 0
+            total = len(results)
+            results = results[offset : offset + size]
+            next_cookie = b""
+            if offset + size < total:
+                next_cookie = str(message_id).encode()
+                self.paged[next_cookie] = offset + size
+            value = ber(0x30, [ber_int(total), ber_str(next_cookie)])
+            response_controls = ber(
+                0xA0, ber(0x30, [ber_str(PAGED_RESULTS_OID), ber_str(value)])
+            )
+
+        for dn, attributes in results:
+            self._send(
+                message_id,
+                ber(
+                    0x64,
+                    [
+                        ber_str(dn),
+                        ber(
+                            0x30,
+                            [
+                                ber(
+                                    0x30,
+                                    [
+                                        ber_str(name),
+                                        ber(0x31, [ber_str(v) for v in values]),
+                                    ],
+                                )
+                                for name, values in attributes
+                            ],
+                        ),
+                    ],
+                ),
+            )
+        self._send(message_id, _result(0x65, code), response_controls)
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeLDAPServer:
+    """
+    An LDAP server serving a `FakeDirectory` from background threads of the
+    current process, holding `entries` or the planetexpress data by default.
+
+    `latency` can be a number of seconds to delay every operation with, or a
+    dict mapping operation names (`bind`, `search`, `compare`, `extended`,
+    `unbind`) to delays, simulating a directory further away. LDAPS and
+    StartTLS are served on the same port, using a self-signed certificate
+    and key generated when the server is started, which requires the
+    cryptography package.
+
+    The operations served are counted by name in `operations`, and
+    connections and bytes sent in `stats`.
+    """
+
+    def __init__(self, entries=None, host="127.0.0.1", port=0, latency=None):
+        self.host = host
+        self.requested_port = port
+        self.latency = latency or 0
+        self.directory = FakeDirectory(entries)
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+        self.ssl_context = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def operations(self):
+        """
+        Counts of operations served, by operation name.
+        """
+        with self.stats_lock:
+            return {
+                k[len("op_") :]: v for k, v in self.stats.items() if k.startswith("op_")
+            }
+
+    def _count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + n
+
+    def _record(self, operation):
+        self._count("op_" + operation)
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(operation, 0)
+        if latency:
+            time.sleep(latency)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {}
+
+    def start(self):
+        if self.ssl_context is None:
+            # created before serving, so that a missing cryptography package
+            # is reported here rather than as failing handshakes
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            with tempfile.TemporaryDirectory() as directory:
+                context.load_cert_chain(*_self_signed_certificate(directory))
+            self.ssl_context = context
+        self._server = _ThreadingServer((self.host, self.requested_port), _Handler)
+        self._server.fake = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-ldap", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python -m ldapauthenticator.fakeldap [port ...]
+    servers = [FakeLDAPServer(port=int(p)).start() for p in sys.argv[1:] or [0]]
+    print(f"Serving {PLANETEXPRESS_BASE_DN} on", [s.port for s in servers], flush=True)
+    threading.Event().wait()
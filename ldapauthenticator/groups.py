@@ -0,0 +1,501 @@
+"""
+Strategies for LDAPAuthenticator to determine which of the groups in
+`allowed_groups` a user is a member of.
+"""
+
+import asyncio
+import enum
+import random
+import re
+import time
+
+import ldap3
+from ldap3.utils.conv import escape_filter_chars
+from ldap3.utils.dn import parse_dn
+
+from .cache import TTLCache
+
+# LDAP_MATCHING_RULE_IN_CHAIN, matching values of DN attributes through any
+# number of levels of nesting, supported by Active Directory
+IN_CHAIN_OID = "1.2.840.113556.1.4.1941"
+
+
+class GroupMembershipStrategy(enum.Enum):
+    """
+    Represents how LDAPAuthenticator determines the groups a user is a member
+    of.
+    """
+
+    per_group_search = 1
+    combined_search = 2
+    compare = 3
+    member_of = 4
+
+
+# an attribute name with Active Directory's range option, as returned when
+# an attribute has too many values to be returned at once
+_RANGED_ATTRIBUTE = re.compile(
+    r"^(?P<name>[^;]+);range=(?P<low>\d+)-(?P<high>\d+|\*)$", re.IGNORECASE
+)
+
+
+class NestedGroupMembership(enum.Enum):
+    """
+    Represents how LDAPAuthenticator determines if a user is a member of a
+    group through groups that are members of it.
+    """
+
+    none = 1
+    in_chain = 2
+    client_side = 3
+
+
+_DN_ESCAPE = re.compile(rb"\\([0-9a-fA-F]{2})|\\(.)")
+
+
+def _unescape_dn_value(value):
+    # hex escapes represent bytes of UTF-8 encoded characters
+    unescaped = _DN_ESCAPE.sub(
+        lambda m: bytes.fromhex(m[1].decode()) if m[1] else m[2],
+        value.encode("utf-8"),
+    )
+    return unescaped.decode("utf-8", "replace")
+
+
+def normalize_dn(dn):
+    """
+    Returns a DN in a form where DNs differing only in letter case, spacing
+    or escaping compare equal.
+    """
+    return "".join(
+        f"{attr.lower()}={' '.join(_unescape_dn_value(value).split()).lower()}{sep}"
+        for attr, value, sep in parse_dn(dn, strip=True)
+    )
+
+
+def split_dn(dn):
+    """
+    Returns the attribute type and value pairs of a DN's first RDN, with the
+    values unescaped, and the DN of its parent.
+    """
+    rdn = []
+    components = parse_dn(dn, strip=True)
+    for i, (attr, value, sep) in enumerate(components):
+        rdn.append((attr, _unescape_dn_value(value)))
+        if sep != "+":
+            parent = "".join(f"{a}={v}{s}" for a, v, s in components[i + 1 :])
+            return rdn, parent
+    return rdn, ""
+
+
+def common_base(dns):
+    """
+    Returns the longest DN that all the DNs are below, or "" if there is
+    none.
+    """
+    parents = []
+    for dn in dns:
+        components = parse_dn(split_dn(dn)[1], strip=True)
+        parents.append(
+            [
+                (attr.lower(), value.lower(), attr, value)
+                for attr, value, _ in components
+            ]
+        )
+    if not parents:
+        return ""
+    common = []
+    for components in zip(*(reversed(p) for p in parents)):
+        if any(c[:2] != components[0][:2] for c in components):
+            break
+        common.append(components[0])
+    return ",".join(f"{attr}={value}" for _, _, attr, value in reversed(common))
+
+
+async def _gather(conn, operations):
+    """
+    Awaits the coroutines returned by calling each of `operations`,
+    concurrently if the connection supports multiple operations in flight.
+    """
+    if getattr(conn, "concurrent", False):
+        return await asyncio.gather(*(operation() for operation in operations))
+    return [await operation() for operation in operations]
+
+
+async def per_group_search(conn, groups, search_filter):
+    """
+    Returns the groups matching `search_filter`, searching each group's entry.
+
+    No attributes are requested, so that the responses don't grow with the
+    number of members of the groups.
+    """
+    found = await _gather(
+        conn,
+        [
+            lambda group=group: conn.search(
+                search_base=group,
+                search_scope=ldap3.BASE,
+                search_filter=search_filter,
+                attributes=[ldap3.NO_ATTRIBUTES],
+            )
+            for group in groups
+        ],
+    )
+    return [group for group, entries in zip(groups, found) if entries]
+
+
+async def combined_search(conn, groups, search_filter):
+    """
+    Returns the groups matching `search_filter`, with one search per distinct
+    parent DN of the groups, matching all groups below it by their RDN.
+    """
+    by_parent = {}
+    for group in groups:
+        rdn, parent = split_dn(group)
+        rdn_filter = "".join(
+            f"({attr}={escape_filter_chars(value)})" for attr, value in rdn
+        )
+        if len(rdn) > 1:
+            rdn_filter = f"(&{rdn_filter})"
+        by_parent.setdefault(parent, []).append(rdn_filter)
+
+    found = await _gather(
+        conn,
+        [
+            lambda parent=parent, rdn_filters=rdn_filters: conn.search(
+                search_base=parent,
+                search_scope=ldap3.LEVEL,
+                search_filter=f"(&{search_filter}(|{''.join(rdn_filters)}))",
+                attributes=[ldap3.NO_ATTRIBUTES],
+            )
+            for parent, rdn_filters in by_parent.items()
+        ],
+    )
+    found_dns = {normalize_dn(entry.dn) for entries in found for entry in entries}
+    return [group for group in groups if normalize_dn(group) in found_dns]
+
+
+async def compare(conn, groups, attribute, value):
+    """
+    Returns the groups with `value` among the values of their `attribute`.
+    """
+    found = await _gather(
+        conn,
+        [lambda group=group: conn.compare(group, attribute, value) for group in groups],
+    )
+    return [group for group, is_member in zip(groups, found) if is_member]
+
+
+async def member_of(conn, groups, userdn, attribute):
+    """
+    Returns the groups listed by the user's `attribute`, such as `memberOf`.
+    """
+    entries = await conn.search(
+        search_base=userdn,
+        search_scope=ldap3.BASE,
+        search_filter="(objectClass=*)",
+        attributes=[attribute],
+    )
+    if not entries:
+        return []
+    values = [
+        value
+        async for chunk in attribute_value_chunks(conn, entries[0], attribute)
+        for value in chunk
+    ]
+    return member_of_groups(groups, {attribute: values}, attribute)
+
+
+async def attribute_value_chunks(conn, entry, attribute):
+    """
+    Yields the values of an attribute of a SearchEntry in chunks.
+
+    Active Directory returns at most 1500 values of an attribute at a time,
+    named with a range option such as `member;range=0-1499`, and the next
+    chunk is then requested by searching the entry for `member;range=1500-*`,
+    until one with a range ending in `*` is returned.
+    """
+    values, high = _ranged_values(entry.attributes, attribute)
+    yield values
+    while high is not None and high != "*":
+        entries = await conn.search(
+            search_base=entry.dn,
+            search_scope=ldap3.BASE,
+            search_filter="(objectClass=*)",
+            attributes=[f"{attribute};range={int(high) + 1}-*"],
+        )
+        if not entries:
+            return
+        values, high = _ranged_values(entries[0].attributes, attribute)
+        yield values
+
+
+def _ranged_values(attributes, attribute):
+    """
+    Returns the values of `attribute` among an entry's attributes, and the
+    end of their range if they are only some of them, or None.
+    """
+    for name, values in attributes.items():
+        if isinstance(values, (str, bytes, int)):
+            values = [values]
+        if name.lower() == attribute.lower():
+            return values, None
+        match = _RANGED_ATTRIBUTE.match(name)
+        if match and match["name"].lower() == attribute.lower():
+            return values, match["high"]
+    return [], None
+
+
+def member_of_groups(groups, attributes, attribute):
+    """
+    Returns the groups listed by `attribute` among already fetched attributes
+    of the user's entry.
+    """
+    member_of_dns = {
+        normalize_dn(dn)
+        for name, values in attributes.items()
+        if name.lower() == attribute.lower()
+        for dn in values
+    }
+    return [group for group in groups if normalize_dn(group) in member_of_dns]
+
+
+def _normalize_member(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    value = str(value)
+    try:
+        return normalize_dn(value)
+    except Exception:
+        # not a DN, for example a memberUid value
+        return " ".join(value.split()).lower()
+
+
+def in_chain_filter(attribute, dn):
+    """
+    Returns a filter matching entries with `dn` among the values of their
+    `attribute`, directly or through nested entries, such as groups with a
+    user as a member of a group that is a member of them.
+    """
+    return f"({attribute}:{IN_CHAIN_OID}:={escape_filter_chars(dn)})"
+
+
+class GroupGraph:
+    """
+    Finds the groups that groups are nested in, walking the graph of groups
+    that are members of other groups breadth-first.
+
+    The parents of each group, the groups with its DN among the values of
+    their `member_attribute` below `search_base`, are found with one search
+    per group and remembered for `ttl` seconds for up to `maxsize` groups,
+    so that walks for different users share them. Groups are followed up to
+    `max_depth` levels up.
+
+    `searches` counts the searches made for parents.
+    """
+
+    def __init__(
+        self,
+        search_base,
+        member_attribute="member",
+        ttl=300,
+        maxsize=10000,
+        max_depth=10,
+        timer=time.monotonic,
+    ):
+        self.search_base = search_base
+        self.member_attribute = member_attribute
+        self.max_depth = max_depth
+        self._parents = TTLCache(maxsize, ttl, timer=timer)
+        self.searches = 0
+
+    async def parents(self, conn, group):
+        """
+        Returns the DNs of the groups that `group` is a direct member of.
+        """
+        key = normalize_dn(group)
+        parents = self._parents.get(key)
+        if parents is None:
+            self.searches += 1
+            entries = await conn.search(
+                search_base=self.search_base,
+                search_scope=ldap3.SUBTREE,
+                search_filter=(
+                    f"({self.member_attribute}={escape_filter_chars(group)})"
+                ),
+                attributes=[ldap3.NO_ATTRIBUTES],
+            )
+            parents = [entry.dn for entry in entries]
+            self._parents.set(key, parents)
+        return parents
+
+    async def reachable(self, conn, groups, targets):
+        """
+        Returns the `targets` that are among `groups` or that any of them is
+        nested in, stopping as soon as all have been found.
+        """
+        wanted = {normalize_dn(target) for target in targets}
+        found = set()
+        seen = set()
+        level = []
+        for group in groups:
+            if normalize_dn(group) not in seen:
+                seen.add(normalize_dn(group))
+                level.append(group)
+        depth = 0
+        while level:
+            found.update(wanted & {normalize_dn(group) for group in level})
+            if found == wanted or depth >= self.max_depth:
+                break
+            parents = await _gather(
+                conn, [lambda group=group: self.parents(conn, group) for group in level]
+            )
+            level = []
+            for parent in (dn for dns in parents for dn in dns):
+                if normalize_dn(parent) not in seen:
+                    seen.add(normalize_dn(parent))
+                    level.append(parent)
+            depth += 1
+        return [target for target in targets if normalize_dn(target) in found]
+
+    def clear(self):
+        """
+        Forgets the parents found for all groups.
+        """
+        self._parents.clear()
+
+
+def normalize_members(fetched):
+    """
+    Returns a dict mapping each group to a set of its members' normalized DNs
+    and names, given a dict mapping each group to a dict of its member
+    attributes' values.
+    """
+    return {
+        group: frozenset(
+            _normalize_member(value)
+            for values in attributes.values()
+            for value in values
+        )
+        for group, attributes in fetched.items()
+    }
+
+
+def member_groups(members, groups, userdn, username):
+    """
+    Returns the groups that have the user's DN or username among their
+    members, as returned by `normalize_members`.
+    """
+    user = {normalize_dn(userdn), " ".join(username.split()).lower()}
+    return [group for group in groups if user & members.get(group, frozenset())]
+
+
+class GroupMembershipCache:
+    """
+    Holds the members of groups in memory, refreshed in the background.
+
+    - `fetch` is a coroutine function returning a dict mapping each group to
+      a dict of its member attributes' values, such as `member` and
+      `memberUid`.
+    - Every `ttl` seconds, shortened by a random fraction of up to `jitter`
+      to spread out refreshes, the members are fetched again in the
+      background.
+    - If the members haven't been fetched successfully for `max_staleness`
+      seconds, they are fetched again before being used.
+    """
+
+    def __init__(self, fetch, ttl, max_staleness, jitter=0.1, log=None):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.max_staleness = max(max_staleness, ttl)
+        self.jitter = jitter
+        self.log = log
+        self.members = None
+        self.fetched_at = None
+        self._fetching = None
+        self._refresher = None
+        self._generation = 0
+
+    def _age(self):
+        if self.fetched_at is None:
+            return None
+        return time.monotonic() - self.fetched_at
+
+    async def refresh(self):
+        """
+        Fetches the members of the groups, sharing a fetch already in
+        progress.
+        """
+        if self._fetching is None:
+            self._fetching = asyncio.ensure_future(self._refresh())
+        fetching = self._fetching
+        try:
+            await asyncio.shield(fetching)
+        finally:
+            if self._fetching is fetching and fetching.done():
+                self._fetching = None
+
+    async def _refresh(self):
+        generation = self._generation
+        started = time.monotonic()
+        fetched = await self._fetch()
+        if generation != self._generation:
+            # invalidated while fetching
+            return
+        self.members = normalize_members(fetched)
+        self.fetched_at = started
+
+    async def _refresh_periodically(self):
+        while True:
+            delay = self.ttl * (1 - self.jitter * random.random())
+            age = self._age() or 0
+            await asyncio.sleep(max(delay - age, 0))
+            try:
+                await self.refresh()
+            except Exception as e:
+                if self.log:
+                    self.log.warning(f"Failed to refresh group memberships: {e}")
+                # try again after a while, rather than immediately
+                await asyncio.sleep(min(self.ttl, 60) * (1 - self.jitter))
+
+    async def get(self):
+        """
+        Returns a dict mapping each group to a set of its members' normalized
+        DNs and names, fetching them first if they haven't been or are too
+        stale.
+        """
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.ensure_future(self._refresh_periodically())
+        if self.members is not None and self._age() > self.max_staleness:
+            # fetched once, as members fetched slower than max_staleness are
+            # already that stale when the fetch completes
+            await self.refresh()
+        while self.members is None:
+            # again if invalidated while fetching
+            await self.refresh()
+        return self.members
+
+    async def member_groups(self, groups, userdn, username):
+        """
+        Returns the groups that have the user's DN or username among their
+        members.
+        """
+        return member_groups(await self.get(), groups, userdn, username)
+
+    def invalidate(self):
+        """
+        Discards the cached members, so that they are fetched again before
+        being used next.
+        """
+        self._generation += 1
+        self._fetching = None
+        self.members = None
+        self.fetched_at = None
+
+    def close(self):
+        """
+        Stops refreshing the members in the background.
+        """
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
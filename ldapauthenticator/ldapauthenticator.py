@@ -1,14 +1,68 @@
+import asyncio
+import contextvars
+import copy
 import enum
+import math
 import re
-from inspect import isawaitable
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from inspect import isawaitable, iscoroutinefunction
 
 import ldap3
 from jupyterhub.auth import Authenticator
-from ldap3.core.exceptions import LDAPBindError, LDAPSocketOpenError
-from ldap3.core.tls import Tls
+from ldap3.core.exceptions import (
+    LDAPBindError,
+    LDAPCommunicationError,
+    LDAPException,
+    LDAPSocketOpenError,
+    LDAPStartTLSError,
+)
 from ldap3.utils.conv import escape_filter_chars
 from ldap3.utils.dn import escape_rdn
-from traitlets import Bool, Dict, Int, List, Unicode, Union, UseEnum, observe, validate
+from tornado import web
+from traitlets import (
+    Any,
+    Bool,
+    Dict,
+    Float,
+    Int,
+    List,
+    Unicode,
+    Union,
+    UseEnum,
+    default,
+    observe,
+    validate,
+)
+
+from . import groups, metrics
+from .cache import (
+    Batcher,
+    CredentialCache,
+    Singleflight,
+    TemplateOrder,
+    TokenBuckets,
+    TTLCache,
+)
+from .connection import (
+    AsyncioConnection,
+    CoalescingConnection,
+    ConnectionStats,
+    FetchedEntries,
+    SyncConnection,
+)
+from .groups import (
+    GroupGraph,
+    GroupMembershipCache,
+    GroupMembershipStrategy,
+    NestedGroupMembership,
+)
+from .metrics import Outcome, Phase
+from .pool import ConnectionPool
+from .servers import Server, ServerSelection, ServerSelector, parse_server
+from .sync import GroupSync
+from .tracing import Tracer
 
 
 class TlsStrategy(enum.Enum):
@@ -22,15 +76,98 @@ class TlsStrategy(enum.Enum):
     insecure = 3
 
 
+class ClientMode(enum.Enum):
+    """
+    Represents how LDAPAuthenticator communicates with the LDAP server.
+    """
+
+    sync = 1
+    asyncio = 2
+
+
+def _merge_attributes(*attribute_lists):
+    """
+    Returns the attribute names of all lists, without duplicates differing
+    only in letter case.
+    """
+    merged = {}
+    for attributes in attribute_lists:
+        for name in attributes:
+            merged.setdefault(name.lower(), name)
+    return list(merged.values())
+
+
+# the attributes of a POSIX identity, and how their values are converted
+def _overridden_as_function(method):
+    """
+    Returns True if `method`, one of LDAPAuthenticator's overridable
+    coroutine methods, is overridden by a subclass with a plain function, as
+    written for LDAPAuthenticator 2.0 and earlier.
+    """
+    return not iscoroutinefunction(method)
+
+
+_POSIX_ATTRIBUTES = {"uidNumber": int, "gidNumber": int, "homeDirectory": str}
+
+
+def _first_value(attributes, name, convert=str):
+    """
+    Returns the first value of an attribute, looked up regardless of letter
+    case in a dict of attributes such as `auth_state["user_attributes"]`,
+    converted with `convert`, or None if it has no valid value.
+    """
+    for key, values in attributes.items():
+        if key.lower() == name.lower():
+            if isinstance(values, (list, tuple)):
+                values = values[0] if values else None
+            if values is None:
+                return None
+            try:
+                return convert(values)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
 class LDAPAuthenticator(Authenticator):
-    server_address = Unicode(
+    server_address = Union(
+        [Unicode(), List()],
         config=True,
         help="""
-        Address of the LDAP server to contact.
+        Address of the LDAP server to contact, or a list of addresses of LDAP
+        servers to spread connections across and fail over between.
+
+        Each address could be an IP address or hostname, optionally with a
+        port as `"hostname:port"` overriding `server_port`. A server can also
+        be configured as a dict with the keys `address`, `port` (optional),
+        and `weight` (optional, defaults to 1), where the weight influences
+        how large share of connections the server receives with
+        `server_selection="round_robin"`.
+
+        String example:
+            ldap.example.org
 
-        Could be an IP address or hostname.
+        List example:
+            [
+                "ldap1.example.org",
+                "ldap2.example.org:1389",
+                {"address": "ldap3.example.org", "weight": 2},
+            ]
         """,
     )
+
+    @validate("server_address")
+    def _validate_server_address(self, proposal):
+        """
+        Ensure a list is set, with each server being valid.
+        """
+        rv = proposal.value
+        if isinstance(rv, str):
+            rv = [rv]
+        for server in rv:
+            parse_server(server)
+        return rv
+
     server_port = Int(
         config=True,
         help="""
@@ -47,6 +184,91 @@ class LDAPAuthenticator(Authenticator):
         else:
             return 389  # default plaintext port for LDAP
 
+    server_selection = UseEnum(
+        ServerSelection,
+        default_value=ServerSelection.round_robin,
+        config=True,
+        help="""
+        Only used with multiple servers configured in `server_address`.
+
+        How to pick which LDAP server to connect to. If connecting to it fails,
+        the other servers are tried in turn.
+
+        Supported `server_selection` values are:
+        - "round_robin" (default), spreading connections across the servers in
+          proportion to their weight.
+        - "least_latency", connecting to the server that has recently been the
+          quickest to connect and bind to.
+        """,
+    )
+
+    server_max_failures = Int(
+        1,
+        config=True,
+        help="""
+        Only used with multiple servers configured in `server_address`.
+
+        Number of consecutive failures to connect to a server after which it
+        is marked down. Servers marked down are only tried if no server is up,
+        so that logins don't wait for connections to them to fail.
+        """,
+    )
+
+    server_probe_interval = Float(
+        10,
+        config=True,
+        help="""
+        Only used with multiple servers configured in `server_address`.
+
+        Seconds between attempts to connect to servers marked down, in the
+        background. A server is marked up again as soon as an attempt
+        succeeds. Set to 0 to disable the attempts, and only mark servers up
+        again if connecting to them succeeds when no server is up.
+        """,
+    )
+
+    server_circuit_breaker_timeout = Float(
+        0,
+        config=True,
+        help="""
+        Seconds during which servers marked down, after
+        `server_max_failures` consecutive failures to connect, aren't
+        connected to at all. Logins needing a server then fail immediately if
+        all servers are down, instead of each waiting for its own connection
+        attempts to fail.
+
+        After that long, a single login is let through to try connecting to
+        the server again. The server is marked up if connecting succeeds, and
+        otherwise stays down for another `server_circuit_breaker_timeout`
+        seconds.
+
+        Set to 0 (default) to keep trying servers marked down when no server
+        is up.
+        """,
+    )
+
+    server_connect_timeout = Float(
+        10,
+        config=True,
+        help="""
+        Seconds to wait for a connection to an LDAP server to be established,
+        including the TLS handshake with `tls_strategy` "on_connect", before
+        giving up on the server. Set to 0 to wait as long as the operating
+        system does.
+        """,
+    )
+
+    server_receive_timeout = Float(
+        30,
+        config=True,
+        help="""
+        Seconds to wait for an LDAP server to respond to an operation, such as
+        a bind or search, before giving up on the connection. Set to 0 to wait
+        indefinitely. With `client_mode` "sync", it is rounded up to whole
+        seconds.
+        """,
+    )
+
     use_ssl = Bool(
         None,
         allow_none=True,
@@ -165,6 +387,76 @@ class LDAPAuthenticator(Authenticator):
                 "bind_dn_template to be configured"
             )
 
+    bind_dn_template_concurrency = Int(
+        1,
+        config=True,
+        help="""
+        Only used with multiple `bind_dn_template` entries configured.
+
+        Maximum number of the DNs formed from `bind_dn_template` that a login
+        attempts to bind as at the same time, instead of one after another.
+        This spares users matching one of the last templates from waiting
+        for binds with the earlier ones to fail first, at the cost of more
+        bind attempts being made.
+
+        The DN used is still the first one in `bind_dn_template` order that
+        could be bound, and connections bound with later ones are unbound.
+        Once a DN could be bound, binds with later DNs that haven't started
+        are skipped, but those already in progress complete.
+
+        Note that each failed bind attempt may count towards locking the
+        account with lockout policies such as Active Directory's or
+        OpenLDAP's ppolicy overlay, so that users could be locked out sooner
+        with this configured. Consider `adaptive_bind_dn_template_order`
+        instead, or in addition.
+        """,
+    )
+
+    adaptive_bind_dn_template_order = Bool(
+        False,
+        config=True,
+        help="""
+        Only used with multiple `bind_dn_template` entries configured.
+
+        If configured True, the `bind_dn_template` entries are tried in an
+        order learned from previous logins instead of as configured: first
+        the entry that last could be bound for the username, then the
+        entries by how often they could be bound overall. This makes most
+        logins bind on the first attempt, saving time and, with Active
+        Directory, failed binds counting towards account lockout.
+
+        Note that if a user could be bound with DNs from multiple entries,
+        the DN used may then differ from the first in configured order.
+
+        The `first_attempt_rate` attribute of `bind_dn_template_order` tells
+        the fraction of logins that were bound on the first attempt.
+        """,
+    )
+
+    adaptive_bind_dn_template_order_size = Int(
+        10000,
+        config=True,
+        help="""
+        Only used with `adaptive_bind_dn_template_order` configured.
+
+        Maximum number of usernames for which the `bind_dn_template` entry
+        that last could be bound is remembered. When full, the least recently
+        used username is forgotten.
+        """,
+    )
+
+    bind_dn_template_order = Any(
+        help="""
+        The `ldapauthenticator.cache.TemplateOrder` learning which
+        `bind_dn_template` entries can be bound for usernames, used with
+        `adaptive_bind_dn_template_order` configured.
+        """,
+    )
+
+    @default("bind_dn_template_order")
+    def _default_bind_dn_template_order(self):
+        return TemplateOrder(self.adaptive_bind_dn_template_order_size)
+
     allowed_groups = List(
         config=True,
         allow_none=True,
@@ -201,9 +493,136 @@ class LDAPAuthenticator(Authenticator):
     group_attributes = List(
         config=True,
         default_value=["member", "uniqueMember", "memberUid"],
-        help="List of attributes in the LDAP group to be searched",
+        help="""
+        List of attributes of LDAP groups listing their members, read with
+        `group_membership_cache_ttl` or `group_sync_interval` configured.
+        Searches with `group_search_filter` don't retrieve them.
+        """,
+    )
+
+    group_membership_strategy = UseEnum(
+        GroupMembershipStrategy,
+        default_value=GroupMembershipStrategy.per_group_search,
+        config=True,
+        help="""
+        Only used with `allowed_groups` configured.
+
+        How to determine which of the `allowed_groups` a user is a member of,
+        to pick the way requiring the fewest requests to the LDAP server that
+        works with its configuration.
+
+        Supported `group_membership_strategy` values are:
+        - "per_group_search" (default), searching each group's entry with
+          `group_search_filter`, requiring one request per group.
+        - "combined_search", searching for all groups with
+          `group_search_filter` in a single request per distinct parent DN of
+          the groups.
+        - "compare", comparing the user's DN with the `group_member_attribute`
+          values of each group, requiring one request per group, that are sent
+          together with `client_mode="asyncio"`.
+        - "member_of", reading the `member_of_attribute` values of the user's
+          entry in a single request. This requires the LDAP server to maintain
+          such an attribute, like Active Directory does, or OpenLDAP does with
+          the memberof overlay.
+        """,
+    )
+
+    group_member_attribute = Unicode(
+        "member",
+        config=True,
+        help="""
+        Only used with `group_membership_strategy="compare"`.
+
+        The attribute of group entries listing the DNs of their members.
+        """,
+    )
+
+    member_of_attribute = Unicode(
+        "memberOf",
+        config=True,
+        help="""
+        Only used with `group_membership_strategy="member_of"`.
+
+        The attribute of user entries listing the DNs of the groups they are
+        members of.
+        """,
+    )
+
+    group_membership_cache_ttl = Float(
+        0,
+        config=True,
+        help="""
+        Only used with `allowed_groups` configured.
+
+        If configured to a positive number of seconds, the `group_attributes`
+        values of each of the `allowed_groups`, such as `member`,
+        `uniqueMember` and `memberUid`, are fetched and kept in memory, and
+        refreshed in the background this often. Logins are then checked for
+        group membership without making requests to the LDAP server, by
+        looking for the user's DN or username among the values, instead of as
+        configured by `group_membership_strategy`.
+
+        The values are fetched with connections bound as
+        `lookup_dn_search_user`, that must be permitted to read them.
+        """,
+    )
+
+    group_membership_cache_max_staleness = Float(
+        3600,
+        config=True,
+        help="""
+        Only used with `group_membership_cache_ttl` configured.
+
+        Seconds after which group members that couldn't be refreshed in the
+        background are no longer used, and logins wait for them to be fetched
+        again instead. Logins are checked as configured by
+        `group_membership_strategy` if that fails.
+        """,
+    )
+
+    group_membership_cache_jitter = Float(
+        0.1,
+        config=True,
+        help="""
+        Only used with `group_membership_cache_ttl` configured.
+
+        The fraction by which the time between refreshes of group members is
+        randomly shortened, so that multiple JupyterHub instances don't
+        refresh at the same time.
+        """,
+    )
+
+    group_membership_cache = Any(
+        help="""
+        The `ldapauthenticator.groups.GroupMembershipCache` holding the members
+        of `allowed_groups`, used with `group_membership_cache_ttl`
+        configured.
+        """,
     )
 
+    @default("group_membership_cache")
+    def _default_group_membership_cache(self):
+        return GroupMembershipCache(
+            self._fetch_group_members,
+            ttl=self.group_membership_cache_ttl,
+            max_staleness=self.group_membership_cache_max_staleness,
+            jitter=self.group_membership_cache_jitter,
+            log=self.log,
+        )
+
+    @observe("allowed_groups", "group_attributes")
+    def invalidate_group_membership_cache(self, change=None):
+        """
+        Discards the group members held in memory with
+        `group_membership_cache_ttl` configured, so that they are fetched
+        again before the next login is checked.
+
+        Called automatically when `allowed_groups` or `group_attributes` is
+        changed.
+        """
+        if self.trait_has_value("group_membership_cache"):
+            self.group_membership_cache.invalidate()
+
     @observe("allowed_groups", "group_search_filter", "group_attributes")
     def _ensure_allowed_groups_requirements(self, change):
         if not self.allowed_groups:
@@ -214,6 +633,110 @@ class LDAPAuthenticator(Authenticator):
                 "group_search_filter and group_attributes to be configured"
             )
 
+    nested_group_membership = UseEnum(
+        NestedGroupMembership,
+        default_value=NestedGroupMembership.none,
+        config=True,
+        help="""
+        Only used with `allowed_groups` configured.
+
+        Whether users are also considered members of `allowed_groups` through
+        groups that are members of them, and how that is determined.
+
+        Supported `nested_group_membership` values are:
+        - "none" (default), only considering direct members.
+        - "in_chain", letting the server follow nested groups by searching
+          the groups for the user's DN among the `group_member_attribute`
+          values with Active Directory's LDAP_MATCHING_RULE_IN_CHAIN
+          (1.2.840.113556.1.4.1941), as configured by
+          `group_membership_strategy` "per_group_search" or
+          "combined_search", instead of with `group_search_filter`.
+        - "client_side", for servers not supporting that, finding the groups
+          the user is a direct member of with `group_search_filter` below
+          `nested_group_search_base`, and then the groups those are members
+          of through their `group_member_attribute`, level by level. The
+          groups each group is a member of are remembered for
+          `nested_group_cache_ttl` seconds, so that logins of other users
+          don't search for them again.
+
+        `group_membership_cache_ttl` isn't used with nested groups.
+        """,
+    )
+
+    nested_group_search_base = Unicode(
+        config=True,
+        default_value=None,
+        allow_none=True,
+        help="""
+        Only used with `nested_group_membership="client_side"`.
+
+        The base below which groups are searched for. Defaults to the
+        longest DN that all `allowed_groups` are below.
+        """,
+    )
+
+    nested_group_max_depth = Int(
+        10,
+        config=True,
+        help="""
+        Only used with `nested_group_membership="client_side"`.
+
+        Maximum number of levels of nested groups followed.
+        """,
+    )
+
+    nested_group_cache_ttl = Float(
+        300,
+        config=True,
+        help="""
+        Only used with `nested_group_membership="client_side"`.
+
+        Seconds for which the groups a group is a member of are remembered.
+        Set to 0 to search for them at every login.
+        """,
+    )
+
+    nested_group_cache_size = Int(
+        10000,
+        config=True,
+        help="""
+        Only used with `nested_group_membership="client_side"`.
+
+        Maximum number of groups whose parent groups are remembered, the
+        least recently used forgotten first.
+        """,
+    )
+
+    group_graph = Any(
+        help="""
+        The `ldapauthenticator.groups.GroupGraph` remembering which groups
+        are members of which, used with
+        `nested_group_membership="client_side"`.
+        """,
+    )
+
+    @default("group_graph")
+    def _default_group_graph(self):
+        return GroupGraph(
+            self._nested_group_search_base(),
+            member_attribute=self.group_member_attribute,
+            ttl=self.nested_group_cache_ttl,
+            maxsize=self.nested_group_cache_size,
+            max_depth=self.nested_group_max_depth,
+        )
+
+    @observe(
+        "allowed_groups",
+        "group_member_attribute",
+        "nested_group_search_base",
+        "nested_group_max_depth",
+        "nested_group_cache_ttl",
+        "nested_group_cache_size",
+    )
+    def _reset_group_graph(self, change):
+        if self.trait_has_value("group_graph"):
+            self.group_graph = self._default_group_graph()
+
     valid_username_regex = Unicode(
         r"^[a-z][.a-z0-9_-]*$",
         config=True,
@@ -331,179 +854,1158 @@ class LDAPAuthenticator(Authenticator):
         """,
     )
 
-    lookup_dn_user_dn_attribute = Unicode(
+    lookup_dn_cache_size = Int(
+        1000,
         config=True,
-        default_value=None,
-        allow_none=True,
         help="""
         Only used with `lookup_dn=True`.
 
-        Attribute containing user's name needed for building DN string. See
-        `user_search_base` for info on how this attribute is used. For most LDAP
-        servers, this is username. For Active Directory, it is `sAMAccountName`.
+        Maximum number of usernames for which the user's DN and
+        `lookup_dn_user_dn_attribute` value looked up is remembered, for up to
+        `lookup_dn_cache_ttl` seconds. When full, the least recently used
+        username is forgotten.
         """,
     )
 
-    escape_userdn = Bool(
-        False,
+    lookup_dn_cache_ttl = Float(
+        0,
         config=True,
         help="""
-        Removed in 2.0, configuring this no longer has any effect.
+        Only used with `lookup_dn=True`.
+
+        Seconds for which the user's DN and `lookup_dn_user_dn_attribute` value
+        looked up for a username is remembered, so that repeated logins don't
+        need to look it up again. Set to 0 (default) to not remember them.
+
+        Note that a user whose entry is renamed or removed can still log in
+        with the DN remembered for up to this many seconds.
         """,
     )
 
-    @observe("escape_userdn")
-    def _observe_escape_userdn(self, change):
-        self.log.warning(
-            "LDAPAuthenticator.escape_userdn was removed in 2.0 and no longer has any effect."
-        )
-
-    search_filter = Unicode(
+    lookup_dn_negative_cache_size = Int(
+        1000,
         config=True,
         help="""
-        LDAP3 Search Filter to limit allowed users.
+        Only used with `lookup_dn=True`.
 
-        That a unique LDAP user is identified with the search_filter is
-        necessary but not sufficient to grant access. Grant access by setting
-        one or more of `allowed_users`, `allow_all`, `allowed_groups`, etc.
+        Maximum number of usernames for which looking up a user found no entry
+        or multiple entries is remembered, for up to
+        `lookup_dn_negative_cache_ttl` seconds.
+        """,
+    )
 
-        Users who do not match this filter cannot be allowed
-        by any other configuration.
+    lookup_dn_negative_cache_ttl = Float(
+        0,
+        config=True,
+        help="""
+        Only used with `lookup_dn=True`.
 
-        The search filter string will be expanded, so that:
+        Seconds for which a username's lookup finding no entry or multiple
+        entries is remembered, so that repeated login attempts with unknown
+        usernames don't each search the LDAP server. Set to 0 (default) to not
+        remember them.
 
-        - `{userattr}` is replaced with the `user_attribute` config's value.
-        - `{username}` is replaced with an escaped username, either provided
-          directly or previously looked up with `lookup_dn` configured.
+        Note that a user created after a failed login attempt can't log in
+        for up to this many seconds.
         """,
     )
 
-    attributes = List(
-        config=True,
+    lookup_dn_cache = Any(
         help="""
-        List of attributes to be passed in the LDAP search with `search_filter`.
+        The `ldapauthenticator.cache.TTLCache` of usernames' looked up
+        `(username, userdn)`, configured by `lookup_dn_cache_size` and
+        `lookup_dn_cache_ttl`. Its `hits` and `misses` attributes count its
+        use.
         """,
     )
 
-    auth_state_attributes = List(
-        config=True,
-        help="""
-        List of user attributes to be returned in auth_state
+    @default("lookup_dn_cache")
+    def _default_lookup_dn_cache(self):
+        return TTLCache(self.lookup_dn_cache_size, self.lookup_dn_cache_ttl)
 
-        Will be available in `auth_state["user_attributes"]`
+    lookup_dn_negative_cache = Any(
+        help="""
+        The `ldapauthenticator.cache.TTLCache` of usernames whose lookup found
+        no entry or multiple entries, configured by
+        `lookup_dn_negative_cache_size` and `lookup_dn_negative_cache_ttl`.
+        Its `hits` and `misses` attributes count its use.
         """,
     )
 
-    use_lookup_dn_username = Bool(
-        False,
+    @default("lookup_dn_negative_cache")
+    def _default_lookup_dn_negative_cache(self):
+        return TTLCache(
+            self.lookup_dn_negative_cache_size, self.lookup_dn_negative_cache_ttl
+        )
+
+    @observe(
+        "server_address",
+        "user_search_base",
+        "user_attribute",
+        "lookup_dn_search_filter",
+        "lookup_dn_user_dn_attribute",
+    )
+    def invalidate_lookup_dn_cache(self, change=None, username=None):
+        """
+        Forgets the looked up users remembered for a username, or for all
+        usernames if not provided, regardless of what the lookup found.
+
+        Called automatically when configuration influencing lookups is
+        changed.
+        """
+        for name in ("lookup_dn_cache", "lookup_dn_negative_cache"):
+            if self.trait_has_value(name):
+                cache = getattr(self, name)
+                if username is None:
+                    cache.clear()
+                else:
+                    cache.pop(username)
+
+    credential_cache_ttl = Float(
+        0,
         config=True,
         help="""
-        Only used with `lookup_dn=True`.
+        If configured to a positive number of seconds, successful logins are
+        remembered this long, so that a user logging in again with the same
+        password is authenticated without contacting the LDAP server. This
+        lets JupyterHub absorb bursts of logins, for example after a restart,
+        and short LDAP server outages.
+
+        Passwords are never stored, only a salted scrypt hash of them
+        together with the resulting auth model. A login remembered for a
+        username is forgotten when a login attempt for it is denied, for
+        example as the password was changed and the old one fails to bind.
+
+        Note that this means a user whose password is changed or whose
+        account is disabled can still log in with the old password, for up
+        to this many seconds after having last done so.
+        """,
+    )
 
-        If configured True, the `lookup_dn_user_dn_attribute` value used to
-        build the LDAP user's DN string is also used as the authenticated user's
-        JupyterHub username.
+    credential_cache_size = Int(
+        1000,
+        config=True,
+        help="""
+        Only used with `credential_cache_ttl` configured.
 
-        If this is configured True, its important to ensure that the values of
-        `lookup_dn_user_dn_attribute` are unique even after the are normalized
-        to be lowercase, otherwise two LDAP users could end up sharing the same
-        JupyterHub username.
+        Maximum number of usernames for which a successful login is
+        remembered. When full, the least recently used username is forgotten.
+        """,
+    )
 
-        With ldapauthenticator 2, the default value was changed to False.
+    credential_cache = Any(
+        help="""
+        The `ldapauthenticator.cache.CredentialCache` of successful logins,
+        configured by `credential_cache_ttl` and `credential_cache_size`. Its
+        `hits` and `misses` attributes count its use.
         """,
     )
 
-    def resolve_username(self, username_supplied_by_user):
+    @default("credential_cache")
+    def _default_credential_cache(self):
+        return CredentialCache(
+            self.credential_cache_size,
+            self.credential_cache_ttl,
+            run=self._run_in_thread,
+        )
+
+    @observe(
+        "server_address",
+        "bind_dn_template",
+        "lookup_dn",
+        "user_search_base",
+        "user_attribute",
+        "lookup_dn_search_filter",
+        "lookup_dn_user_dn_attribute",
+        "use_lookup_dn_username",
+        "search_filter",
+        "allowed_groups",
+        "group_search_filter",
+        "auth_state_attributes",
+    )
+    def invalidate_credential_cache(self, change=None, username=None):
         """
-        Resolves a username (that could be used to construct a DN through a
-        template), and a DN, based on a username supplied by a user via a login
-        prompt in JupyterHub.
+        Forgets the successful login remembered for a username, or for all
+        usernames if not provided.
 
-        Returns (username, userdn) if found, or (None, None) if an error occurred,
-        or if `username_supplied_by_user` does not correspond to a unique user.
+        Called automatically when configuration influencing logins' auth
+        models is changed.
         """
-        conn = self.get_connection(
-            userdn=self.lookup_dn_search_user,
-            password=self.lookup_dn_search_password,
-        )
-        if not conn:
-            self.log.error(
-                f"Failed to bind lookup_dn_search_user '{self.lookup_dn_search_user}'"
+        if self.trait_has_value("credential_cache"):
+            if username is None:
+                self.credential_cache.clear()
+            else:
+                self.credential_cache.pop(username)
+
+    lookup_dn_pool_min_size = Int(
+        0,
+        config=True,
+        help="""
+        Minimum number of connections bound as `lookup_dn_search_user` to keep
+        open for reuse across logins.
+        """,
+    )
+
+    lookup_dn_pool_max_size = Int(
+        10,
+        config=True,
+        help="""
+        Maximum number of connections bound as `lookup_dn_search_user` to have
+        open at the same time. Logins needing one while all are in use wait
+        for one to be released.
+        """,
+    )
+
+    lookup_dn_pool_idle_timeout = Float(
+        300,
+        config=True,
+        help="""
+        Seconds after which a connection bound as `lookup_dn_search_user` that
+        hasn't been used is closed, unless it is needed to keep
+        `lookup_dn_pool_min_size` connections open.
+        """,
+    )
+
+    lookup_dn_pool_keepalive_interval = Float(
+        60,
+        config=True,
+        help="""
+        Seconds between checks of the idle connections bound as
+        `lookup_dn_search_user`, where each is verified to still be responsive
+        with a cheap search, and otherwise replaced. Idle connections are also
+        closed according to `lookup_dn_pool_idle_timeout` when checked.
+
+        Set to 0 to disable the checks.
+        """,
+    )
+
+    lookup_dn_pool = Any(
+        help="""
+        The `ldapauthenticator.pool.ConnectionPool` of connections bound as
+        `lookup_dn_search_user`, configured by the `lookup_dn_pool_*` options.
+        """,
+    )
+
+    @default("lookup_dn_pool")
+    def _default_lookup_dn_pool(self):
+        return ConnectionPool(
+            self._connect_lookup_dn_search_user,
+            min_size=self.lookup_dn_pool_min_size,
+            max_size=self.lookup_dn_pool_max_size,
+            idle_timeout=self.lookup_dn_pool_idle_timeout,
+            keepalive_interval=self.lookup_dn_pool_keepalive_interval,
+            log=self.log,
+        )
+
+    connection_stats = Any(
+        help="""
+        The `ldapauthenticator.connection.ConnectionStats` counting the
+        connections returned by `get_connection`, including those pooled:
+        its `open`, `in_use` and `leaked` attributes tell how many are open,
+        how many of those are used by logins or other operations rather than
+        idle in `lookup_dn_pool`, and how many were garbage collected without
+        being unbound.
+        """,
+    )
+
+    @default("connection_stats")
+    def _default_connection_stats(self):
+        return ConnectionStats(
+            idle=self._idle_connections,
+            on_operation=self._count_operation,
+            log=self.log,
+        )
+
+    def _idle_connections(self):
+        if self.trait_has_value("lookup_dn_pool"):
+            return self.lookup_dn_pool.idle
+        return 0
+
+    coalesce_requests = Bool(
+        True,
+        config=True,
+        help="""
+        Whether concurrent identical searches and compares made to look up
+        users and check their group membership share one request to the LDAP
+        server and its result. This spares the LDAP server from repeated
+        requests when a user submits the login form multiple times, or many
+        users' membership of the same group is checked at the same time.
+
+        Requests are only shared among connections bound as the same DN, and
+        binds are never shared.
+        """,
+    )
+
+    singleflight = Any(
+        help="""
+        The `ldapauthenticator.cache.Singleflight` sharing concurrent
+        identical requests with `coalesce_requests` configured. Its `shared`
+        attribute counts the requests that shared another's result.
+        """,
+    )
+
+    @default("singleflight")
+    def _default_singleflight(self):
+        return Singleflight()
+
+    def _coalescing(self, conn):
+        """
+        Returns `conn`, a connection or `lookup_dn_pool`, wrapped so that
+        concurrent identical requests share one, unless `coalesce_requests`
+        is False.
+        """
+        if not self.coalesce_requests:
+            return conn
+        identity = conn if conn is self.lookup_dn_pool else conn.bound_dn
+        return CoalescingConnection(conn, self.singleflight, identity)
+
+    enable_metrics = Bool(
+        True,
+        config=True,
+        help="""
+        Whether to record Prometheus metrics about logins, exported by
+        JupyterHub on `/hub/metrics` together with its own metrics:
+
+        - `ldapauthenticator_phase_duration_seconds`, a histogram of the time
+          taken by each phase of logins, labeled by `phase` ("lookup_dn",
+          "bind", "search_filter", "groups" or "user_attributes") and
+          `outcome` ("success", "bad_credentials", "not_found",
+          "multiple_matches", "socket_error", "tls_error" or "error").
+        - `ldapauthenticator_ldap_operations_total`, counting the LDAP
+          operations requested, labeled by `operation` ("bind", "search" or
+          "compare").
+        """,
+    )
+
+    def _measure(self, phase):
+        """
+        Returns a context manager measuring the duration and outcome of a
+        phase of logins, unless `enable_metrics` is False.
+        """
+        return metrics.measure(phase, enabled=self.enable_metrics)
+
+    def _count_operation(self, operation):
+        if self.enable_metrics:
+            metrics.count_operation(operation)
+
+    tracer = Any(
+        config=True,
+        help="""
+        A tracer from `ldapauthenticator.tracing`, given a span for each LDAP
+        operation: connecting, establishing TLS, binding, searching,
+        comparing and unbinding, nested in a span for each login. Use
+        `ldapauthenticator.tracing.OpenTelemetryTracer()` to pass them to
+        OpenTelemetry, if the opentelemetry-api package is installed and
+        configured:
+
+        ```python
+        from ldapauthenticator.tracing import OpenTelemetryTracer
+
+        c.LDAPAuthenticator.tracer = OpenTelemetryTracer()
+        ```
+
+        By default, a tracer doing nothing.
+        """,
+    )
+
+    @default("tracer")
+    def _default_tracer(self):
+        return Tracer()
+
+    async def _connect_lookup_dn_search_user(self):
+        return await self._get_connection(
+            userdn=self.lookup_dn_search_user,
+            password=self.lookup_dn_search_password,
+        )
+
+    use_lookup_dn_search_user_for_searches = Bool(
+        False,
+        config=True,
+        help="""
+        If configured True, the searches made for `search_filter`,
+        `allowed_groups` and `auth_state_attributes` after a user has been
+        authenticated are made with the pooled connections bound as
+        `lookup_dn_search_user` instead of with a connection bound as the user.
+        This saves the user's connection from being used for more than
+        verifying the password, but requires `lookup_dn_search_user` to be
+        permitted to read the searched entries.
+        """,
+    )
+
+    lookup_dn_user_dn_attribute = Unicode(
+        config=True,
+        default_value=None,
+        allow_none=True,
+        help="""
+        Only used with `lookup_dn=True`.
+
+        Attribute containing user's name needed for building DN string. See
+        `user_search_base` for info on how this attribute is used. For most LDAP
+        servers, this is username. For Active Directory, it is `sAMAccountName`.
+        """,
+    )
+
+    escape_userdn = Bool(
+        False,
+        config=True,
+        help="""
+        Removed in 2.0, configuring this no longer has any effect.
+        """,
+    )
+
+    @observe("escape_userdn")
+    def _observe_escape_userdn(self, change):
+        self.log.warning(
+            "LDAPAuthenticator.escape_userdn was removed in 2.0 and no longer has any effect."
+        )
+
+    search_filter = Unicode(
+        config=True,
+        help="""
+        LDAP3 Search Filter to limit allowed users.
+
+        That a unique LDAP user is identified with the search_filter is
+        necessary but not sufficient to grant access. Grant access by setting
+        one or more of `allowed_users`, `allow_all`, `allowed_groups`, etc.
+
+        Users who do not match this filter cannot be allowed
+        by any other configuration.
+
+        The search filter string will be expanded, so that:
+
+        - `{userattr}` is replaced with the `user_attribute` config's value.
+        - `{username}` is replaced with an escaped username, either provided
+          directly or previously looked up with `lookup_dn` configured.
+        """,
+    )
+
+    attributes = List(
+        config=True,
+        help="""
+        List of attributes to be passed in the LDAP search with `search_filter`.
+        """,
+    )
+
+    auth_state_attributes = List(
+        config=True,
+        help="""
+        List of user attributes to be returned in auth_state
+
+        Will be available in `auth_state["user_attributes"]`
+        """,
+    )
+
+    posix_identity_cache_ttl = Float(
+        300,
+        config=True,
+        help="""
+        Seconds for which a user's POSIX identity, as set in the spawner's
+        environment by `pre_spawn_start`, is remembered, so that repeated
+        spawns, such as of named servers or after servers are culled, don't
+        each decrypt the user's auth_state or read the LDAP server. Set to 0
+        to not remember them.
+
+        A user's remembered identity is forgotten when they log in, and when
+        they are checked again as configured by `refresh_users`.
+        """,
+    )
+
+    posix_identity_cache_size = Int(
+        10000,
+        config=True,
+        help="""
+        Maximum number of users whose POSIX identity is remembered for
+        `posix_identity_cache_ttl` seconds.
+        """,
+    )
+
+    posix_identity_cache = Any(
+        help="""
+        The `ldapauthenticator.cache.TTLCache` of users' POSIX identities
+        returned by `get_posix_identity`, configured by
+        `posix_identity_cache_size` and `posix_identity_cache_ttl`. Its `hits`
+        and `misses` attributes count its use.
+        """,
+    )
+
+    @default("posix_identity_cache")
+    def _default_posix_identity_cache(self):
+        return TTLCache(self.posix_identity_cache_size, self.posix_identity_cache_ttl)
+
+    posix_groups_search_base = Unicode(
+        None,
+        allow_none=True,
+        config=True,
+        help="""
+        Base DN below which the groups a user is a supplementary member of
+        are searched for with `posix_groups_search_filter`, by
+        `pre_spawn_start`. Their `gidNumber` values are set in the spawner's
+        environment as `NB_SUPPLEMENTARY_GIDS`.
+
+        Not searched for by default.
+        """,
+    )
+
+    posix_groups_search_filter = Unicode(
+        "(&(objectClass=posixGroup)(memberUid={username}))",
+        config=True,
+        help="""
+        Search filter finding the groups a user is a supplementary member of,
+        below `posix_groups_search_base`, where `{username}` is replaced with
+        the user's JupyterHub username.
+        """,
+    )
+
+    use_lookup_dn_username = Bool(
+        False,
+        config=True,
+        help="""
+        Only used with `lookup_dn=True`.
+
+        If configured True, the `lookup_dn_user_dn_attribute` value used to
+        build the LDAP user's DN string is also used as the authenticated user's
+        JupyterHub username.
+
+        If this is configured True, its important to ensure that the values of
+        `lookup_dn_user_dn_attribute` are unique even after the are normalized
+        to be lowercase, otherwise two LDAP users could end up sharing the same
+        JupyterHub username.
+
+        With ldapauthenticator 2, the default value was changed to False.
+        """,
+    )
+
+    executor_threads = Int(
+        0,
+        config=True,
+        help="""
+        Number of worker threads to run the LDAP part of logins in, off the
+        event loop of JupyterHub.
+
+        With the default value of 0, logins interact with the LDAP server
+        directly from the event loop, and JupyterHub is unresponsive while
+        waiting for the LDAP server. Setting this to a positive number makes
+        at most this number of logins interact with the LDAP server at the
+        same time, while additional logins wait up to
+        `executor_queue_timeout` seconds for a thread to become available.
+        """,
+    )
+
+    executor_queue_timeout = Float(
+        10,
+        config=True,
+        help="""
+        Only used with `executor_threads` configured.
+
+        Seconds a login waits for a worker thread to become available before
+        it is rejected with a "503 Service Unavailable" response.
+        """,
+    )
+
+    executor = Any(
+        help="""
+        The `concurrent.futures.Executor` used to run the LDAP part of logins,
+        created with `executor_threads` worker threads.
+        """,
+    )
+
+    @default("executor")
+    def _default_executor(self):
+        return ThreadPoolExecutor(
+            max(self.executor_threads, 1), thread_name_prefix="ldapauthenticator"
+        )
+
+    _executor_slots = Any()
+
+    @default("_executor_slots")
+    def _default_executor_slots(self):
+        return asyncio.Semaphore(self.executor_threads)
+
+    max_concurrent_logins = Int(
+        0,
+        config=True,
+        help="""
+        Maximum number of logins interacting with the LDAP server at the same
+        time. Additional logins wait in a queue for up to
+        `login_queue_timeout` seconds, and are rejected with a "503 Service
+        Unavailable" response if they don't get to start by then, or right
+        away if `max_queued_logins` logins are already waiting.
+
+        Set to 0 (default) for no limit.
+        """,
+    )
+
+    max_queued_logins = Int(
+        100,
+        config=True,
+        help="""
+        Only used with `max_concurrent_logins` configured.
+
+        Maximum number of logins waiting to interact with the LDAP server.
+        """,
+    )
+
+    login_queue_timeout = Float(
+        10,
+        config=True,
+        help="""
+        Only used with `max_concurrent_logins` configured.
+
+        Seconds a login waits to interact with the LDAP server before it is
+        rejected.
+        """,
+    )
+
+    login_timeout = Float(
+        0,
+        config=True,
+        help="""
+        Seconds the LDAP part of a login may take overall, across looking up
+        the user's DN, binding, searching and checking group memberships,
+        after which the login is rejected with a "504 Gateway Timeout"
+        response. Set to 0 (default) for no limit.
+
+        With `client_mode` "sync" and no `executor_threads`, operations block
+        JupyterHub and can't be interrupted, and only
+        `server_connect_timeout` and `server_receive_timeout` limit them.
+        """,
+    )
+
+    _login_slots = Any()
+
+    @default("_login_slots")
+    def _default_login_slots(self):
+        return asyncio.Semaphore(self.max_concurrent_logins)
+
+    _queued_logins = Int(0)
+
+    failed_login_limit_per_username = Int(
+        0,
+        config=True,
+        help="""
+        Maximum number of failed logins for a username, after which further
+        login attempts for it are rejected with a "429 Too Many Requests"
+        response without contacting the LDAP server.
+
+        Attempts are let through again at a rate of this many per
+        `failed_login_limit_period` seconds, as if each failed login was
+        forgotten after that long. Set to 0 (default) for no limit.
+        """,
+    )
+
+    failed_login_limit_per_ip = Int(
+        0,
+        config=True,
+        help="""
+        Like `failed_login_limit_per_username`, but for failed logins from
+        the same client IP address, as seen by JupyterHub.
+        """,
+    )
+
+    failed_login_limit_period = Float(
+        300,
+        config=True,
+        help="""
+        Seconds over which `failed_login_limit_per_username` and
+        `failed_login_limit_per_ip` failed logins are allowed.
+        """,
+    )
+
+    failed_logins_per_username = Any(
+        help="""
+        The `ldapauthenticator.cache.TokenBuckets` limiting failed logins per
+        username, configured by `failed_login_limit_per_username`.
+        """,
+    )
+
+    @default("failed_logins_per_username")
+    def _default_failed_logins_per_username(self):
+        return TokenBuckets(
+            self.failed_login_limit_per_username, self.failed_login_limit_period
+        )
+
+    failed_logins_per_ip = Any(
+        help="""
+        The `ldapauthenticator.cache.TokenBuckets` limiting failed logins per
+        client IP address, configured by `failed_login_limit_per_ip`.
+        """,
+    )
+
+    @default("failed_logins_per_ip")
+    def _default_failed_logins_per_ip(self):
+        return TokenBuckets(
+            self.failed_login_limit_per_ip, self.failed_login_limit_period
+        )
+
+    refresh_users = Bool(
+        False,
+        config=True,
+        help="""
+        Whether to check logged in users again with the LDAP server once their
+        auth state is older than JupyterHub's `Authenticator.auth_refresh_age`
+        (default 300 seconds), updating their `ldap_groups` and
+        `user_attributes` auth state, and requiring them to log in again if
+        they no longer match `search_filter` or are no longer allowed, for
+        example after being removed from `allowed_groups`.
+
+        Users are checked with the pooled connections bound as
+        `lookup_dn_search_user`, that must be permitted to read their entries
+        and group memberships, by searching `user_search_base` for their
+        `user_attribute`, or `lookup_dn_user_dn_attribute` with
+        `use_lookup_dn_username` configured.
+
+        Checks are made together for users due within `refresh_batch_delay`
+        seconds of each other, and limited by `refresh_rate_limit`.
+        """,
+    )
+
+    refresh_batch_delay = Float(
+        1,
+        config=True,
+        help="""
+        Only used with `refresh_users` configured.
+
+        Seconds to wait for more users to become due for a check after one
+        does, so that they are checked together: their entries with one
+        search per `refresh_batch_size` users, and group memberships with one
+        search per group in `allowed_groups` regardless of the number of users.
+        """,
+    )
+
+    refresh_batch_size = Int(
+        100,
+        config=True,
+        help="""
+        Only used with `refresh_users` configured.
+
+        Maximum number of users checked together.
+        """,
+    )
+
+    refresh_rate_limit = Int(
+        600,
+        config=True,
+        help="""
+        Only used with `refresh_users` configured.
+
+        Maximum number of users checked per minute. Users due for a check
+        above this rate keep their current auth state, and are checked again
+        after another `auth_refresh_age` seconds. Set to 0 for no limit.
+        """,
+    )
+
+    refresh_batcher = Any(
+        help="""
+        The `ldapauthenticator.cache.Batcher` collecting users to check
+        together with `refresh_users` configured. Its `batches` attribute
+        counts the checks made.
+        """,
+    )
+
+    @default("refresh_batcher")
+    def _default_refresh_batcher(self):
+        return Batcher(
+            self._refresh_users,
+            delay=self.refresh_batch_delay,
+            max_size=self.refresh_batch_size,
+        )
+
+    _refresh_tokens = Any()
+
+    @default("_refresh_tokens")
+    def _default_refresh_tokens(self):
+        return TokenBuckets(self.refresh_rate_limit, 60)
+
+    group_sync_interval = Float(
+        0,
+        config=True,
+        help="""
+        Seconds between passes of a background job mirroring LDAP groups into
+        JupyterHub groups, for use with JupyterHub's
+        `Authenticator.manage_groups`. Set to 0 (default) to disable it. It is
+        also disabled, with a warning, without `manage_groups` enabled, so
+        that groups managed by other means aren't changed.
+
+        Each pass reads the groups found below `group_sync_search_base` with
+        `group_sync_search_filter`, or the groups in `allowed_groups` if it
+        isn't configured, and their `group_attributes` members, with
+        connections bound as `lookup_dn_search_user`. Members that are DNs
+        are translated to usernames by reading `user_attribute` of the users
+        below `user_search_base`. Only the differences from the previous pass
+        are applied to JupyterHub's groups, named by `group_name`, for users
+        that exist in JupyterHub.
+
+        With `manage_groups` enabled, logins are then assigned the groups of
+        the last pass without searching for them.
+        """,
+    )
+
+    group_sync_search_base = Unicode(
+        config=True,
+        default_value=None,
+        allow_none=True,
+        help="""
+        Only used with `group_sync_interval` configured.
+
+        The base below which groups to mirror into JupyterHub are searched
+        for, instead of mirroring only the groups in `allowed_groups`.
+        """,
+    )
+
+    group_sync_search_filter = Unicode(
+        "(|(objectClass=groupOfNames)(objectClass=groupOfUniqueNames)"
+        "(objectClass=posixGroup)(objectClass=group))",
+        config=True,
+        help="""
+        Only used with `group_sync_search_base` configured.
+
+        The filter matching the groups to mirror into JupyterHub.
+        """,
+    )
+
+    group_sync_change_attribute = Unicode(
+        "modifyTimestamp",
+        config=True,
+        help="""
+        Only used with `group_sync_interval` configured.
+
+        The operational attribute recording when an entry was last changed,
+        such as "modifyTimestamp", or "uSNChanged" for Active Directory.
+        Passes after the first only read the groups and users with a value at
+        least as high as the highest read by previous passes.
+        """,
+    )
+
+    group_sync_full_interval = Float(
+        3600,
+        config=True,
+        help="""
+        Only used with `group_sync_interval` configured.
+
+        Seconds between passes reading all groups and users regardless of
+        `group_sync_change_attribute`, noticing deleted groups and changes
+        missed by the other passes.
+        """,
+    )
+
+    group_sync_page_size = Int(
+        500,
+        config=True,
+        help="""
+        Only used with `group_sync_interval` configured.
+
+        Number of entries requested per page by the paged searches for
+        groups and users.
+        """,
+    )
+
+    group_sync = Any(
+        help="""
+        The `ldapauthenticator.sync.GroupSync` mirroring LDAP groups with
+        `group_sync_interval` configured. Its `entries_read` attribute tells
+        how many entries the last pass read.
+        """,
+    )
+
+    @default("group_sync")
+    def _default_group_sync(self):
+        if self.lookup_dn and self.use_lookup_dn_username:
+            name_attribute = self.lookup_dn_user_dn_attribute
+        else:
+            name_attribute = self.user_attribute
+        return GroupSync(
+            self.lookup_dn_pool.connection,
+            member_attributes=self.group_attributes,
+            users_base=self.user_search_base,
+            name_attribute=name_attribute or "uid",
+            groups_base=self.group_sync_search_base,
+            groups_filter=self.group_sync_search_filter,
+            groups=None if self.group_sync_search_base else self.allowed_groups,
+            change_attribute=self.group_sync_change_attribute,
+            page_size=self.group_sync_page_size,
+            full_interval=self.group_sync_full_interval,
+            normalize=self.normalize_username,
+            log=self.log,
+        )
+
+    _group_syncer = Any(None)
+
+    client_mode = UseEnum(
+        ClientMode,
+        default_value=ClientMode.sync,
+        config=True,
+        help="""
+        How LDAPAuthenticator communicates with the LDAP server.
+
+        Supported `client_mode` values are:
+        - "sync" (default), using the ldap3 package's blocking connections,
+          optionally run in worker threads as configured by `executor_threads`.
+        - "asyncio", speaking LDAP directly from JupyterHub's event loop. This
+          lets many logins wait on the LDAP server concurrently without
+          blocking JupyterHub or requiring a thread each, and
+          `executor_threads` is then not used.
+
+        Note that with "asyncio", attribute values in `auth_state` are
+        returned as strings, as the LDAP server's schema isn't read to convert
+        them to other types.
+        """,
+    )
+
+    async def _run_blocking(self, func, *args):
+        """
+        Runs a blocking function, in a worker thread if `executor_threads` is
+        configured.
+        """
+        if not self.executor_threads:
+            return func(*args)
+        return await self._run_in_thread(func, *args)
+
+    async def _run_in_thread(self, func, *args):
+        """
+        Runs a blocking function in a worker thread, one of `executor_threads`
+        if configured, or otherwise of the event loop's default executor.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self.executor if self.executor_threads else None
+        # run in a copy of the current context, so that spans started in the
+        # thread are nested in the current span
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(executor, context.run, func, *args)
+
+    _servers = Any(None)
+
+    def get_servers(self):
+        """
+        Returns the ServerSelector for the servers configured by
+        `server_address`. It and the ldap3 Server and SessionResumingTls
+        objects of each server are reused across connections until
+        `server_address`, `server_port`, `tls_strategy`, `tls_kwargs` or
+        `server_selection` are changed.
+
+        Reusing the Tls objects avoids reloading certificates for every
+        connection, and lets new connections resume the TLS session of
+        previous ones.
+        """
+        if self._servers is None:
+            server_address = self.server_address
+            if isinstance(server_address, str):
+                server_address = [server_address]
+            servers = []
+            for server in map(parse_server, server_address):
+                servers.append(
+                    Server(
+                        server["address"],
+                        server["port"] or self.server_port,
+                        weight=server["weight"],
+                        use_ssl=self.tls_strategy == TlsStrategy.on_connect,
+                        tls_kwargs=self.tls_kwargs,
+                        connect_timeout=self.server_connect_timeout or None,
+                    )
+                )
+            self._servers = ServerSelector(
+                servers,
+                selection=self.server_selection,
+                max_failures=self.server_max_failures,
+                probe=self._probe_server,
+                probe_interval=self.server_probe_interval,
+                breaker_timeout=self.server_circuit_breaker_timeout,
+                log=self.log,
             )
-            return (None, None)
+        return self._servers
+
+    @observe(
+        "server_address",
+        "server_port",
+        "tls_strategy",
+        "tls_kwargs",
+        "server_selection",
+        "server_max_failures",
+        "server_probe_interval",
+        "server_circuit_breaker_timeout",
+        "server_connect_timeout",
+    )
+    def _reset_servers(self, change):
+        if self._servers is not None:
+            self._servers.close()
+            self._servers = None
+        self._reset_lookup_dn_pool(change)
 
-        search_filter = self.lookup_dn_search_filter.format(
-            # A search filter matching against string literals, should
-            # have the string literals escaped with escape_filter_chars.
-            # Escaped characters are `/()*` (and null).
-            #
-            # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
-            # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
-            #
-            login_attr=self.user_attribute,
-            login=escape_filter_chars(username_supplied_by_user),
-        )
-        self.log.debug(
-            "Looking up user with:\n"
-            f"    search_base = '{self.user_search_base}'\n"
-            f"    search_filter = '{search_filter}'\n"
-            f"    attributes = '[{self.lookup_dn_user_dn_attribute}]'"
-        )
-        conn.search(
-            search_base=self.user_search_base,
-            search_scope=ldap3.SUBTREE,
-            search_filter=search_filter,
-            attributes=[self.lookup_dn_user_dn_attribute],
-        )
+    async def _probe_server(self, server):
+        """
+        Raises an error if a connection to a server can't be established.
+        """
+        conn = await self._get_server_connection(server, None, None)
+        if conn:
+            await conn.unbind()
 
-        # identify unique search response entry
-        n_entries = len(conn.entries)
-        if n_entries == 0:
-            self.log.warning(f"No response looking up '{username_supplied_by_user}'")
-            return (None, None)
-        if n_entries > 1:
-            self.log.error(
-                f"Looking up '{username_supplied_by_user}' gave multiple entries, "
-                f"expected 0 or 1 search response entries but received {n_entries}. "
-                "Is lookup_dn_search_filter and user_attribute configured to get a "
-                "unique match?"
+    @observe("lookup_dn_search_user", "lookup_dn_search_password")
+    def _reset_lookup_dn_pool(self, change):
+        if self.trait_has_value("lookup_dn_pool"):
+            self.lookup_dn_pool.reset()
+
+    async def resolve_username(self, username_supplied_by_user, fetched=None):
+        """
+        Resolves a username (that could be used to construct a DN through a
+        template), and a DN, based on a username supplied by a user via a login
+        prompt in JupyterHub.
+
+        Returns (username, userdn) if found, or (None, None) if an error occurred,
+        or if `username_supplied_by_user` does not correspond to a unique user.
+
+        Results are remembered as configured by `lookup_dn_cache_ttl` and
+        `lookup_dn_negative_cache_ttl`.
+
+        If a FetchedEntries object is passed as `fetched`, the found entry is
+        recorded in it. With `use_lookup_dn_search_user_for_searches`
+        configured, the attributes of the user's entry needed later in the
+        login are then fetched as well.
+        """
+        with self._measure(Phase.lookup_dn) as measurement:
+            resolved = self.lookup_dn_cache.get(username_supplied_by_user)
+            if resolved is not None:
+                return resolved
+            n_entries = self.lookup_dn_negative_cache.get(username_supplied_by_user)
+            if n_entries is not None:
+                measurement.entries_found(n_entries)
+                self.log.warning(
+                    f"Looking up '{username_supplied_by_user}' recently found "
+                    f"{n_entries} entries, not looking it up again yet"
+                )
+                return (None, None)
+
+            search_filter = self.lookup_dn_search_filter.format(
+                # A search filter matching against string literals, should
+                # have the string literals escaped with escape_filter_chars.
+                # Escaped characters are `/()*` (and null).
+                #
+                # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
+                # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
+                #
+                login_attr=self.user_attribute,
+                login=escape_filter_chars(username_supplied_by_user),
+            )
+            attributes = [self.lookup_dn_user_dn_attribute]
+            if fetched is not None and self.use_lookup_dn_search_user_for_searches:
+                attributes = _merge_attributes(
+                    attributes, self._user_entry_attributes()
+                )
+            self.log.debug(
+                "Looking up user with:\n"
+                f"    search_base = '{self.user_search_base}'\n"
+                f"    search_filter = '{search_filter}'\n"
+                f"    attributes = '[{', '.join(attributes)}]'"
             )
-            return (None, None)
-        entry = conn.entries[0]
+            try:
+                entries = await self._coalescing(self.lookup_dn_pool).search(
+                    search_base=self.user_search_base,
+                    search_scope=ldap3.SUBTREE,
+                    search_filter=search_filter,
+                    attributes=attributes,
+                )
+            except LDAPBindError:
+                measurement.outcome = Outcome.bad_credentials
+                self.log.error(
+                    f"Failed to bind lookup_dn_search_user '{self.lookup_dn_search_user}'"
+                )
+                return (None, None)
 
-        # identify unique attribute value within the entry
-        attribute_values = entry.entry_attributes_as_dict.get(
-            self.lookup_dn_user_dn_attribute
-        )
-        if not attribute_values:
-            if attribute_values is None:
+            # identify unique search response entry
+            n_entries = len(entries)
+            measurement.entries_found(n_entries)
+            if n_entries != 1:
+                self.lookup_dn_negative_cache.set(username_supplied_by_user, n_entries)
+            if n_entries == 0:
+                self.log.warning(
+                    f"No response looking up '{username_supplied_by_user}'"
+                )
+                return (None, None)
+            if n_entries > 1:
                 self.log.error(
-                    f"No attribute '{self.lookup_dn_user_dn_attribute}' found. "
-                    "Is lookup_dn_user_dn_attribute configured correctly?"
+                    f"Looking up '{username_supplied_by_user}' gave multiple entries, "
+                    f"expected 0 or 1 search response entries but received {n_entries}. "
+                    "Is lookup_dn_search_filter and user_attribute configured to get a "
+                    "unique match?"
                 )
-            else:
+                return (None, None)
+            entry = entries[0]
+            if fetched is not None:
+                fetched.add(entry, attributes)
+
+            # identify unique attribute value within the entry
+            attribute_values = entry.attributes.get(self.lookup_dn_user_dn_attribute)
+            if not attribute_values or len(attribute_values) > 1:
+                measurement.outcome = Outcome.error
+            if not attribute_values:
+                if attribute_values is None:
+                    self.log.error(
+                        f"No attribute '{self.lookup_dn_user_dn_attribute}' found. "
+                        "Is lookup_dn_user_dn_attribute configured correctly?"
+                    )
+                else:
+                    self.log.error(
+                        f"No attribute values for '{self.lookup_dn_user_dn_attribute}'. "
+                        "Is lookup_dn_user_dn_attribute configured correctly?"
+                    )
+                return (None, None)
+            if len(attribute_values) > 1:
                 self.log.error(
-                    f"No attribute values for '{self.lookup_dn_user_dn_attribute}'. "
+                    f"Attribute '{self.lookup_dn_user_dn_attribute}' had multiple values, "
+                    f"expected one attribute value but it had {len(attribute_values)} "
+                    f"({';'.join(attribute_values)}). "
                     "Is lookup_dn_user_dn_attribute configured correctly?"
                 )
-            return (None, None)
-        if len(attribute_values) > 1:
-            self.log.error(
-                f"Attribute '{self.lookup_dn_user_dn_attribute}' had multiple values, "
-                f"expected one attribute value but it had {len(attribute_values)} "
-                f"({';'.join(attribute_values)}). "
-                "Is lookup_dn_user_dn_attribute configured correctly?"
-            )
-            return None, None
+                return None, None
 
-        userdn = entry.entry_dn
-        username = attribute_values[0]
-        return (username, userdn)
+            userdn = entry.dn
+            username = attribute_values[0]
+            self.lookup_dn_cache.set(username_supplied_by_user, (username, userdn))
+            return (username, userdn)
+
+    async def _resolve_username(self, username_supplied_by_user, fetched):
+        """
+        Calls `resolve_username`, also if overridden as in LDAPAuthenticator
+        2.0 and earlier, without the `fetched` argument and not as a
+        coroutine.
+        """
+        if not _overridden_as_function(self.resolve_username):
+            return await self.resolve_username(
+                username_supplied_by_user, fetched=fetched
+            )
+        result = self.resolve_username(username_supplied_by_user)
+        if isawaitable(result):
+            result = await result
+        return result
 
-    def get_connection(self, userdn, password):
+    async def _get_connection(self, userdn, password):
+        """
+        Calls `get_connection`, also if overridden as in LDAPAuthenticator
+        2.0 and earlier, not as a coroutine and returning an ldap3 Connection,
+        which is then wrapped in a SyncConnection.
+        """
+        if not _overridden_as_function(self.get_connection):
+            return await self.get_connection(userdn, password)
+        conn = self.get_connection(userdn, password)
+        if isawaitable(conn):
+            conn = await conn
+        if isinstance(conn, ldap3.Connection):
+            conn = SyncConnection(conn, self._run_blocking)
+            self.connection_stats.track(conn)
+        return conn
+
+    async def get_connection(self, userdn, password):
         """
-        Returns either an ldap3 Connection object automatically bound to the
-        user, or None if the bind operation failed for some reason.
+        Returns either a connection bound to the user, or None if the bind
+        operation failed for some reason. The connection is a SyncConnection
+        wrapping an ldap3 Connection object, or an AsyncioConnection if
+        `client_mode="asyncio"` is configured.
+
+        The caller is responsible for unbinding the connection, for example
+        by using it as an async context manager, and it is counted as open in
+        `connection_stats` until then.
+
+        With multiple servers configured in `server_address`, they are tried
+        in the order decided by `server_selection` until a connection is
+        established.
 
         Raises errors on connectivity or TLS issues.
 
@@ -511,31 +2013,68 @@ class LDAPAuthenticator(Authenticator):
         - docs: https://ldap3.readthedocs.io/en/latest/connection.html
         - code: https://github.com/cannatag/ldap3/blob/dev/ldap3/core/connection.py
         """
+        servers = self.get_servers()
+        error = None
+        with self._measure(Phase.bind) as measurement:
+            for server in servers.candidates():
+                start = time.perf_counter()
+                self.connection_stats.count("bind")
+                try:
+                    conn = await self._get_server_connection(server, userdn, password)
+                except LDAPCommunicationError as e:
+                    servers.failed(server, e)
+                    error = e
+                    continue
+                servers.succeeded(server, time.perf_counter() - start)
+                if conn:
+                    self.connection_stats.track(conn)
+                else:
+                    measurement.outcome = Outcome.bad_credentials
+                return conn
+            if error is None:
+                # all servers are held down by the circuit breaker
+                error = LDAPSocketOpenError(
+                    "socket connection error while opening: all LDAP servers are marked down"
+                )
+            raise error
+
+    async def _get_server_connection(self, server, userdn, password):
+        """
+        Returns either a connection to a given Server bound to the user, or
+        None if the bind operation failed.
+        """
         if self.tls_strategy == TlsStrategy.on_connect:
-            use_ssl = True
             auto_bind = ldap3.AUTO_BIND_NO_TLS
         elif self.tls_strategy == TlsStrategy.before_bind:
-            use_ssl = False
             auto_bind = ldap3.AUTO_BIND_TLS_BEFORE_BIND
         else:  # TlsStrategy.insecure
-            use_ssl = False
             auto_bind = ldap3.AUTO_BIND_NO_TLS
 
-        tls = Tls(**self.tls_kwargs)
-        server = ldap3.Server(
-            self.server_address,
-            port=self.server_port,
-            use_ssl=use_ssl,
-            tls=tls,
-        )
         try:
-            self.log.debug(f"Attempting to bind {userdn}")
-            conn = ldap3.Connection(
-                server,
-                user=userdn,
-                password=password,
-                auto_bind=auto_bind,
-            )
+            self.log.debug(f"Attempting to bind {userdn} on {server.address}")
+            if self.client_mode == ClientMode.asyncio:
+                conn = await AsyncioConnection.open(
+                    server.address,
+                    server.port,
+                    tls=server.tls,
+                    use_ssl=server.use_ssl,
+                    connect_timeout=self.server_connect_timeout or None,
+                    receive_timeout=self.server_receive_timeout or None,
+                    tracer=self.tracer,
+                )
+                try:
+                    if auto_bind == ldap3.AUTO_BIND_TLS_BEFORE_BIND:
+                        await conn.start_tls(server.tls)
+                    await conn.bind(userdn, password)
+                except BaseException:
+                    await conn.unbind()
+                    raise
+            else:
+                conn = await self._run_blocking(
+                    self._open_sync_connection, server, userdn, password, auto_bind
+                )
+                conn = SyncConnection(conn, self._run_blocking)
+                conn._tracer = self.tracer
         except LDAPSocketOpenError as e:
             if "handshake" in str(e).lower():
                 self.log.error(
@@ -559,19 +2098,188 @@ class LDAPAuthenticator(Authenticator):
             self.log.debug(f"Successfully bound {userdn}")
             return conn
 
-    def get_user_attributes(self, conn, userdn):
+    def _open_sync_connection(self, server, userdn, password, auto_bind):
+        """
+        Returns an ldap3 Connection to a Server, bound as `userdn`, opened and
+        bound as with ldap3's `auto_bind` option, but tracing each step.
+        With "on_connect" TLS, the TLS handshake is part of connecting.
+
+        Raises LDAPBindError if the bind operation failed, and blocks. The
+        connection is unbound if any step fails.
+        """
+        conn = ldap3.Connection(
+            server.ldap3_server,
+            user=userdn,
+            password=password,
+            # ldap3 only supports whole seconds
+            receive_timeout=math.ceil(self.server_receive_timeout) or None,
+            # counting bytes received for tracing
+            collect_usage=self.tracer.enabled,
+        )
+        attributes = None
+        if self.tracer.enabled:
+            attributes = {"ldap.server": f"{server.address}:{server.port}"}
+        try:
+            with self.tracer.span("ldap.connect", attributes):
+                conn.open(read_server_info=False)
+            if auto_bind == ldap3.AUTO_BIND_TLS_BEFORE_BIND:
+                with self.tracer.span("ldap.tls", attributes):
+                    started = conn.start_tls(read_server_info=False)
+                if not started:
+                    raise LDAPStartTLSError(
+                        "automatic start_tls before bind not successful"
+                        + (" - " + conn.last_error if conn.last_error else "")
+                    )
+            with self.tracer.span("ldap.bind", attributes) as span:
+                received = conn.usage.bytes_received if conn.usage else 0
+                conn.bind(read_server_info=True)
+                if conn.usage:
+                    span.set_attribute(
+                        "ldap.bytes", conn.usage.bytes_received - received
+                    )
+                span.set_attribute(
+                    "ldap.result", (conn.result or {}).get("description")
+                )
+            if not conn.bound:
+                raise LDAPBindError(
+                    "automatic bind not successful"
+                    + (" - " + conn.last_error if conn.last_error else "")
+                )
+        except BaseException:
+            conn.unbind()
+            raise
+        return conn
+
+    def _user_entry_attributes(self):
+        """
+        Returns the attributes of the user's entry read after the user has
+        been bound, that could be fetched together with other attributes of
+        the entry.
+        """
+        names = [name for name in self.auth_state_attributes if name not in ("*", "+")]
+        if self._member_of_attribute_needed():
+            names.append(self.member_of_attribute)
+        return names
+
+    def _member_of_attribute_needed(self):
+        return (
+            bool(self.allowed_groups)
+            and self.group_membership_strategy == GroupMembershipStrategy.member_of
+            and self.group_membership_cache_ttl <= 0
+            and self.nested_group_membership == NestedGroupMembership.none
+        )
+
+    async def bind_first(self, userdns, password):
+        """
+        Returns `(userdn, conn)` for the first of `userdns` that could be
+        bound with `password`, or `(None, None)` if none could.
+
+        With `bind_dn_template_concurrency` configured above 1, up to that
+        many of the DNs are bound at the same time. The result is still the
+        first DN in order that could be bound, and connections bound for
+        later DNs are unbound. Once a DN could be bound, later DNs not being
+        bound yet are skipped.
+        """
+        concurrency = self.bind_dn_template_concurrency
+        if concurrency <= 1 or len(userdns) <= 1:
+            for userdn in userdns:
+                conn = await self._get_connection(userdn, password)
+                if conn:
+                    return userdn, conn
+            return None, None
+
+        slots = asyncio.Semaphore(concurrency)
+        decided = False
+        # the index of the first DN bound so far, as DNs after it needn't be
+        # bound anymore
+        first_bound = len(userdns)
+
+        async def bind(index, userdn):
+            nonlocal first_bound
+            async with slots:
+                if decided or index > first_bound:
+                    return None
+                conn = await self._get_connection(userdn, password)
+            if conn and (decided or index > first_bound):
+                await conn.unbind()
+                return None
+            if conn:
+                first_bound = index
+            return conn
+
+        def retrieve_exception(task):
+            # errors of attempts not awaited are expected, not worth warning
+            # about
+            if not task.cancelled():
+                task.exception()
+
+        attempts = [
+            asyncio.ensure_future(bind(index, userdn))
+            for index, userdn in enumerate(userdns)
+        ]
+        for attempt in attempts:
+            attempt.add_done_callback(retrieve_exception)
+        chosen = None
+        try:
+            # awaited in order, so that the first DN in order that could be
+            # bound is chosen regardless of which bound first
+            for userdn, attempt in zip(userdns, attempts):
+                # shielded, so that if this is cancelled, attempts binding
+                # still get to unbind their connections
+                conn = await asyncio.shield(attempt)
+                if conn:
+                    chosen = attempt
+                    return userdn, conn
+            return None, None
+        finally:
+            decided = True
+            for attempt in attempts:
+                if attempt is chosen or not attempt.done() or attempt.cancelled():
+                    continue
+                if attempt.exception() is None and attempt.result():
+                    await attempt.result().unbind()
+
+    async def _get_user_attributes(self, conn, userdn, fetched):
+        """
+        Calls `get_user_attributes`, also if overridden as in
+        LDAPAuthenticator 2.0 and earlier, without the `fetched` argument, not
+        as a coroutine, and with an ldap3 Connection, which is then that of a
+        connection of `conn` if it is a ConnectionPool, with the "sync"
+        `client_mode`.
+        """
+        if not _overridden_as_function(self.get_user_attributes):
+            return await self.get_user_attributes(conn, userdn, fetched=fetched)
+        async with AsyncExitStack() as stack:
+            if isinstance(conn, ConnectionPool):
+                conn = await stack.enter_async_context(conn.connection())
+            result = self.get_user_attributes(getattr(conn, "connection", conn), userdn)
+            if isawaitable(result):
+                result = await result
+            return result
+
+    async def get_user_attributes(self, conn, userdn, fetched=None):
+        """
+        Returns the user's `auth_state_attributes`, taken from the
+        FetchedEntries object `fetched` if they have already been fetched.
+        """
         if self.auth_state_attributes:
-            conn.search(
-                search_base=userdn,
-                search_scope=ldap3.SUBTREE,
-                search_filter="(objectClass=*)",
-                attributes=self.auth_state_attributes,
-            )
+            if fetched is not None:
+                attributes = fetched.get(userdn, self.auth_state_attributes)
+                if attributes is not None:
+                    return attributes
+            with self._measure(Phase.user_attributes) as measurement:
+                entries = await conn.search(
+                    search_base=userdn,
+                    search_scope=ldap3.SUBTREE,
+                    search_filter="(objectClass=*)",
+                    attributes=self.auth_state_attributes,
+                )
+                measurement.entries_found(len(entries))
 
             # identify unique search response entry
-            n_entries = len(conn.entries)
+            n_entries = len(entries)
             if n_entries == 1:
-                return conn.entries[0].entry_attributes_as_dict
+                return entries[0].attributes
             self.log.error(
                 f"Expected 1 but got {n_entries} search response entries for DN '{userdn}' "
                 "when looking up attributes configured via auth_state_attributes. The user's "
@@ -579,6 +2287,117 @@ class LDAPAuthenticator(Authenticator):
             )
         return {}
 
+    async def get_ldap_groups(self, conn, userdn, username, fetched=None):
+        """
+        Returns the groups in `allowed_groups` that the user is a member of,
+        determined as configured by `group_membership_strategy`, or from the
+        group members held in memory with `group_membership_cache_ttl`
+        configured.
+
+        With `group_membership_strategy="member_of"`, the user's
+        `member_of_attribute` is taken from the FetchedEntries object
+        `fetched` if it has already been fetched.
+        """
+        with self._measure(Phase.groups):
+            nested = self.nested_group_membership
+            if (
+                self.group_membership_cache_ttl > 0
+                and nested == NestedGroupMembership.none
+            ):
+                try:
+                    return await self.group_membership_cache.member_groups(
+                        self.allowed_groups, userdn, username
+                    )
+                except LDAPException as e:
+                    self.log.warning(
+                        f"Failed to fetch group members, checking groups directly: {e}"
+                    )
+
+            conn = self._coalescing(conn)
+            strategy = self.group_membership_strategy
+            if nested == NestedGroupMembership.in_chain:
+                search_filter = groups.in_chain_filter(
+                    self.group_member_attribute, userdn
+                )
+                if strategy == GroupMembershipStrategy.combined_search:
+                    return await groups.combined_search(
+                        conn, self.allowed_groups, search_filter
+                    )
+                return await groups.per_group_search(
+                    conn, self.allowed_groups, search_filter
+                )
+
+            search_filter = self.group_search_filter.format(
+                # A search filter matching against string literals, should
+                # have the string literals escaped with escape_filter_chars.
+                # Escaped characters are `/()*` (and null).
+                #
+                # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
+                # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
+                #
+                userdn=escape_filter_chars(userdn),
+                uid=escape_filter_chars(username),
+            )
+            if nested == NestedGroupMembership.client_side:
+                entries = await conn.search(
+                    search_base=self._nested_group_search_base(),
+                    search_scope=ldap3.SUBTREE,
+                    search_filter=search_filter,
+                    attributes=[ldap3.NO_ATTRIBUTES],
+                )
+                return await self.group_graph.reachable(
+                    conn, [entry.dn for entry in entries], self.allowed_groups
+                )
+            if strategy == GroupMembershipStrategy.compare:
+                return await groups.compare(
+                    conn, self.allowed_groups, self.group_member_attribute, userdn
+                )
+            if strategy == GroupMembershipStrategy.member_of:
+                if fetched is not None:
+                    attributes = fetched.get(userdn, [self.member_of_attribute])
+                    if attributes is not None:
+                        return groups.member_of_groups(
+                            self.allowed_groups, attributes, self.member_of_attribute
+                        )
+                return await groups.member_of(
+                    conn, self.allowed_groups, userdn, self.member_of_attribute
+                )
+
+            if strategy == GroupMembershipStrategy.combined_search:
+                return await groups.combined_search(
+                    conn, self.allowed_groups, search_filter
+                )
+            return await groups.per_group_search(
+                conn, self.allowed_groups, search_filter
+            )
+
+    async def _fetch_group_members(self):
+        members = {}
+        async with self.lookup_dn_pool.connection() as conn:
+            for group in self.allowed_groups:
+                entries = await conn.search(
+                    search_base=group,
+                    search_scope=ldap3.BASE,
+                    search_filter="(objectClass=*)",
+                    attributes=self.group_attributes,
+                )
+                members[group] = {}
+                if entries:
+                    for attribute in self.group_attributes:
+                        members[group][attribute] = [
+                            value
+                            async for chunk in groups.attribute_value_chunks(
+                                conn, entries[0], attribute
+                            )
+                            for value in chunk
+                        ]
+        return members
+
+    def _nested_group_search_base(self):
+        if self.nested_group_search_base is not None:
+            return self.nested_group_search_base
+        return groups.common_base(self.allowed_groups)
+
     async def authenticate(self, handler, data):
         """
         Note: This function is really meant to identify a user, and
@@ -607,10 +2426,152 @@ class LDAPAuthenticator(Authenticator):
             )
             return None
 
+        remote_ip = handler.request.remote_ip if handler is not None else None
+        if self.failed_logins_per_username.empty(login_username) or (
+            remote_ip is not None and self.failed_logins_per_ip.empty(remote_ip)
+        ):
+            self.log.warning(
+                "username:%s Login from %s rejected after too many failed logins",
+                login_username,
+                remote_ip,
+            )
+            raise web.HTTPError(
+                429, "Too many failed login attempts, please try again later."
+            )
+
+        self._ensure_group_sync()
+        with self.tracer.span("ldap.login") as span:
+            if self.credential_cache_ttl > 0:
+                auth_model = await self.credential_cache.get(login_username, password)
+                if auth_model is not None:
+                    self.log.debug(
+                        "username:%s Authenticated by a remembered login",
+                        login_username,
+                    )
+                    span.set_attribute("outcome", "remembered")
+                    return auth_model
+
+            async with self._login_slot(login_username):
+                try:
+                    auth_model = await asyncio.wait_for(
+                        self._authenticate_in_executor_slot(login_username, password),
+                        timeout=self.login_timeout or None,
+                    )
+                except asyncio.TimeoutError:
+                    self.log.warning(
+                        "username:%s Login rejected after taking over %s seconds",
+                        login_username,
+                        self.login_timeout,
+                    )
+                    raise web.HTTPError(
+                        504,
+                        "The LDAP server didn't respond in time, please try again later.",
+                    )
+            if auth_model is None:
+                self.failed_logins_per_username.take(login_username)
+                if remote_ip is not None:
+                    self.failed_logins_per_ip.take(remote_ip)
+            else:
+                # the POSIX identity is taken from the new auth_state when needed
+                self.posix_identity_cache.pop(
+                    self.normalize_username(auth_model["name"])
+                )
+            if self.credential_cache_ttl > 0:
+                if auth_model is None:
+                    self.credential_cache.pop(login_username)
+                else:
+                    await self.credential_cache.set(
+                        login_username, password, auth_model
+                    )
+            span.set_attribute(
+                "outcome", "rejected" if auth_model is None else "success"
+            )
+            return auth_model
+
+    @asynccontextmanager
+    async def _login_slot(self, login_username):
+        """
+        Waits for fewer than `max_concurrent_logins` logins to be interacting
+        with the LDAP server, raising a 503 error if too many logins are
+        waiting already or if waiting for `login_queue_timeout` seconds.
+        """
+        if not self.max_concurrent_logins:
+            yield
+            return
+
+        if self._login_slots.locked() and self._queued_logins >= self.max_queued_logins:
+            self.log.warning(
+                "username:%s Login rejected as %s logins are waiting already",
+                login_username,
+                self._queued_logins,
+            )
+            raise web.HTTPError(
+                503, "Too many logins in progress, please try again later."
+            )
+        self._queued_logins += 1
+        try:
+            await asyncio.wait_for(
+                self._login_slots.acquire(), timeout=self.login_queue_timeout
+            )
+        except asyncio.TimeoutError:
+            self.log.warning(
+                "username:%s Login rejected after waiting %s seconds to start",
+                login_username,
+                self.login_queue_timeout,
+            )
+            raise web.HTTPError(
+                503, "Too many logins in progress, please try again later."
+            )
+        finally:
+            self._queued_logins -= 1
+        try:
+            yield
+        finally:
+            self._login_slots.release()
+
+    async def _authenticate_in_executor_slot(self, login_username, password):
+        """
+        Calls `authenticate_ldap_user`, waiting for a worker thread to become
+        available first with `executor_threads` configured.
+        """
+        if not self.executor_threads or self.client_mode == ClientMode.asyncio:
+            return await self.authenticate_ldap_user(login_username, password)
+
+        try:
+            await asyncio.wait_for(
+                self._executor_slots.acquire(), timeout=self.executor_queue_timeout
+            )
+        except asyncio.TimeoutError:
+            self.log.warning(
+                "username:%s Login rejected after waiting %s seconds for an available thread",
+                login_username,
+                self.executor_queue_timeout,
+            )
+            raise web.HTTPError(
+                503, "Too many logins in progress, please try again later."
+            )
+        try:
+            return await self.authenticate_ldap_user(login_username, password)
+        finally:
+            self._executor_slots.release()
+
+    async def authenticate_ldap_user(self, login_username, password):
+        """
+        Performs the LDAP interactions of `authenticate` for a validated
+        username and password, and returns an auth model or None.
+
+        With `executor_threads` configured, this holds one of the worker
+        threads' slots while its blocking LDAP operations run in them.
+        """
         bind_dn_template = self.bind_dn_template
         resolved_username = login_username
+        # entries fetched during this login, reused instead of searching for
+        # them again
+        fetched = FetchedEntries()
         if self.lookup_dn:
-            resolved_username, resolved_dn = self.resolve_username(login_username)
+            resolved_username, resolved_dn = await self._resolve_username(
+                login_username, fetched
+            )
             if not resolved_dn:
                 self.log.warning(
                     "username:%s Login denied for failed lookup", login_username
@@ -620,8 +2581,12 @@ class LDAPAuthenticator(Authenticator):
                 bind_dn_template = [resolved_dn]
 
         # bind to ldap user
-        conn = None
-        for dn in bind_dn_template:
+        adaptive = self.adaptive_bind_dn_template_order and len(bind_dn_template) > 1
+        if adaptive:
+            bind_dn_template = self.bind_dn_template_order.order(
+                resolved_username, bind_dn_template
+            )
+        userdns = [
             # A DN represented as a string should have its attribute values
             # escaped with escape_rdn. Escaped characters are `\,+"<>;=` (and
             # null).
@@ -629,10 +2594,18 @@ class LDAPAuthenticator(Authenticator):
             # ref: https://datatracker.ietf.org/doc/html/rfc4514#section-2.4.
             # ref: https://ldap3.readthedocs.io/en/latest/connection.html?highlight=escape_rdn
             #
-            userdn = dn.format(username=escape_rdn(resolved_username))
-            conn = self.get_connection(userdn, password)
+            dn.format(username=escape_rdn(resolved_username))
+            for dn in bind_dn_template
+        ]
+        userdn, conn = await self.bind_first(userdns, password)
+        if adaptive:
             if conn:
-                break
+                attempt = userdns.index(userdn)
+                self.bind_dn_template_order.succeeded(
+                    resolved_username, bind_dn_template[attempt], attempt
+                )
+            else:
+                self.bind_dn_template_order.failed(resolved_username)
         if not conn:
             if login_username == resolved_username:
                 self.log.warning(
@@ -646,58 +2619,73 @@ class LDAPAuthenticator(Authenticator):
                 )
             return None
 
-        if self.search_filter:
-            conn.search(
-                search_base=self.user_search_base,
-                search_scope=ldap3.SUBTREE,
-                search_filter=self.search_filter.format(
-                    # A search filter matching against string literals, should
-                    # have the string literals escaped with escape_filter_chars.
-                    # Escaped characters are `/()*` (and null).
-                    #
-                    # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
-                    # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
-                    #
-                    userattr=self.user_attribute,
-                    username=escape_filter_chars(resolved_username),
-                ),
-                attributes=self.attributes,
-            )
-            n_entries = len(conn.entries)
-            if n_entries != 1:
-                self.log.warning(
-                    f"Login of '{login_username}' denied. Configured search_filter "
-                    f"found {n_entries} users associated with "
-                    f"userattr='{self.user_attribute}' and username='{resolved_username}', "
-                    "and a unique match is required."
-                )
-                return None
-
-        ldap_groups = []
-        if self.allowed_groups:
-            self.log.debug("username:%s Using dn %s", resolved_username, userdn)
-            for group in self.allowed_groups:
-                found = conn.search(
-                    search_base=group,
+        async with AsyncExitStack() as stack:
+            if self.use_lookup_dn_search_user_for_searches:
+                await conn.unbind()
+                conn = self.lookup_dn_pool
+            else:
+                # unbound when done, also if an error is raised
+                await stack.enter_async_context(conn)
+            user_entry_attributes = self._user_entry_attributes()
+            if fetched.get(userdn, user_entry_attributes) is not None:
+                user_entry_attributes = []
+            if self.search_filter:
+                # fetch the attributes of the user's entry needed later too,
+                # as search_filter typically matches it
+                attributes = _merge_attributes(self.attributes, user_entry_attributes)
+                with self._measure(Phase.search_filter) as measurement:
+                    entries = await conn.search(
+                        search_base=self.user_search_base,
+                        search_scope=ldap3.SUBTREE,
+                        search_filter=self.search_filter.format(
+                            # A search filter matching against string literals, should
+                            # have the string literals escaped with escape_filter_chars.
+                            # Escaped characters are `/()*` (and null).
+                            #
+                            # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
+                            # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
+                            #
+                            userattr=self.user_attribute,
+                            username=escape_filter_chars(resolved_username),
+                        ),
+                        attributes=attributes,
+                    )
+                    measurement.entries_found(len(entries))
+                n_entries = len(entries)
+                if n_entries != 1:
+                    self.log.warning(
+                        f"Login of '{login_username}' denied. Configured search_filter "
+                        f"found {n_entries} users associated with "
+                        f"userattr='{self.user_attribute}' and username='{resolved_username}', "
+                        "and a unique match is required."
+                    )
+                    return None
+                fetched.add(entries[0], attributes)
+
+            if (
+                self.auth_state_attributes
+                and self._member_of_attribute_needed()
+                and fetched.get(userdn, user_entry_attributes) is None
+            ):
+                # read the user's entry once for both purposes
+                entries = await conn.search(
+                    search_base=userdn,
                     search_scope=ldap3.BASE,
-                    search_filter=self.group_search_filter.format(
-                        # A search filter matching against string literals, should
-                        # have the string literals escaped with escape_filter_chars.
-                        # Escaped characters are `/()*` (and null).
-                        #
-                        # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
-                        # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
-                        #
-                        userdn=escape_filter_chars(userdn),
-                        uid=escape_filter_chars(resolved_username),
-                    ),
-                    attributes=self.group_attributes,
+                    search_filter="(objectClass=*)",
+                    attributes=user_entry_attributes,
+                )
+                if len(entries) == 1:
+                    fetched.add(entries[0], user_entry_attributes)
+
+            ldap_groups = []
+            if self.allowed_groups:
+                self.log.debug("username:%s Using dn %s", resolved_username, userdn)
+                ldap_groups = await self.get_ldap_groups(
+                    conn, userdn, resolved_username, fetched=fetched
                 )
-                if found:
-                    ldap_groups.append(group)
-                    # Returned in auth_state, so fetch the full list
 
-        user_attributes = self.get_user_attributes(conn, userdn)
+            user_attributes = await self._get_user_attributes(conn, userdn, fetched)
+
         self.log.debug("username:%s attributes:%s", login_username, user_attributes)
 
         username = resolved_username if self.use_lookup_dn_username else login_username
@@ -705,7 +2693,10 @@ class LDAPAuthenticator(Authenticator):
             "ldap_groups": ldap_groups,
             "user_attributes": user_attributes,
         }
-        return {"name": username, "auth_state": auth_state}
+        auth_model = {"name": username, "auth_state": auth_state}
+        if self.manage_groups:
+            auth_model["groups"] = self._managed_groups(username, ldap_groups)
+        return auth_model
 
     async def check_allowed(self, username, auth_model):
         if not hasattr(self, "allow_all"):
@@ -736,21 +2727,426 @@ class LDAPAuthenticator(Authenticator):
             )
         return False
 
-    async def pre_spawn_start(self, user, spawner):
-        auth_state = await user.get_auth_state()
-        # create uid and gid environment variables to be picked up by spawner
-        self.log.debug('pre_spawn_start')
-        self.log.debug('initial spawner environment:')
-        self.log.debug(spawner.environment)
-        self.log.debug('user.name: %s', user.name)
-        self.log.debug('auth_state: %s', str(auth_state))
-        spawner.environment['NB_USER'] = user.name
-        if auth_state['user_attributes']['uidNumber'][0] > -1:
-            spawner.environment['NB_UID'] = str(auth_state['user_attributes']['uidNumber'][0])
-        if auth_state['user_attributes']['gidNumber'][0] > -1:
-            spawner.environment['NB_GID'] = str(auth_state['user_attributes']['gidNumber'][0])
-        if auth_state['user_attributes']['homeDirectory'][0]:
-            spawner.environment['NB_HOMEDIR'] = auth_state['user_attributes']['homeDirectory'][0]
-        self.log.debug('final spawner environment:')
-        self.log.debug(spawner.environment)
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.group_sync_interval > 0 and not self.manage_groups:
+            self.log.warning(
+                "LDAPAuthenticator.group_sync_interval is ignored without "
+                "Authenticator.manage_groups enabled"
+            )
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # started by the first login instead
+            return
+        self._ensure_group_sync()
+
+    async def close(self):
+        """
+        Stops the background tasks of LDAPAuthenticator, such as the
+        `group_sync_interval` job, and unbinds its pooled connections.
+
+        JupyterHub doesn't call this by itself; it is meant for subclasses
+        and tools using LDAPAuthenticator outside of JupyterHub.
+        """
+        if self._group_syncer is not None:
+            self._group_syncer.cancel()
+            self._group_syncer = None
+        if self.trait_has_value("group_membership_cache"):
+            self.group_membership_cache.close()
+        if self._servers is not None:
+            self._servers.close()
+            self._servers = None
+        if self.trait_has_value("lookup_dn_pool"):
+            await self.lookup_dn_pool.close()
+
+    def _ensure_group_sync(self):
+        if self.group_sync_interval <= 0 or not self.manage_groups:
+            return
+        if self._group_syncer is None or self._group_syncer.done():
+            self._group_syncer = asyncio.ensure_future(self._sync_groups_periodically())
+
+    async def _sync_groups_periodically(self):
+        while True:
+            try:
+                await self.sync_groups()
+            except Exception as e:
+                self.log.warning(f"Failed to sync groups: {e}")
+            await asyncio.sleep(self.group_sync_interval)
+
+    async def sync_groups(self):
+        """
+        Makes a pass of `group_sync`, and applies the changes found with
+        `apply_group_changes`.
+        """
+        changes = await self.group_sync.sync()
+        if changes:
+            await self.apply_group_changes(changes)
+
+    def group_name(self, group_dn):
+        """
+        Returns the name of the JupyterHub group mirroring an LDAP group: the
+        value of the first RDN of its DN, such as "ship_crew" for
+        "cn=ship_crew,ou=people,dc=planetexpress,dc=com".
+        """
+        rdn, _ = groups.split_dn(group_dn)
+        return rdn[0][1]
 
+    async def apply_group_changes(self, changes):
+        """
+        Applies the changes found by a pass of `group_sync`, a dict mapping
+        group DNs to the sets of usernames added and removed, to the groups in
+        JupyterHub's database. Usernames of users that don't exist in
+        JupyterHub are skipped, as they are assigned their groups when they
+        log in.
+
+        Does nothing without `manage_groups` enabled, leaving JupyterHub's
+        groups to be managed by other means.
+        """
+        from jupyterhub import orm
+
+        if not self.manage_groups:
+            self.log.warning("Not applying group changes without manage_groups")
+            return
+        db = getattr(self.parent, "db", None)
+        if db is None:
+            self.log.warning("Not applying group changes without JupyterHub's database")
+            return
+        for group_dn, (added, removed) in changes.items():
+            name = self.group_name(group_dn)
+            group = orm.Group.find(db, name)
+            if group is None:
+                if not added:
+                    continue
+                self.log.info(f"Creating group {name}")
+                group = orm.Group(name=name)
+                db.add(group)
+            for username in added:
+                user = orm.User.find(db, username)
+                if user is not None and group not in user.groups:
+                    self.log.info(f"Adding user {username} to group {name}")
+                    group.users.append(user)
+            for username in removed:
+                user = orm.User.find(db, username)
+                if user is not None and group in user.groups:
+                    self.log.info(f"Removing user {username} from group {name}")
+                    group.users.remove(user)
+        db.commit()
+
+    def _managed_groups(self, username, ldap_groups):
+        """
+        Returns the names of the JupyterHub groups of a user with
+        `manage_groups` enabled, taken from the last pass of `group_sync` if
+        there has been one.
+        """
+        if self.group_sync_interval > 0 and self.group_sync.passes:
+            ldap_groups = self.group_sync.member_groups(
+                self.normalize_username(username)
+            )
+        return [self.group_name(group) for group in ldap_groups]
+
+    async def refresh_user(self, user, handler=None):
+        """
+        With `refresh_users` configured, checks the user again with the LDAP
+        server, returning an updated auth model, or False if the user should
+        log in again. Returns True, keeping the current auth model, otherwise.
+
+        JupyterHub calls this when the user's auth model is older than
+        `auth_refresh_age` seconds.
+        """
+        if not self.refresh_users:
+            return True
+        if not self.user_search_base or not self.user_attribute:
+            self.log.warning(
+                "refresh_users requires user_search_base and user_attribute "
+                "to be configured, not checking '%s' again",
+                user.name,
+            )
+            return True
+        if self._refresh_tokens.empty(None):
+            self.log.debug(
+                "username:%s Check deferred by refresh_rate_limit", user.name
+            )
+            return True
+        self._refresh_tokens.take(None)
+
+        try:
+            auth_model = await self.refresh_batcher.submit(user.name)
+        except LDAPException as e:
+            self.log.warning(
+                "username:%s Failed to check again, keeping auth state: %s",
+                user.name,
+                e,
+            )
+            return True
+        if auth_model is None:
+            self.log.warning(
+                "username:%s No longer matches a unique LDAP user, requiring login",
+                user.name,
+            )
+            self._forget_user(user.name)
+            return False
+        if not await self.check_allowed(user.name, auth_model):
+            self.log.warning(
+                "username:%s No longer allowed, requiring login", user.name
+            )
+            self._forget_user(user.name)
+            return False
+        if self.trait_has_value("credential_cache"):
+            self.credential_cache.update(user.name, auth_model)
+        # the POSIX identity is taken from the new auth_state when needed
+        self.posix_identity_cache.pop(user.name)
+        return auth_model
+
+    def _forget_user(self, name):
+        """
+        Forgets what is remembered about the JupyterHub user `name`, as it
+        was denied when checked again: its remembered logins, lookups and
+        POSIX identity.
+        """
+        usernames = {name}
+        if self.trait_has_value("credential_cache"):
+            usernames.update(self.credential_cache.usernames(name))
+        for username in usernames:
+            self.invalidate_credential_cache(username=username)
+            self.invalidate_lookup_dn_cache(username=username)
+        self.posix_identity_cache.pop(name)
+
+    async def _refresh_users(self, usernames):
+        """
+        Returns a dict mapping each of `usernames` to an auth model built from
+        their current LDAP entries, or None for those not matching a unique
+        entry or `search_filter`.
+
+        Entries are found with `lookup_dn_search_filter`, as when logging in,
+        and attributed to the usernames by their `user_attribute` value, or
+        `lookup_dn_user_dn_attribute` value with `use_lookup_dn_username`.
+        """
+        pool = self.lookup_dn_pool
+        if self.lookup_dn and self.use_lookup_dn_username:
+            name_attribute = self.lookup_dn_user_dn_attribute
+        else:
+            name_attribute = self.user_attribute
+        user_entry_attributes = self._user_entry_attributes()
+        attributes = _merge_attributes(
+            [name_attribute],
+            [self.lookup_dn_user_dn_attribute] if self.lookup_dn else [],
+            user_entry_attributes,
+        )
+        entries = await pool.search(
+            search_base=self.user_search_base,
+            search_scope=ldap3.SUBTREE,
+            search_filter="(|{})".format(
+                "".join(
+                    self.lookup_dn_search_filter.format(
+                        login_attr=name_attribute,
+                        login=escape_filter_chars(username),
+                    )
+                    for username in usernames
+                )
+            ),
+            attributes=attributes,
+        )
+
+        # username -> entries with it as their name_attribute value
+        matches = {username: [] for username in usernames}
+        folded = {username.casefold(): username for username in usernames}
+        fetched = FetchedEntries()
+        for entry in entries:
+            fetched.add(entry, attributes)
+            for name, values in entry.attributes.items():
+                if name.lower() != name_attribute.lower():
+                    continue
+                for value in [values] if isinstance(values, str) else values:
+                    username = folded.get(str(value).casefold())
+                    if username is not None:
+                        matches[username].append(entry)
+
+        # username -> (resolved username, DN)
+        users = {}
+        for username, user_entries in matches.items():
+            if len(user_entries) != 1:
+                continue
+            entry = user_entries[0]
+            resolved_username = username
+            if self.lookup_dn:
+                values = fetched.get(entry.dn, [self.lookup_dn_user_dn_attribute])
+                values = list(values.values())[0] if values else []
+                if len(values) != 1:
+                    continue
+                resolved_username = str(values[0])
+            users[username] = (resolved_username, entry.dn)
+
+        if self.search_filter and users:
+            entries = await pool.search(
+                search_base=self.user_search_base,
+                search_scope=ldap3.SUBTREE,
+                search_filter="(|{})".format(
+                    "".join(
+                        self.search_filter.format(
+                            userattr=self.user_attribute,
+                            username=escape_filter_chars(resolved_username),
+                        )
+                        for resolved_username, _ in users.values()
+                    )
+                ),
+                attributes=[],
+            )
+            matching = {groups.normalize_dn(entry.dn) for entry in entries}
+            users = {
+                username: user
+                for username, user in users.items()
+                if groups.normalize_dn(user[1]) in matching
+            }
+
+        # the members of allowed_groups, fetched once for all users when they
+        # aren't held in memory and can't be read from the users' entries
+        members = None
+        if (
+            self.allowed_groups
+            and self.group_membership_cache_ttl <= 0
+            and self.group_membership_strategy != GroupMembershipStrategy.member_of
+            and self.nested_group_membership == NestedGroupMembership.none
+            and users
+        ):
+            members = groups.normalize_members(await self._fetch_group_members())
+
+        auth_models = {}
+        for username, (resolved_username, userdn) in users.items():
+            ldap_groups = []
+            if members is not None:
+                ldap_groups = groups.member_groups(
+                    members, self.allowed_groups, userdn, resolved_username
+                )
+            elif self.allowed_groups:
+                ldap_groups = await self.get_ldap_groups(
+                    pool, userdn, resolved_username, fetched=fetched
+                )
+            user_attributes = await self._get_user_attributes(pool, userdn, fetched)
+            auth_models[username] = {
+                "name": username,
+                "auth_state": {
+                    "ldap_groups": ldap_groups,
+                    "user_attributes": user_attributes,
+                },
+            }
+            if self.manage_groups:
+                auth_models[username]["groups"] = self._managed_groups(
+                    username, ldap_groups
+                )
+        return auth_models
+
+    async def get_posix_identity(self, user):
+        """
+        Returns a dict with the "uidNumber", "gidNumber" and "homeDirectory"
+        of a JupyterHub user, and the gidNumbers of their supplementary
+        "groups", with None for those that aren't known.
+
+        Values found in the user's `auth_state["user_attributes"]`, as
+        configured by `auth_state_attributes`, are used. Others are read from
+        the user's entry below `user_search_base`, found with
+        `lookup_dn_search_filter` matching the username against
+        `user_attribute`, or `lookup_dn_user_dn_attribute` with
+        `use_lookup_dn_username` configured, and the groups are found with
+        `posix_groups_search_base` if configured, bound as
+        `lookup_dn_search_user`.
+
+        Identities are remembered as configured by `posix_identity_cache_ttl`,
+        so that this is usually done once per user, not once per spawn.
+        """
+        identity = self.posix_identity_cache.get(user.name)
+        if identity is None:
+            auth_state = await user.get_auth_state() or {}
+            attributes = auth_state.get("user_attributes") or {}
+            identity = {
+                name: _first_value(attributes, name, convert)
+                for name, convert in _POSIX_ATTRIBUTES.items()
+            }
+            identity["groups"] = None
+            unknown = [name for name in _POSIX_ATTRIBUTES if identity[name] is None]
+            if unknown or self.posix_groups_search_base:
+                identity = await self.singleflight.run(
+                    ("posix_identity", user.name),
+                    self._fetch_posix_identity,
+                    user.name,
+                    identity,
+                )
+            else:
+                self.posix_identity_cache.set(user.name, identity)
+        return copy.deepcopy(identity)
+
+    async def _fetch_posix_identity(self, username, identity):
+        """
+        Returns `identity` with its unknown values read from the LDAP server,
+        remembering it unless an error occurred.
+        """
+        identity = dict(identity)
+        missing = [name for name in _POSIX_ATTRIBUTES if identity[name] is None]
+        if self.lookup_dn and self.use_lookup_dn_username:
+            name_attribute = self.lookup_dn_user_dn_attribute
+        else:
+            name_attribute = self.user_attribute
+        try:
+            if missing and self.user_search_base and name_attribute:
+                search_filter = self.lookup_dn_search_filter.format(
+                    login_attr=name_attribute,
+                    login=escape_filter_chars(username),
+                )
+                entries = await self._coalescing(self.lookup_dn_pool).search(
+                    search_base=self.user_search_base,
+                    search_scope=ldap3.SUBTREE,
+                    search_filter=search_filter,
+                    attributes=missing,
+                )
+                if len(entries) == 1:
+                    attributes = entries[0].attributes
+                    for name in missing:
+                        identity[name] = _first_value(
+                            attributes, name, _POSIX_ATTRIBUTES[name]
+                        )
+                else:
+                    self.log.warning(
+                        f"Expected 1 but got {len(entries)} entries looking up "
+                        f"the POSIX identity of '{username}'"
+                    )
+            if self.posix_groups_search_base:
+                search_filter = self.posix_groups_search_filter.format(
+                    username=escape_filter_chars(username)
+                )
+                entries = await self._coalescing(self.lookup_dn_pool).search(
+                    search_base=self.posix_groups_search_base,
+                    search_scope=ldap3.SUBTREE,
+                    search_filter=search_filter,
+                    attributes=["gidNumber"],
+                )
+                gids = {_first_value(e.attributes, "gidNumber", int) for e in entries}
+                gids -= {None, identity["gidNumber"]}
+                identity["groups"] = sorted(gids)
+        except LDAPException as e:
+            self.log.warning(
+                f"Failed to look up the POSIX identity of '{username}': {e!r}"
+            )
+            return identity
+        self.posix_identity_cache.set(username, identity)
+        return identity
+
+    async def pre_spawn_start(self, user, spawner):
+        """
+        Sets the user's name and POSIX identity, as returned by
+        `get_posix_identity`, in the spawner's environment as `NB_USER`,
+        `NB_UID`, `NB_GID`, `NB_HOMEDIR` and `NB_SUPPLEMENTARY_GIDS`, where
+        known.
+        """
+        identity = await self.get_posix_identity(user)
+        spawner.environment["NB_USER"] = user.name
+        if identity["uidNumber"] is not None and identity["uidNumber"] > -1:
+            spawner.environment["NB_UID"] = str(identity["uidNumber"])
+        if identity["gidNumber"] is not None and identity["gidNumber"] > -1:
+            spawner.environment["NB_GID"] = str(identity["gidNumber"])
+        if identity["homeDirectory"]:
+            spawner.environment["NB_HOMEDIR"] = identity["homeDirectory"]
+        if identity["groups"]:
+            spawner.environment["NB_SUPPLEMENTARY_GIDS"] = ",".join(
+                map(str, identity["groups"])
+            )
+        self.log.debug("Spawning %s with POSIX identity %s", user.name, identity)
@@ -0,0 +1,310 @@
+"""
+A load generator measuring how many logins LDAPAuthenticator handles against
+an LDAP server, for sizing a JupyterHub deployment.
+
+Run `python -m ldapauthenticator.loadtest --help` for usage. Logins are made
+by calling `LDAPAuthenticator.authenticate` as JupyterHub would, configured
+by a JupyterHub config file, either against the LDAP servers it configures
+or against the in-process stand-in of `ldapauthenticator.fakeldap`.
+"""
+
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import logging
+import math
+import os
+import sys
+import time
+from collections import Counter
+
+from tornado import web
+from traitlets.config import Config
+from traitlets.config.loader import JSONFileConfigLoader, PyFileConfigLoader
+
+from .fakeldap import FakeLDAPServer
+from .ldapauthenticator import LDAPAuthenticator
+
+# users and configuration used with --stand-in if none are provided
+STAND_IN_USERS = [
+    (uid, uid) for uid in ["professor", "hermes", "fry", "leela", "bender"]
+]
+STAND_IN_CONFIG = {
+    "lookup_dn": True,
+    "bind_dn_template": "cn={username},ou=people,dc=planetexpress,dc=com",
+    "user_search_base": "ou=people,dc=planetexpress,dc=com",
+    "user_attribute": "uid",
+    "lookup_dn_user_dn_attribute": "cn",
+    "allowed_groups": [
+        "cn=admin_staff,ou=people,dc=planetexpress,dc=com",
+        "cn=ship_crew,ou=people,dc=planetexpress,dc=com",
+    ],
+}
+
+
+def load_config(path):
+    """
+    Returns the traitlets Config loaded from a Python or JSON config file,
+    such as a jupyterhub_config.py file.
+    """
+    directory, filename = os.path.split(os.path.abspath(path))
+    if filename.endswith(".json"):
+        loader = JSONFileConfigLoader(filename, path=directory)
+    else:
+        loader = PyFileConfigLoader(filename, path=directory)
+    return loader.load_config()
+
+
+def read_users(path):
+    """
+    Returns a list of (username, password) tuples read from a CSV file with
+    a username and a password per row, and an optional header row.
+    """
+    with open(path, newline="") as f:
+        rows = [row for row in csv.reader(f) if row]
+    if rows and [c.strip().lower() for c in rows[0][:2]] == ["username", "password"]:
+        rows = rows[1:]
+    users = []
+    for n, row in enumerate(rows, 1):
+        if len(row) < 2:
+            raise ValueError(f"{path}: row {n} doesn't have a username and password")
+        users.append((row[0], row[1]))
+    return users
+
+
+def error_class(error):
+    """
+    Returns the name that an error raised by `authenticate` is counted as.
+    """
+    if isinstance(error, web.HTTPError):
+        return f"HTTPError {error.status_code}"
+    return type(error).__name__
+
+
+def percentile(values, p):
+    """
+    Returns the `p`th percentile of sorted `values` by the nearest-rank
+    method, or None if there are no values.
+    """
+    if not values:
+        return None
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class Results:
+    """
+    The outcomes and latencies of the logins made by `run`.
+
+    Outcomes are "success", "rejected" for logins returning None, such as
+    with a wrong password or a user not in `allowed_groups`, or the class of
+    the error raised, as named by `error_class`.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.outcomes = Counter()
+        self.duration = 0
+        self.operations = Counter()
+        self.connections = 0
+
+    def record(self, latency, outcome):
+        self.latencies.append(latency)
+        self.outcomes[outcome] += 1
+
+    @property
+    def logins(self):
+        return len(self.latencies)
+
+    def summary(self):
+        """
+        Returns the results as a dict, with latencies in seconds.
+        """
+        latencies = sorted(self.latencies)
+        logins = self.logins or 1
+        return {
+            "logins": self.logins,
+            "duration": self.duration,
+            "throughput": self.logins / self.duration if self.duration else 0,
+            "outcomes": dict(self.outcomes.most_common()),
+            "latency": {
+                "mean": sum(latencies) / logins,
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else None,
+            },
+            "ldap_operations_per_login": {
+                operation: n / logins for operation, n in self.operations.items()
+            },
+            "connections_per_login": self.connections / logins,
+        }
+
+    def report(self):
+        """
+        Returns the results as human readable text.
+        """
+        summary = self.summary()
+
+        def ms(seconds):
+            return "-" if seconds is None else f"{seconds * 1000:.1f}ms"
+
+        outcomes = ", ".join(f"{k}: {v}" for k, v in summary["outcomes"].items())
+        latency = ", ".join(f"{k} {ms(v)}" for k, v in summary["latency"].items())
+        per_login = summary["ldap_operations_per_login"]
+        operations = ", ".join(f"{k} {v:.2f}" for k, v in sorted(per_login.items()))
+        return "\n".join(
+            [
+                f"Logins:     {summary['logins']} in {summary['duration']:.2f}s, "
+                f"{summary['throughput']:.1f}/s",
+                f"Outcomes:   {outcomes}",
+                f"Latency:    {latency}",
+                f"LDAP operations per login: {sum(per_login.values()):.2f} "
+                f"({operations or 'none'}), "
+                f"connections per login: {summary['connections_per_login']:.2f}",
+            ]
+        )
+
+
+async def run(authenticator, users, logins, concurrency, rate=0):
+    """
+    Makes `logins` logins with `authenticator`, cycling through `users`, a
+    list of (username, password) tuples, with up to `concurrency` logins in
+    progress at a time, started at `rate` logins per second if not 0, and
+    returns their `Results`.
+    """
+    results = Results()
+    users = itertools.cycle(users)
+    scheduled = iter(range(logins))
+    operations = Counter(authenticator.connection_stats.operations)
+    connections = authenticator.connection_stats.opened
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def worker():
+        # workers share `scheduled`, taking the next login when done
+        for n in scheduled:
+            if rate:
+                await asyncio.sleep(start + n / rate - loop.time())
+            username, password = next(users)
+            started = time.perf_counter()
+            try:
+                auth_model = await authenticator.authenticate(
+                    None, {"username": username, "password": password}
+                )
+            except Exception as e:
+                outcome = error_class(e)
+            else:
+                outcome = "rejected" if auth_model is None else "success"
+            results.record(time.perf_counter() - started, outcome)
+
+    await asyncio.gather(*(worker() for _ in range(max(concurrency, 1))))
+    results.duration = loop.time() - start
+    results.operations = authenticator.connection_stats.operations - operations
+    results.connections = authenticator.connection_stats.opened - connections
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m ldapauthenticator.loadtest",
+        description=(
+            "Measures the throughput and latency of LDAPAuthenticator logins, "
+            "configured by a JupyterHub config file."
+        ),
+    )
+    parser.add_argument(
+        "-f",
+        "--config",
+        help="A JupyterHub config file (.py or .json) configuring LDAPAuthenticator",
+    )
+    parser.add_argument(
+        "-u",
+        "--users",
+        help="A CSV file with a username and password per row",
+    )
+    parser.add_argument(
+        "-n",
+        "--logins",
+        type=int,
+        default=1000,
+        help="The number of logins to make, cycling through the users (default: 1000)",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=10,
+        help="The maximum number of logins in progress at a time (default: 10)",
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        type=float,
+        default=0,
+        help="Logins to start per second, or 0 for as many as possible (default: 0)",
+    )
+    parser.add_argument(
+        "--stand-in",
+        action="store_true",
+        help=(
+            "Log in against an in-process stand-in for the LDAP server with "
+            "the planetexpress test data, instead of the configured servers"
+        ),
+    )
+    parser.add_argument(
+        "--stand-in-latency",
+        type=float,
+        default=0,
+        help="Seconds to delay each LDAP operation of the stand-in by (default: 0)",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument(
+        "--log-level",
+        default="WARNING",
+        help="The log level of LDAPAuthenticator (default: WARNING)",
+    )
+    args = parser.parse_args(argv)
+    if not args.stand_in and not (args.config and args.users):
+        parser.error("--config and --users are required without --stand-in")
+    return args
+
+
+async def _main(args, config, users):
+    authenticator = LDAPAuthenticator(config=config)
+    try:
+        return await run(authenticator, users, args.logins, args.concurrency, args.rate)
+    finally:
+        await authenticator.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    config = load_config(args.config) if args.config else Config()
+    users = read_users(args.users) if args.users else STAND_IN_USERS
+
+    server = None
+    if args.stand_in:
+        server = FakeLDAPServer(latency=args.stand_in_latency).start()
+        if not args.config:
+            for name, value in STAND_IN_CONFIG.items():
+                setattr(config.LDAPAuthenticator, name, value)
+        config.LDAPAuthenticator.server_address = server.host
+        config.LDAPAuthenticator.server_port = server.port
+    try:
+        results = asyncio.run(_main(args, config, users))
+    finally:
+        if server is not None:
+            server.stop()
+
+    if args.json:
+        print(json.dumps(results.summary(), indent=2))
+    else:
+        print(results.report())
+    return 0 if results.outcomes["success"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Prometheus metrics exported by LDAPAuthenticator, registered with the
+prometheus_client default registry that JupyterHub exports on
+`/hub/metrics`.
+
+Like JupyterHub's metrics, the label values are listed in Enums and created
+up front, so that for example
+`ldapauthenticator_phase_duration_seconds{outcome="tls_error"}` exists before
+the first TLS error happens.
+"""
+
+import ssl
+import time
+from contextlib import contextmanager
+from enum import Enum
+
+from ldap3.core.exceptions import (
+    LDAPBindError,
+    LDAPCommunicationError,
+    LDAPSocketOpenError,
+    LDAPStartTLSError,
+)
+from prometheus_client import Counter, Histogram
+
+metrics_prefix = "ldapauthenticator"
+
+
+class Phase(Enum):
+    """
+    The phases of a login measured by `PHASE_DURATION_SECONDS`.
+    """
+
+    # resolve_username looking up the user's DN with lookup_dn
+    lookup_dn = "lookup_dn"
+    # get_connection connecting to a server and binding
+    bind = "bind"
+    # the search with search_filter
+    search_filter = "search_filter"
+    # get_ldap_groups checking membership of allowed_groups
+    groups = "groups"
+    # get_user_attributes reading auth_state_attributes
+    user_attributes = "user_attributes"
+
+    def __str__(self):
+        return self.value
+
+
+class Outcome(Enum):
+    """
+    The outcomes of phases of a login.
+    """
+
+    success = "success"
+    bad_credentials = "bad_credentials"
+    not_found = "not_found"
+    multiple_matches = "multiple_matches"
+    socket_error = "socket_error"
+    tls_error = "tls_error"
+    error = "error"
+
+    def __str__(self):
+        return self.value
+
+
+class Operation(Enum):
+    """
+    The LDAP operations counted by `OPERATIONS`.
+    """
+
+    bind = "bind"
+    search = "search"
+    compare = "compare"
+
+    def __str__(self):
+        return self.value
+
+
+PHASE_DURATION_SECONDS = Histogram(
+    "phase_duration_seconds",
+    "Time taken for a phase of LDAP authentication",
+    ["phase", "outcome"],
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf")],
+    namespace=metrics_prefix,
+)
+
+for phase in Phase:
+    for outcome in Outcome:
+        PHASE_DURATION_SECONDS.labels(phase=phase, outcome=outcome)
+
+OPERATIONS = Counter(
+    "ldap_operations",
+    "Number of LDAP operations requested",
+    ["operation"],
+    namespace=metrics_prefix,
+)
+
+for operation in Operation:
+    OPERATIONS.labels(operation=operation)
+
+
+def error_outcome(error):
+    """
+    Returns the Outcome representing an error raised during a phase.
+    """
+    if isinstance(error, (LDAPStartTLSError, ssl.SSLError)):
+        return Outcome.tls_error
+    if isinstance(error, LDAPSocketOpenError) and "ssl" in str(error).lower():
+        return Outcome.tls_error
+    if isinstance(error, LDAPBindError):
+        return Outcome.bad_credentials
+    if isinstance(error, (LDAPCommunicationError, OSError)):
+        return Outcome.socket_error
+    return Outcome.error
+
+
+class Measurement:
+    """
+    The outcome of a phase being measured with `measure`, success unless
+    changed.
+    """
+
+    def __init__(self):
+        self.outcome = Outcome.success
+
+    def entries_found(self, n_entries):
+        """
+        Sets the outcome of a phase that required a unique entry to be found.
+        """
+        if n_entries == 0:
+            self.outcome = Outcome.not_found
+        elif n_entries > 1:
+            self.outcome = Outcome.multiple_matches
+
+
+@contextmanager
+def measure(phase, enabled=True):
+    """
+    Context manager observing the duration and outcome of a phase in
+    `PHASE_DURATION_SECONDS`, unless `enabled` is False.
+
+    It yields a Measurement to set the outcome with, which is otherwise
+    derived from the error raised, if any.
+    """
+    measurement = Measurement()
+    start = time.perf_counter()
+    try:
+        yield measurement
+    except BaseException as e:
+        measurement.outcome = error_outcome(e)
+        raise
+    finally:
+        if enabled:
+            PHASE_DURATION_SECONDS.labels(
+                phase=phase, outcome=measurement.outcome
+            ).observe(time.perf_counter() - start)
+
+
+def count_operation(operation):
+    """
+    Counts an LDAP operation in `OPERATIONS`.
+    """
+    OPERATIONS.labels(operation=operation).inc()
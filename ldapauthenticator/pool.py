@@ -0,0 +1,260 @@
+"""
+A pool of bound connections, used by LDAPAuthenticator to reuse connections
+bound as `lookup_dn_search_user` across logins.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import ldap3
+from ldap3.core.exceptions import LDAPBindError, LDAPCommunicationError
+
+
+async def _close_quietly(conn):
+    try:
+        await conn.unbind()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """
+    Keeps between `min_size` and `max_size` bound connections, handing out
+    idle ones to callers and opening new ones as needed.
+
+    - `connect` is a coroutine function returning a new bound connection, or
+      None if the bind failed.
+    - Connections idle for more than `idle_timeout` seconds are closed, while
+      keeping at least `min_size` connections open.
+    - Every `keepalive_interval` seconds, idle connections are health checked
+      with a cheap search and replaced if they fail it.
+    - Connections found disconnected, for example by the server closing them,
+      are replaced by new connections, bound again via `connect`.
+    - All connections are replaced after `reset` is called.
+    """
+
+    def __init__(
+        self,
+        connect,
+        min_size=0,
+        max_size=10,
+        idle_timeout=300,
+        keepalive_interval=60,
+        log=None,
+    ):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.log = log
+        # (connection, time it was last released) for idle connections, the
+        # most recently released last
+        self._idle = []
+        self._size = 0
+        # the generation of the pool each open connection was opened in
+        self._generations = {}
+        self._generation = 0
+        self._changed = None
+        self._maintenance = None
+
+    @property
+    def size(self):
+        """Number of open connections, idle or in use."""
+        return self._size
+
+    @property
+    def idle(self):
+        """Number of idle connections."""
+        return len(self._idle)
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+
+    async def _open(self):
+        self._size += 1
+        try:
+            conn = await self._connect()
+        except BaseException:
+            self._size -= 1
+            self._notify()
+            raise
+        if conn is None:
+            self._size -= 1
+            self._notify()
+            raise LDAPBindError("failed to bind a connection for the pool")
+        self._generations[conn] = self._generation
+        return conn
+
+    def _stale(self, conn):
+        return conn.closed or self._generations.get(conn) != self._generation
+
+    async def _discard(self, conn):
+        self._generations.pop(conn, None)
+        self._size -= 1
+        self._notify()
+        await _close_quietly(conn)
+
+    def _ensure_maintenance(self):
+        if self._maintenance is None and self.keepalive_interval > 0:
+            self._maintenance = asyncio.ensure_future(self._maintain())
+
+    async def acquire(self):
+        """
+        Returns a bound connection for exclusive use until passed to
+        `release`, waiting for one if `max_size` connections are in use.
+
+        Raises LDAPBindError if a new connection couldn't be bound.
+        """
+        self._ensure_maintenance()
+        while True:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                if not self._stale(conn):
+                    return conn
+                await self._discard(conn)
+            if self._size < self.max_size:
+                return await self._open()
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            self._changed.clear()
+            await self._changed.wait()
+
+    async def release(self, conn, discard=False):
+        """
+        Returns a connection acquired with `acquire` to the pool, or closes it
+        if `discard` is True or it has been disconnected.
+        """
+        if discard or self._stale(conn):
+            await self._discard(conn)
+        else:
+            self._idle.append((conn, time.monotonic()))
+            self._notify()
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Context manager acquiring a connection and releasing it afterwards,
+        discarding it if communicating with the server failed.
+        """
+        conn = await self.acquire()
+        try:
+            yield conn
+        except LDAPCommunicationError:
+            await self.release(conn, discard=True)
+            raise
+        except BaseException:
+            await self.release(conn)
+            raise
+        else:
+            await self.release(conn)
+
+    async def _run(self, operation, *args, **kwargs):
+        """
+        Calls a connection method with a pooled connection. If the connection
+        turns out to be disconnected, the call is retried once with a newly
+        bound connection.
+        """
+        for attempt in range(2):
+            try:
+                async with self.connection() as conn:
+                    return await getattr(conn, operation)(*args, **kwargs)
+            except LDAPCommunicationError as e:
+                if attempt:
+                    raise
+                if self.log:
+                    self.log.info(f"Replacing disconnected pooled connection: {e}")
+
+    async def search(self, **kwargs):
+        """
+        Searches with a pooled connection, taking the same arguments and
+        returning the same as the connections' search method.
+        """
+        return await self._run("search", **kwargs)
+
+    async def compare(self, dn, attribute, value):
+        """
+        Compares with a pooled connection, taking the same arguments and
+        returning the same as the connections' compare method.
+        """
+        return await self._run("compare", dn, attribute, value)
+
+    async def check(self, conn):
+        """
+        Returns True if a connection responds to a search for the root DSE.
+        """
+        try:
+            await conn.search(
+                search_base="",
+                search_filter="(objectClass=*)",
+                search_scope=ldap3.BASE,
+                attributes=[ldap3.NO_ATTRIBUTES],
+            )
+        except Exception as e:
+            if self.log:
+                self.log.info(f"Pooled connection failed its health check: {e}")
+            return False
+        return True
+
+    async def maintain(self):
+        """
+        Closes connections idle for longer than `idle_timeout`, health checks
+        the remaining idle connections, and opens connections up to
+        `min_size`.
+        """
+        now = time.monotonic()
+        idle, self._idle = self._idle, []
+        keep = []
+        excess = self._size - self.min_size
+        # oldest first, so the least recently used connections are evicted
+        for conn, released in idle:
+            if excess > 0 and now - released > self.idle_timeout:
+                excess -= 1
+                await self._discard(conn)
+            else:
+                keep.append((conn, released))
+        for conn, released in keep:
+            if not self._stale(conn) and await self.check(conn):
+                self._idle.append((conn, released))
+                self._notify()
+            else:
+                await self._discard(conn)
+        self._idle.sort(key=lambda item: item[1])
+        while self._size < self.min_size:
+            try:
+                conn = await self._open()
+            except Exception as e:
+                if self.log:
+                    self.log.warning(f"Failed to open a pooled connection: {e}")
+                break
+            await self.release(conn)
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            try:
+                await self.maintain()
+            except Exception:
+                if self.log:
+                    self.log.exception("Failed to maintain connection pool")
+
+    def reset(self):
+        """
+        Makes the pool replace all its connections, for example as the
+        configuration they were opened with has changed. Connections opened
+        before are closed instead of being reused.
+        """
+        self._generation += 1
+
+    async def close(self):
+        """
+        Stops maintaining the pool and closes its idle connections.
+        """
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            self._maintenance = None
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            await self._discard(conn)
@@ -0,0 +1,264 @@
+"""
+Selection among the LDAP servers configured for LDAPAuthenticator, spreading
+connections across them and avoiding servers that fail.
+"""
+
+import asyncio
+import enum
+import time
+
+import ldap3
+
+from .connection import SessionResumingTls
+
+
+class ServerSelection(enum.Enum):
+    """
+    Represents how LDAPAuthenticator picks which LDAP server to connect to
+    when multiple are configured.
+    """
+
+    round_robin = 1
+    least_latency = 2
+
+
+def parse_server(value):
+    """
+    Returns a dict with the keys `address`, `port` and `weight` for a server
+    configured as `"host"`, `"host:port"`, `"[ipv6-address]:port"` or as a
+    dict with an `address` key and optional `port` and `weight` keys.
+
+    A port of None means the default port.
+    """
+    if isinstance(value, dict):
+        unknown = set(value) - {"address", "port", "weight"}
+        if unknown or "address" not in value:
+            raise ValueError(
+                f"Invalid LDAP server {value!r}, expected a dict with an "
+                "'address' key and optional 'port' and 'weight' keys"
+            )
+        server = {"address": value["address"], "port": None, "weight": 1}
+        server.update(value)
+    elif isinstance(value, str):
+        server = {"address": value, "port": None, "weight": 1}
+        if value.startswith("["):
+            address, _, rest = value[1:].partition("]")
+            server["address"] = address
+            if rest.startswith(":"):
+                server["port"] = rest[1:]
+        elif value.count(":") == 1:
+            server["address"], server["port"] = value.split(":")
+    else:
+        raise ValueError(f"Invalid LDAP server {value!r}, expected a str or dict")
+    if server["port"] is not None:
+        server["port"] = int(server["port"])
+    if not isinstance(server["weight"], int) or server["weight"] < 1:
+        raise ValueError(
+            f"Invalid LDAP server {value!r}, weight must be a positive integer"
+        )
+    return server
+
+
+class Server:
+    """
+    An LDAP server, with its health and latency as observed when connecting
+    to it, and the ldap3 Server and SessionResumingTls objects used to
+    connect to it.
+    """
+
+    def __init__(
+        self,
+        address,
+        port,
+        weight=1,
+        use_ssl=False,
+        tls_kwargs=None,
+        connect_timeout=None,
+    ):
+        self.address = address
+        self.port = port
+        self.weight = weight
+        self.use_ssl = use_ssl
+        self.tls_kwargs = tls_kwargs or {}
+        self.connect_timeout = connect_timeout
+        self.up = True
+        self.failures = 0
+        # when the server was last marked down, or failed while down
+        self.down_since = None
+        # when the server was last tried while down, with a circuit breaker
+        self.trial_started = None
+        # exponentially weighted moving average of the seconds it takes to
+        # connect and bind, None until measured
+        self.latency = None
+        self._current_weight = 0
+        self._ldap3_server = None
+
+    def __repr__(self):
+        state = "up" if self.up else "down"
+        return f"<Server {self.address}:{self.port} {state}>"
+
+    @property
+    def ldap3_server(self):
+        """
+        The ldap3 Server object for this server, created on first use.
+        """
+        if self._ldap3_server is None:
+            self._ldap3_server = ldap3.Server(
+                self.address,
+                port=self.port,
+                use_ssl=self.use_ssl,
+                tls=SessionResumingTls(**self.tls_kwargs),
+                connect_timeout=self.connect_timeout,
+            )
+        return self._ldap3_server
+
+    @property
+    def tls(self):
+        """
+        The SessionResumingTls object for this server, created on first use.
+        """
+        return self.ldap3_server.tls
+
+
+class ServerSelector:
+    """
+    Orders the servers to try when connecting, according to `selection`.
+
+    A server is marked down after `max_failures` consecutive failures to
+    connect, after which it is only tried if no server is up. While servers
+    are down, each is probed every `probe_interval` seconds with the
+    coroutine function `probe`, taking a Server and raising an error if it
+    is still down, and marked up again when the probe succeeds.
+
+    With a positive `breaker_timeout`, servers marked down aren't tried at
+    all, failing fast, until they have been down for that many seconds.
+    They are then half-open: a single connection attempt is let through,
+    and the server is marked up if it succeeds, or kept down for another
+    `breaker_timeout` seconds if it fails.
+    """
+
+    latency_smoothing = 0.3
+
+    def __init__(
+        self,
+        servers,
+        selection=ServerSelection.round_robin,
+        max_failures=1,
+        probe=None,
+        probe_interval=10,
+        breaker_timeout=0,
+        log=None,
+    ):
+        self.servers = servers
+        self.selection = selection
+        self.max_failures = max(max_failures, 1)
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.breaker_timeout = breaker_timeout
+        self.log = log
+        self._prober = None
+
+    def candidates(self):
+        """
+        Returns the servers in the order they should be tried, those up
+        first. With `breaker_timeout` configured, servers down are only
+        included when half-open.
+        """
+        up = [s for s in self.servers if s.up]
+        down = [s for s in self.servers if not s.up]
+        if self.breaker_timeout > 0:
+            down = [s for s in down if self._start_trial(s)]
+        if not up:
+            return down
+        if self.selection == ServerSelection.least_latency:
+            # servers without a measured latency are tried first, to measure it
+            up.sort(key=lambda s: -1 if s.latency is None else s.latency)
+        else:
+            # smooth weighted round robin, spreading out picks of each server
+            # in proportion to its weight
+            total = 0
+            for server in up:
+                server._current_weight += server.weight
+                total += server.weight
+            first = max(up, key=lambda s: s._current_weight)
+            first._current_weight -= total
+            i = up.index(first)
+            up = up[i:] + up[:i]
+        return up + down
+
+    def _start_trial(self, server):
+        """
+        Returns True if a server down is half-open, letting a connection
+        attempt through, which no other attempt is let through with until
+        `breaker_timeout` seconds have passed.
+        """
+        now = time.monotonic()
+        last = max(server.down_since, server.trial_started or server.down_since)
+        if now - last < self.breaker_timeout:
+            return False
+        server.trial_started = now
+        return True
+
+    def succeeded(self, server, latency=None):
+        """
+        Records a successful connection to a server, which took `latency`
+        seconds.
+        """
+        server.failures = 0
+        if latency is not None:
+            if server.latency is None:
+                server.latency = latency
+            else:
+                server.latency += self.latency_smoothing * (latency - server.latency)
+        if not server.up:
+            server.up = True
+            server.down_since = None
+            server.trial_started = None
+            if self.log:
+                self.log.info(f"LDAP server {server.address}:{server.port} is up")
+
+    def failed(self, server, error):
+        """
+        Records a failure to connect to a server.
+        """
+        server.failures += 1
+        if not server.up:
+            server.down_since = time.monotonic()
+        elif server.failures >= self.max_failures:
+            server.up = False
+            server.down_since = time.monotonic()
+            if self.log:
+                self.log.warning(
+                    f"LDAP server {server.address}:{server.port} marked down: {error}"
+                )
+            if self.probe and self.probe_interval > 0 and len(self.servers) > 1:
+                self._ensure_prober()
+
+    def _ensure_prober(self):
+        if self._prober is None or self._prober.done():
+            self._prober = asyncio.ensure_future(self._probe_down_servers())
+
+    async def _probe_down_servers(self):
+        while any(not s.up for s in self.servers):
+            await asyncio.sleep(self.probe_interval)
+            for server in self.servers:
+                if server.up:
+                    continue
+                start = time.perf_counter()
+                try:
+                    await self.probe(server)
+                except Exception as e:
+                    if self.log:
+                        self.log.debug(
+                            f"LDAP server {server.address}:{server.port} still down: {e}"
+                        )
+                else:
+                    self.succeeded(server, time.perf_counter() - start)
+
+    def close(self):
+        """
+        Stops probing servers that are down.
+        """
+        if self._prober is not None:
+            self._prober.cancel()
+            self._prober = None
@@ -0,0 +1,262 @@
+"""
+Mirroring of LDAP group memberships, so that LDAPAuthenticator can keep
+JupyterHub groups in sync with them in the background rather than checking
+them at every login.
+"""
+
+import datetime
+import time
+
+import ldap3
+from ldap3.utils.conv import escape_filter_chars
+
+from .connection import paged_search
+from .groups import attribute_value_chunks, normalize_dn, split_dn
+
+
+def _values(attributes, name):
+    """
+    Returns the values of an attribute of an entry, looked up regardless of
+    letter case, as a list.
+    """
+    for key, values in attributes.items():
+        if key.lower() == name.lower():
+            return values if isinstance(values, list) else [values]
+    return []
+
+
+def _change_value(value):
+    """
+    Returns a change attribute value as it is written in search filters.
+    ldap3 converts modifyTimestamp values to datetimes and uSNChanged values
+    to ints when it has read the server's schema, which are converted back
+    to a generalized time such as "20240101000000Z" and a number.
+    """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        # fractions of seconds are dropped, so that the filter matches the
+        # entry again rather than missing changes made in the same second
+        return value.strftime("%Y%m%d%H%M%SZ")
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return str(value)
+
+
+def _newest(a, b):
+    """
+    Returns the later of two change attribute values, either generalized
+    times such as modifyTimestamp values, or numbers such as uSNChanged
+    values.
+    """
+    if a is None:
+        return b
+    if a.isdigit() and b.isdigit():
+        return a if int(a) >= int(b) else b
+    return a if a >= b else b
+
+
+class GroupSync:
+    """
+    Holds the members of LDAP groups as usernames, and returns what changed
+    with each `sync` pass.
+
+    - `connection` is a function returning an async context manager
+      yielding a bound connection, such as `ConnectionPool.connection`.
+    - The groups are either those found below `groups_base` with
+      `groups_filter`, or the list of group DNs `groups`.
+    - Members are the values of the groups' `member_attributes`. Values
+      that are DNs are translated to the `name_attribute` value of the entry
+      below `users_base` they refer to, or the value of their first RDN if
+      its attribute is `name_attribute`. Other values, such as `memberUid`
+      values, are usernames already. Usernames are passed through
+      `normalize`.
+
+    Searches are paged with `page_size` entries per page. The first pass,
+    and a pass every `full_interval` seconds, reads all groups and users,
+    also noticing deleted groups. Other passes only read the entries whose
+    `change_attribute`, such as modifyTimestamp or Active Directory's
+    uSNChanged, is at least the highest value seen in previous passes, if
+    the server provided any.
+
+    `entries_read` is the number of entries read by the last pass, and
+    `passes` counts the passes.
+    """
+
+    def __init__(
+        self,
+        connection,
+        member_attributes,
+        users_base,
+        name_attribute,
+        groups_base=None,
+        groups_filter="(objectClass=*)",
+        groups=None,
+        change_attribute="modifyTimestamp",
+        page_size=500,
+        full_interval=3600,
+        normalize=None,
+        timer=time.monotonic,
+        log=None,
+    ):
+        self.connection = connection
+        self.member_attributes = member_attributes
+        self.users_base = users_base
+        self.name_attribute = name_attribute
+        self.groups_base = groups_base
+        self.groups_filter = groups_filter
+        self.groups = groups or []
+        self.change_attribute = change_attribute
+        self.page_size = page_size
+        self.full_interval = full_interval
+        self.normalize = normalize or (lambda username: username)
+        self.timer = timer
+        self.log = log
+        # group DN -> frozenset of usernames
+        self.members = {}
+        # normalized user DN -> username
+        self._usernames = {}
+        # group DN -> member attribute values
+        self._member_values = {}
+        self._high_water_mark = None
+        self._full_at = None
+        self.entries_read = 0
+        self.passes = 0
+
+    def member_groups(self, username):
+        """
+        Returns the DNs of the groups having `username` as a member.
+        """
+        return [group for group, members in self.members.items() if username in members]
+
+    def _since_filter(self, search_filter, high_water_mark):
+        if high_water_mark is None:
+            return search_filter
+        since = escape_filter_chars(high_water_mark)
+        return f"(&{search_filter}({self.change_attribute}>={since}))"
+
+    async def _search(self, conn, base, search_filter, scope, attributes):
+        """
+        Yields the entries found, counting them in `entries_read` and
+        noting the highest change attribute value.
+        """
+        async for page in paged_search(
+            conn,
+            base,
+            search_filter,
+            search_scope=scope,
+            attributes=attributes + [self.change_attribute],
+            page_size=self.page_size,
+        ):
+            self.entries_read += len(page)
+            for entry in page:
+                for value in _values(entry.attributes, self.change_attribute):
+                    self._next_high_water_mark = _newest(
+                        self._next_high_water_mark, _change_value(value)
+                    )
+                yield entry
+
+    def _username(self, value):
+        if isinstance(value, bytes):
+            value = value.decode("utf-8", "replace")
+        value = str(value).strip()
+        try:
+            dn = normalize_dn(value)
+            rdn, _ = split_dn(value)
+        except Exception:
+            # not a DN, for example a memberUid value
+            return self.normalize(value)
+        username = self._usernames.get(dn)
+        if username is None and len(rdn) == 1:
+            attribute, rdn_value = rdn[0]
+            if attribute.lower() == self.name_attribute.lower():
+                username = self.normalize(rdn_value)
+        return username
+
+    async def sync(self):
+        """
+        Reads the groups and users changed since the last pass, and returns
+        a dict mapping the DN of each group whose members changed to a tuple
+        of the sets of usernames added and removed.
+        """
+        full = (
+            self._high_water_mark is None
+            or self._full_at is None
+            or self.timer() - self._full_at >= self.full_interval
+        )
+        high_water_mark = None if full else self._high_water_mark
+        self._next_high_water_mark = self._high_water_mark
+        self.entries_read = 0
+        started = self.timer()
+
+        async with self.connection() as conn:
+            if self.users_base:
+                usernames = {} if full else dict(self._usernames)
+                async for entry in self._search(
+                    conn,
+                    self.users_base,
+                    self._since_filter(f"({self.name_attribute}=*)", high_water_mark),
+                    ldap3.SUBTREE,
+                    [self.name_attribute],
+                ):
+                    names = _values(entry.attributes, self.name_attribute)
+                    if len(names) == 1:
+                        usernames[normalize_dn(entry.dn)] = self.normalize(
+                            str(names[0])
+                        )
+                self._usernames = usernames
+
+            # (group, entry) of the groups read
+            found = []
+            if self.groups_base:
+                async for entry in self._search(
+                    conn,
+                    self.groups_base,
+                    self._since_filter(self.groups_filter, high_water_mark),
+                    ldap3.SUBTREE,
+                    list(self.member_attributes),
+                ):
+                    found.append((entry.dn, entry))
+            for group in self.groups:
+                async for entry in self._search(
+                    conn,
+                    group,
+                    self._since_filter("(objectClass=*)", high_water_mark),
+                    ldap3.BASE,
+                    list(self.member_attributes),
+                ):
+                    found.append((group, entry))
+
+            # members beyond those returned with the entry are requested
+            # once the paged searches are done
+            member_values = {} if full else dict(self._member_values)
+            for group, entry in found:
+                member_values[group] = [
+                    value
+                    for name in self.member_attributes
+                    async for chunk in attribute_value_chunks(conn, entry, name)
+                    for value in chunk
+                ]
+        self._member_values = member_values
+        self._high_water_mark = self._next_high_water_mark
+        if full:
+            self._full_at = started
+
+        members = {}
+        for group, values in member_values.items():
+            usernames = (self._username(value) for value in values)
+            members[group] = frozenset(u for u in usernames if u)
+        changes = {}
+        for group in members.keys() | self.members.keys():
+            old = self.members.get(group, frozenset())
+            new = members.get(group, frozenset())
+            if old != new:
+                changes[group] = (new - old, old - new)
+        self.members = members
+        self.passes += 1
+        if self.log:
+            self.log.info(
+                f"Group sync pass ({'full' if full else 'incremental'}) read "
+                f"{self.entries_read} entries, {len(changes)} groups changed"
+            )
+        return changes
@@ -3,14 +3,37 @@ import os
 import pytest
 from traitlets.config import Config
 
+from ..fakeldap import FakeLDAPServer
 
-@pytest.fixture()
-def c():
+
+@pytest.fixture(scope="session")
+def ldap_server():
+    """
+    The (host, port) of the LDAP server to test against, either `LDAP_HOST`
+    running the test-openldap image as started by ci/docker-ldap.sh, with a
+    port of None meaning the default ports, or an in-process stand-in with
+    the same data if `LDAP_HOST` isn't set.
+    """
+    if "LDAP_HOST" in os.environ:
+        yield os.environ["LDAP_HOST"], None
+        return
+    with FakeLDAPServer() as server:
+        yield server.host, server.port
+
+
+@pytest.fixture(params=["sync", "asyncio"])
+def c(request, ldap_server):
     """
     A base configuration for LDAPAuthenticator that individual tests can adjust.
+
+    Tests using it run once for each client_mode.
     """
     c = Config()
-    c.LDAPAuthenticator.server_address = os.environ.get("LDAP_HOST", "localhost")
+    c.LDAPAuthenticator.client_mode = request.param
+    host, port = ldap_server
+    c.LDAPAuthenticator.server_address = host
+    if port:
+        c.LDAPAuthenticator.server_port = port
     c.LDAPAuthenticator.lookup_dn = True
     c.LDAPAuthenticator.bind_dn_template = (
         "cn={username},ou=people,dc=planetexpress,dc=com"
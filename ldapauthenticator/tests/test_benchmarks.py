@@ -0,0 +1,141 @@
+"""
+Benchmarks of `LDAPAuthenticator.authenticate` against an in-process stand-in
+for the LDAP server, run with pytest-benchmark if it is installed.
+
+Every LDAP operation is delayed by `LATENCY`, so that the number of round
+trips a login makes shows in the results as it would with a real directory.
+Besides pytest-benchmark's statistics, each benchmark records logins per
+second, p50 and p99 login latency and LDAP operations per login in its
+`extra_info`, for example to be saved with `--benchmark-json`.
+"""
+
+import asyncio
+import itertools
+import statistics
+
+import pytest
+from traitlets.config import Config
+
+from ..fakeldap import FakeLDAPServer
+from ..ldapauthenticator import LDAPAuthenticator
+
+pytest.importorskip("pytest_benchmark")
+
+PEOPLE = "ou=people,dc=planetexpress,dc=com"
+GROUP = f"cn=benchmark,{PEOPLE}"
+USERS = [f"user{i}" for i in range(50)]
+LATENCY = 0.001
+ROUNDS = 50
+WARMUP_ROUNDS = 5
+
+# configurations on top of the base configuration of `authenticator`
+CONFIGS = {
+    "bind_dn_template": {
+        "bind_dn_template": [
+            f"uid={{username}},ou=staff,{PEOPLE}",
+            f"uid={{username}},ou=interns,{PEOPLE}",
+            f"uid={{username}},{PEOPLE}",
+        ],
+    },
+    "lookup_dn": {
+        "lookup_dn": True,
+        "lookup_dn_cache_ttl": 0,
+        "user_search_base": PEOPLE,
+        "user_attribute": "uid",
+        "lookup_dn_user_dn_attribute": "uid",
+    },
+    "allowed_groups": {
+        "allowed_groups": [f"cn=group{i},{PEOPLE}" for i in range(100)] + [GROUP],
+    },
+    "auth_state_attributes": {
+        "auth_state_attributes": ["uid", "cn", "mail", "ou", "employeeType"],
+    },
+}
+
+
+@pytest.fixture(scope="module")
+def server():
+    """
+    The stand-in, with the users `USERS`, all members of `GROUP`, and 100
+    other groups.
+    """
+    with FakeLDAPServer(latency=LATENCY) as server:
+        for username in USERS:
+            server.directory.add(
+                f"uid={username},{PEOPLE}",
+                {
+                    "objectClass": ["top", "person", "inetOrgPerson"],
+                    "cn": username,
+                    "sn": username,
+                    "mail": f"{username}@planetexpress.com",
+                    "ou": "Delivering Crew",
+                    "employeeType": "Delivery boy",
+                    "userPassword": username,
+                },
+            )
+        server.directory.add(
+            GROUP,
+            {
+                "objectClass": ["top", "groupOfNames"],
+                "member": [f"uid={username},{PEOPLE}" for username in USERS],
+            },
+        )
+        for i in range(100):
+            server.directory.add(
+                f"cn=group{i},{PEOPLE}",
+                {
+                    "objectClass": ["top", "groupOfNames"],
+                    "member": [f"cn=Amy Wong,{PEOPLE}"],
+                },
+            )
+        yield server
+
+
+def authenticator(server, client_mode, config):
+    c = Config()
+    c.LDAPAuthenticator.client_mode = client_mode
+    c.LDAPAuthenticator.server_address = server.host
+    c.LDAPAuthenticator.server_port = server.port
+    c.LDAPAuthenticator.bind_dn_template = f"uid={{username}},{PEOPLE}"
+    c.LDAPAuthenticator.allowed_groups = [GROUP]
+    for name, value in CONFIGS[config].items():
+        setattr(c.LDAPAuthenticator, name, value)
+    return LDAPAuthenticator(config=c)
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("client_mode", ["sync", "asyncio"])
+def test_authenticate(benchmark, server, client_mode, config):
+    authenticator_ = authenticator(server, client_mode, config)
+    usernames = itertools.cycle(USERS)
+    loop = asyncio.new_event_loop()
+
+    def login():
+        username = next(usernames)
+        return loop.run_until_complete(
+            authenticator_.authenticate(
+                None, {"username": username, "password": username}
+            )
+        )
+
+    server.reset_stats()
+    try:
+        auth_model = benchmark.pedantic(
+            login, rounds=ROUNDS, warmup_rounds=WARMUP_ROUNDS
+        )
+    finally:
+        loop.close()
+    assert auth_model["name"] in USERS
+
+    logins = ROUNDS + WARMUP_ROUNDS if benchmark.stats else 1
+    operations = sum(
+        n for operation, n in server.operations.items() if operation != "unbind"
+    )
+    benchmark.extra_info["ldap_operations_per_login"] = operations / logins
+    if benchmark.stats:
+        # None with --benchmark-disable
+        timings = benchmark.stats.stats.data
+        percentiles = statistics.quantiles(timings, n=100)
+        benchmark.extra_info["logins_per_second"] = len(timings) / sum(timings)
+        benchmark.extra_info["p50"] = statistics.median(timings)
+        benchmark.extra_info["p99"] = percentiles[98]
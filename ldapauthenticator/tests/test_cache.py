@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import time
+
+from ..cache import (
+    Batcher,
+    CredentialCache,
+    Singleflight,
+    TemplateOrder,
+    TokenBuckets,
+    TTLCache,
+)
+
+
+class Timer:
+    now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expiry():
+    timer = Timer()
+    cache = TTLCache(10, 5, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=1)
+
+    assert cache.get("a") == 1
+    timer.now = 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    timer.now = 5
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert len(cache) == 0
+
+
+def test_ttl_cache_lru():
+    cache = TTLCache(2, 5)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.pop("c") == 3
+    assert len(cache) == 1
+
+
+def test_ttl_cache_disabled():
+    cache = TTLCache(10, 0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+async def test_credential_cache():
+    cache = CredentialCache(10, 5)
+    auth_model = {"name": "fry", "auth_state": {"ldap_groups": []}}
+    await cache.set("fry", "fry", auth_model)
+
+    salt, digest, _ = cache._cache.get("fry")
+    assert b"fry" not in salt + digest
+    assert await cache.get("fry", "wrong") is None
+    cached = await cache.get("fry", "fry")
+    assert cached == auth_model
+    assert cached is not auth_model
+    assert await cache.get("leela", "leela") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    cache.pop("fry")
+    assert "fry" not in cache
+
+
+async def test_credential_cache_hashes_in_thread(monkeypatch):
+    cache = CredentialCache(10, 5)
+    await cache.set("fry", "fry", {"name": "fry"})
+    scrypt = hashlib.scrypt
+
+    def slow_scrypt(*args, **kwargs):
+        time.sleep(0.2)
+        return scrypt(*args, **kwargs)
+
+    monkeypatch.setattr(hashlib, "scrypt", slow_scrypt)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.ensure_future(tick())
+    try:
+        assert await cache.get("fry", "wrong") is None
+    finally:
+        ticker.cancel()
+    # the event loop kept running while the password was hashed
+    assert ticks >= 5
+
+
+def test_template_order():
+    order = TemplateOrder(2)
+    templates = ["a", "b", "c"]
+    assert order.order("fry", templates) == templates
+
+    order.succeeded("fry", "c", 2)
+    order.succeeded("leela", "b", 1)
+    order.succeeded("leela", "b", 0)
+    # remembered template first, then by overall successes
+    assert order.order("fry", templates) == ["c", "b", "a"]
+    assert order.order("bender", templates) == ["b", "c", "a"]
+    assert (order.logins, order.first_attempt_logins) == (3, 1)
+
+    order.failed("fry")
+    assert order.order("fry", templates) == ["b", "c", "a"]
+
+
+async def test_singleflight():
+    singleflight = Singleflight()
+    calls = []
+
+    async def search(base):
+        calls.append(base)
+        await asyncio.sleep(0.1)
+        return [{"dn": base}]
+
+    results = await asyncio.gather(
+        singleflight.run("a", search, "a"),
+        singleflight.run("a", search, "a"),
+        singleflight.run("b", search, "b"),
+    )
+    assert calls == ["a", "b"]
+    assert results == [[{"dn": "a"}], [{"dn": "a"}], [{"dn": "b"}]]
+    # callers sharing a result get their own copy
+    assert results[0] is not results[1]
+    assert singleflight.shared == 1
+
+    # once done, calls are made again
+    await singleflight.run("a", search, "a")
+    assert calls == ["a", "b", "a"]
+
+
+def test_token_buckets():
+    timer = Timer()
+    buckets = TokenBuckets(2, 10, timer=timer)
+    buckets.take("fry")
+    assert not buckets.empty("fry")
+    buckets.take("fry")
+    assert buckets.empty("fry")
+    assert not buckets.empty("leela")
+
+    # refilled at 2 tokens per 10 seconds
+    timer.now = 5
+    assert not buckets.empty("fry")
+    buckets.take("fry")
+    assert buckets.empty("fry")
+    timer.now = 15
+    assert len(buckets._buckets) == 1
+    timer.now = 16
+    assert not buckets.empty("fry")
+    assert len(buckets._buckets) == 0
+
+
+async def test_batcher():
+    batches = []
+
+    async def process(keys):
+        batches.append(keys)
+        return {key: {"name": key} for key in keys if key != "c"}
+
+    batcher = Batcher(process, delay=0.05, max_size=3)
+    results = await asyncio.gather(
+        batcher.submit("a"),
+        batcher.submit("a"),
+        batcher.submit("b"),
+        batcher.submit("c"),
+        batcher.submit("d"),
+    )
+    # a full batch is processed right away, the rest after the delay
+    assert batches == [["a", "b", "c"], ["d"]]
+    assert results == [{"name": "a"}, {"name": "a"}, {"name": "b"}, None, {"name": "d"}]
+    assert results[0] is not results[1]
+    assert (batcher.batches, batcher.shared) == (2, 1)
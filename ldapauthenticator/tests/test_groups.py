@@ -0,0 +1,205 @@
+import asyncio
+
+import pytest
+from ldap3.core.exceptions import LDAPSocketOpenError
+
+from ..connection import SearchEntry
+from ..groups import (
+    GroupGraph,
+    GroupMembershipCache,
+    attribute_value_chunks,
+    common_base,
+    in_chain_filter,
+    normalize_dn,
+    per_group_search,
+    split_dn,
+)
+
+
+def test_normalize_dn():
+    assert normalize_dn("CN=Admin  Staff, OU=People,DC=example,DC=org") == (
+        "cn=admin staff,ou=people,dc=example,dc=org"
+    )
+    assert normalize_dn("cn=a\\2Cb,dc=org") == normalize_dn("cn=a\\,b,dc=org")
+
+
+def test_split_dn():
+    assert split_dn("cn=ship_crew,ou=people,dc=example,dc=org") == (
+        [("cn", "ship_crew")],
+        "ou=people,dc=example,dc=org",
+    )
+    assert split_dn("cn=a\\,b+uid=x,dc=org") == (
+        [("cn", "a,b"), ("uid", "x")],
+        "dc=org",
+    )
+
+
+class Fetcher:
+    def __init__(self):
+        self.members = {"cn=crew,dc=org": {"member": ["CN=Fry,dc=org"]}}
+        self.fetches = 0
+        self.fail = False
+
+    async def __call__(self):
+        self.fetches += 1
+        if self.fail:
+            raise LDAPSocketOpenError("server down")
+        return self.members
+
+
+async def test_group_membership_cache():
+    fetch = Fetcher()
+    cache = GroupMembershipCache(fetch, ttl=0.05, max_staleness=0.3, jitter=0.5)
+    groups = ["cn=crew,dc=org", "cn=staff,dc=org"]
+
+    assert await cache.member_groups(groups, "cn=fry,dc=org", "fry") == groups[:1]
+    assert await cache.member_groups(groups, "cn=leela,dc=org", "leela") == []
+    assert fetch.fetches == 1
+
+    # refreshed in the background
+    fetch.members = {"cn=staff,dc=org": {"memberUid": ["leela"]}}
+    await asyncio.sleep(0.1)
+    assert fetch.fetches > 1
+    assert await cache.member_groups(groups, "cn=leela,dc=org", "leela") == groups[1:]
+
+    # stale members are served while refreshing fails, until max_staleness
+    fetch.fail = True
+    await asyncio.sleep(0.1)
+    assert await cache.member_groups(groups, "cn=leela,dc=org", "leela") == groups[1:]
+    await asyncio.sleep(0.3)
+    with pytest.raises(LDAPSocketOpenError):
+        await cache.member_groups(groups, "cn=leela,dc=org", "leela")
+
+    fetch.fail = False
+    cache.invalidate()
+    assert cache.members is None
+    assert await cache.member_groups(groups, "cn=leela,dc=org", "leela") == groups[1:]
+    cache.close()
+
+
+async def test_group_membership_cache_slow_fetch():
+    fetch = Fetcher()
+
+    async def slow_fetch():
+        await asyncio.sleep(0.1)
+        return await fetch()
+
+    cache = GroupMembershipCache(slow_fetch, ttl=0.05, max_staleness=0.05)
+    groups = ["cn=crew,dc=org"]
+    # the members are already stale when fetched, and are used nonetheless
+    for _ in range(2):
+        found = cache.member_groups(groups, "cn=fry,dc=org", "fry")
+        assert await asyncio.wait_for(found, 1) == groups
+        await asyncio.sleep(0.05)
+    cache.close()
+
+
+class Directory:
+    """
+    Answers searches for a group with 4000 members, returning at most 1500
+    values of an attribute at a time like Active Directory.
+    """
+
+    members = [f"cn=user{i},dc=org" for i in range(4000)]
+
+    def __init__(self):
+        self.searches = []
+
+    async def search(self, search_base, search_filter, search_scope, attributes):
+        self.searches.append(attributes)
+        if attributes == ["1.1"]:
+            return [SearchEntry(search_base, {})]
+        low = 0
+        if ";range=" in attributes[0]:
+            low = int(attributes[0].split("=")[1].split("-")[0])
+        high = low + 1500
+        if high >= len(self.members):
+            name = f"member;range={low}-*"
+        else:
+            name = f"member;range={low}-{high - 1}"
+        return [SearchEntry(search_base, {name: self.members[low:high]})]
+
+
+async def test_per_group_search_requests_no_attributes():
+    directory = Directory()
+    found = await per_group_search(directory, ["cn=crew,dc=org"], "(member=x)")
+    assert found == ["cn=crew,dc=org"]
+    assert directory.searches == [["1.1"]]
+
+
+async def test_attribute_value_chunks():
+    directory = Directory()
+    (entry,) = await directory.search("cn=crew,dc=org", "", "", ["member"])
+    chunks = [
+        chunk async for chunk in attribute_value_chunks(directory, entry, "member")
+    ]
+    assert [len(chunk) for chunk in chunks] == [1500, 1500, 1000]
+    assert sum(chunks, []) == directory.members
+    assert directory.searches[1:] == [["member;range=1500-*"], ["member;range=3000-*"]]
+
+    # values returned all at once
+    entry = SearchEntry("cn=crew,dc=org", {"Member": ["cn=fry,dc=org"]})
+    chunks = [
+        chunk async for chunk in attribute_value_chunks(directory, entry, "member")
+    ]
+    assert chunks == [["cn=fry,dc=org"]]
+
+
+def test_in_chain_filter():
+    assert in_chain_filter("member", "cn=Fry (PE),dc=org") == (
+        "(member:1.2.840.113556.1.4.1941:=cn=Fry \\28PE\\29,dc=org)"
+    )
+
+
+def test_common_base():
+    assert common_base(["cn=a,ou=x,dc=org", "CN=b,OU=X,dc=org"]) == "ou=x,dc=org"
+    assert common_base(["cn=a,ou=x,dc=org", "cn=b,ou=y,dc=org"]) == "dc=org"
+
+
+class NestedGroups:
+    """
+    Answers searches for the groups with a group as a member.
+    """
+
+    # group -> groups it is a member of
+    parents = {
+        "cn=delivery": ["cn=crew"],
+        "cn=crew": ["cn=staff", "cn=everyone"],
+        "cn=staff": ["cn=everyone"],
+        "cn=everyone": ["cn=delivery"],
+    }
+
+    def __init__(self):
+        self.searches = []
+
+    async def search(self, search_base, search_filter, search_scope, attributes):
+        group = search_filter[len("(member=") : -1]
+        self.searches.append(group)
+        return [SearchEntry(parent, {}) for parent in self.parents.get(group, [])]
+
+
+async def test_group_graph():
+    directory = NestedGroups()
+    graph = GroupGraph("", ttl=300)
+
+    reached = await graph.reachable(
+        directory, ["cn=delivery"], ["cn=everyone", "cn=staff", "cn=other"]
+    )
+    assert reached == ["cn=everyone", "cn=staff"]
+    # each group's parents are searched for once, despite the cycle
+    assert sorted(directory.searches) == [
+        "cn=crew",
+        "cn=delivery",
+        "cn=everyone",
+        "cn=staff",
+    ]
+
+    # remembered for later walks, which stop once all targets are found
+    directory.searches.clear()
+    assert await graph.reachable(directory, ["cn=delivery"], ["cn=crew"]) == ["cn=crew"]
+    assert await graph.reachable(directory, ["cn=crew"], ["cn=other"]) == []
+    assert directory.searches == []
+    assert graph.searches == 4
+
+    graph.max_depth = 1
+    assert await graph.reachable(directory, ["cn=delivery"], ["cn=staff"]) == []
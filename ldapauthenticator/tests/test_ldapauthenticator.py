@@ -5,10 +5,30 @@ Testing data is hardcoded in docker-test-openldap, described at
 https://github.com/rroemhild/docker-test-openldap?tab=readme-ov-file#ldap-structure
 """
 
+import asyncio
+import gc
+import hashlib
+import socket
+import threading
+from types import SimpleNamespace
+
+import ldap3
 import pytest
-from ldap3.core.exceptions import LDAPSSLConfigurationError
+from jupyterhub import orm
+from ldap3.core.exceptions import (
+    LDAPSocketOpenError,
+    LDAPSocketReceiveError,
+    LDAPSSLConfigurationError,
+)
+from prometheus_client import REGISTRY
+from tornado import web
+from traitlets.config import Configurable
 
-from ..ldapauthenticator import LDAPAuthenticator, TlsStrategy
+from .. import groups
+from ..connection import AsyncioConnection
+from ..fakeldap import FakeLDAPServer
+from ..ldapauthenticator import ClientMode, LDAPAuthenticator, TlsStrategy
+from ..tracing import RecordingTracer
 
 
 async def test_ldap_auth_allowed(c):
@@ -234,3 +254,1153 @@ async def test_ldap_tls_kwargs_config_passthrough(c):
         await authenticator.get_authenticated_user(
             None, {"username": "leela", "password": "leela"}
         )
+
+
+async def test_ldap_auth_legacy_overrides(c):
+    c.LDAPAuthenticator.client_mode = "sync"
+    c.LDAPAuthenticator.tls_strategy = "insecure"
+    c.LDAPAuthenticator.auth_state_attributes = ["mail"]
+    calls = []
+
+    class LegacyLDAPAuthenticator(LDAPAuthenticator):
+        # overrides written for LDAPAuthenticator 2.0, as functions
+        def resolve_username(self, username_supplied_by_user):
+            calls.append("resolve_username")
+            return (
+                "Philip J. Fry",
+                "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com",
+            )
+
+        def get_connection(self, userdn, password):
+            calls.append("get_connection")
+            server = ldap3.Server(self.server_address[0], port=self.server_port)
+            return ldap3.Connection(server, userdn, password, auto_bind=True)
+
+        def get_user_attributes(self, conn, userdn):
+            calls.append("get_user_attributes")
+            conn.search(userdn, "(objectClass=*)", attributes=["mail"])
+            return conn.entries[0].entry_attributes_as_dict
+
+    authenticator = LegacyLDAPAuthenticator(config=c)
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "pjf", "password": "fry"}
+    )
+    assert authorized["auth_state"]["user_attributes"] == {
+        "mail": ["fry@planetexpress.com"]
+    }
+    assert calls == ["resolve_username", "get_connection", "get_user_attributes"]
+    assert authenticator.connection_stats.open == 0
+
+
+async def test_ldap_auth_executor_threads(c):
+    c.LDAPAuthenticator.client_mode = "sync"
+    c.LDAPAuthenticator.executor_threads = 2
+    authenticator = LDAPAuthenticator(config=c)
+
+    results = await asyncio.gather(
+        *(
+            authenticator.get_authenticated_user(
+                None, {"username": username, "password": username}
+            )
+            for username in ["fry", "leela", "bender", "zoidberg"]
+        )
+    )
+    assert [r and r["name"] for r in results] == ["fry", "leela", "bender", None]
+
+
+async def test_ldap_auth_executor_queue_timeout(c):
+    c.LDAPAuthenticator.client_mode = "sync"
+    c.LDAPAuthenticator.executor_threads = 1
+    c.LDAPAuthenticator.executor_queue_timeout = 0.1
+    authenticator = LDAPAuthenticator(config=c)
+
+    # occupy the only worker thread
+    await authenticator._executor_slots.acquire()
+    with pytest.raises(web.HTTPError) as exc_info:
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert exc_info.value.status_code == 503
+
+    authenticator._executor_slots.release()
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+
+
+async def test_ldap_auth_client_mode_asyncio(c):
+    c.LDAPAuthenticator.client_mode = "asyncio"
+    c.LDAPAuthenticator.auth_state_attributes = ["employeeType"]
+    authenticator = LDAPAuthenticator(config=c)
+    assert authenticator.client_mode == ClientMode.asyncio
+
+    results = await asyncio.gather(
+        *(
+            authenticator.get_authenticated_user(
+                None, {"username": username, "password": password}
+            )
+            for username, password in [
+                ("fry", "fry"),
+                ("leela", "leela"),
+                ("fry", "wrong"),
+                ("zoidberg", "zoidberg"),
+            ]
+        )
+    )
+    assert [r and r["name"] for r in results] == ["fry", "leela", None, None]
+    assert results[0]["auth_state"]["user_attributes"] == {
+        "employeeType": ["Delivery boy"]
+    }
+
+
+async def test_ldap_auth_lookup_dn_pool(c):
+    authenticator = LDAPAuthenticator(config=c)
+
+    for username in ["fry", "leela"]:
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": username, "password": username}
+        )
+        assert authorized["name"] == username
+    pool = authenticator.lookup_dn_pool
+    assert pool.size == 1
+
+    # a connection dropped by the server is replaced by a newly bound one
+    conn = await pool.acquire()
+    if isinstance(conn, AsyncioConnection):
+        conn._protocol.transport.get_extra_info("socket").shutdown(socket.SHUT_RDWR)
+    else:
+        conn.connection.socket.shutdown(socket.SHUT_RDWR)
+    await pool.release(conn)
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "bender", "password": "bender"}
+    )
+    assert authorized["name"] == "bender"
+    assert pool.size == 1
+    await pool.close()
+
+
+async def test_ldap_auth_use_lookup_dn_search_user_for_searches(c):
+    c.LDAPAuthenticator.use_lookup_dn_search_user_for_searches = True
+    c.LDAPAuthenticator.auth_state_attributes = ["employeeType"]
+    authenticator = LDAPAuthenticator(config=c)
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert authorized["auth_state"]["ldap_groups"] == [
+        "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+    ]
+    assert authorized["auth_state"]["user_attributes"] == {
+        "employeeType": ["Delivery boy"]
+    }
+    assert authenticator.lookup_dn_pool.size == 1
+
+
+@pytest.mark.parametrize("tls_strategy", ["before_bind", "on_connect"])
+async def test_ldap_tls_session_resumption(c, tls_strategy):
+    c.LDAPAuthenticator.tls_strategy = tls_strategy
+    authenticator = LDAPAuthenticator(config=c)
+    tls = authenticator.get_servers().servers[0].tls
+
+    conn = await authenticator.get_connection(
+        "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com", "fry"
+    )
+    assert not conn.session_reused
+    await conn.unbind()
+    assert tls.session is not None
+
+    conn = await authenticator.get_connection(
+        "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com", "fry"
+    )
+    assert conn.session_reused
+    await conn.unbind()
+
+    # the tls object is reused until the configuration changes
+    assert authenticator.get_servers().servers[0].tls is tls
+    authenticator.tls_kwargs = {"ciphers": "HIGH"}
+    assert authenticator.get_servers().servers[0].tls is not tls
+
+
+async def test_ldap_search_result(c):
+    authenticator = LDAPAuthenticator(config=c)
+    warnings = []
+    authenticator.connection_stats.log = SimpleNamespace(
+        warning=lambda *args: warnings.append(args)
+    )
+
+    conn = await authenticator.get_connection(
+        "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com", "fry"
+    )
+    entries = await conn.search(
+        "ou=people,dc=planetexpress,dc=com", "(uid=fry)", attributes=["uid"]
+    )
+    assert len(entries) == 1
+    assert conn.result["description"] == "success"
+    assert not warnings
+
+    # a search failing without entries is told apart from one without matches
+    entries = await conn.search(
+        "ou=nobody,dc=planetexpress,dc=com", "(uid=fry)", attributes=["uid"]
+    )
+    assert entries == []
+    assert conn.result["description"] == "noSuchObject"
+    assert [args[:4] for args in warnings] == [
+        ("LDAP %s on %s ended with %s%s", "search", conn.server, "noSuchObject")
+    ]
+    await conn.unbind()
+
+
+async def test_ldap_auth_server_failover(c):
+    c.LDAPAuthenticator.server_address = [
+        # nothing listens on port 1, so connections to it are refused
+        "127.0.0.1:1",
+        {"address": c.LDAPAuthenticator.server_address, "weight": 2},
+    ]
+    authenticator = LDAPAuthenticator(config=c)
+    down, up = authenticator.get_servers().servers
+
+    for username in ["fry", "leela", "bender"]:
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": username, "password": username}
+        )
+        assert authorized["name"] == username
+
+    # the unreachable server is marked down on its first failure, and not
+    # tried again by later logins
+    assert not down.up
+    assert down.failures == 1
+    assert up.up
+    assert up.latency is not None
+    authenticator.get_servers().close()
+
+
+@pytest.fixture(scope="module")
+def stand_in():
+    """
+    An in-process stand-in for the LDAP server, for tests relying on what
+    the server at `LDAP_HOST` lacks, such as memberOf values.
+    """
+    with FakeLDAPServer() as server:
+        yield server
+
+
+def use_stand_in(c, stand_in):
+    c.LDAPAuthenticator.server_address = stand_in.host
+    c.LDAPAuthenticator.server_port = stand_in.port
+
+
+@pytest.mark.parametrize(
+    "group_membership_strategy",
+    ["per_group_search", "combined_search", "compare", "member_of"],
+)
+async def test_ldap_auth_group_membership_strategy(
+    c, stand_in, group_membership_strategy
+):
+    if group_membership_strategy == "member_of":
+        use_stand_in(c, stand_in)
+    c.LDAPAuthenticator.group_membership_strategy = group_membership_strategy
+    authenticator = LDAPAuthenticator(config=c)
+
+    admin_staff, ship_crew = c.LDAPAuthenticator.allowed_groups
+    expected = {
+        "professor": [admin_staff],
+        "hermes": [admin_staff],
+        "fry": [ship_crew],
+        "leela": [ship_crew],
+        "amy": [],
+    }
+    for username, ldap_groups in expected.items():
+        auth_model = await authenticator.authenticate(
+            None, {"username": username, "password": username}
+        )
+        assert auth_model["auth_state"]["ldap_groups"] == ldap_groups
+
+
+async def test_ldap_auth_group_membership_cache(c, monkeypatch):
+    c.LDAPAuthenticator.group_membership_cache_ttl = 60
+    authenticator = LDAPAuthenticator(config=c)
+
+    async def per_group_search(*args):
+        raise AssertionError("groups should be checked from memory")
+
+    monkeypatch.setattr(groups, "per_group_search", per_group_search)
+
+    admin_staff, ship_crew = c.LDAPAuthenticator.allowed_groups
+    for username, ldap_groups in [
+        ("professor", [admin_staff]),
+        ("fry", [ship_crew]),
+        ("amy", []),
+    ]:
+        auth_model = await authenticator.authenticate(
+            None, {"username": username, "password": username}
+        )
+        assert auth_model["auth_state"]["ldap_groups"] == ldap_groups
+
+    cache = authenticator.group_membership_cache
+    fetched_at = cache.fetched_at
+    authenticator.invalidate_group_membership_cache()
+    assert cache.members is None
+    auth_model = await authenticator.authenticate(
+        None, {"username": "leela", "password": "leela"}
+    )
+    assert auth_model["auth_state"]["ldap_groups"] == [ship_crew]
+    assert cache.fetched_at > fetched_at
+    cache.close()
+
+
+async def test_ldap_auth_lookup_dn_cache(c):
+    # not remembered by default
+    authenticator = LDAPAuthenticator(config=c)
+    await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert "fry" not in authenticator.lookup_dn_cache
+
+    c.LDAPAuthenticator.lookup_dn_cache_ttl = 300
+    c.LDAPAuthenticator.lookup_dn_negative_cache_ttl = 30
+    authenticator = LDAPAuthenticator(config=c)
+    cache = authenticator.lookup_dn_cache
+    negative_cache = authenticator.lookup_dn_negative_cache
+
+    for _ in range(2):
+        assert await authenticator.resolve_username("fry") == (
+            "Philip J. Fry",
+            "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com",
+        )
+        assert await authenticator.resolve_username("nobody") == (None, None)
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert (negative_cache.hits, negative_cache.misses) == (1, 2)
+    assert "fry" in cache
+    assert "nobody" in negative_cache
+
+    authenticator.invalidate_lookup_dn_cache(username="fry")
+    assert "fry" not in cache
+    assert "nobody" in negative_cache
+    authenticator.invalidate_lookup_dn_cache()
+    assert "nobody" not in negative_cache
+
+
+async def test_ldap_auth_credential_cache(c, monkeypatch):
+    c.LDAPAuthenticator.credential_cache_ttl = 60
+    authenticator = LDAPAuthenticator(config=c)
+    cache = authenticator.credential_cache
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert "fry" in cache
+
+    async def unavailable(login_username, password):
+        raise AssertionError("LDAP server unavailable")
+
+    # a repeated login doesn't need the LDAP server
+    with monkeypatch.context() as m:
+        m.setattr(authenticator, "authenticate_ldap_user", unavailable)
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert authorized["name"] == "fry"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a denied login attempt makes the login be forgotten
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "wrong"}
+    )
+    assert authorized is None
+    assert "fry" not in cache
+
+
+async def test_ldap_auth_credential_cache_hashes_in_thread(c, monkeypatch):
+    c.LDAPAuthenticator.credential_cache_ttl = 60
+    authenticator = LDAPAuthenticator(config=c)
+    assert not authenticator.executor_threads
+    threads = []
+    scrypt = hashlib.scrypt
+
+    def recording_scrypt(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return scrypt(*args, **kwargs)
+
+    monkeypatch.setattr(hashlib, "scrypt", recording_scrypt)
+    for password in ["fry", "wrong"]:
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": password}
+        )
+    # hashed when remembering the login and when checking the wrong password,
+    # without blocking the event loop
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+
+
+@pytest.mark.parametrize(
+    "search_filter", ["", "(&(objectClass=inetOrgPerson)(cn={username}))"]
+)
+async def test_ldap_auth_merged_searches(c, stand_in, monkeypatch, search_filter):
+    use_stand_in(c, stand_in)
+    c.LDAPAuthenticator.search_filter = search_filter
+    c.LDAPAuthenticator.group_membership_strategy = "member_of"
+    c.LDAPAuthenticator.auth_state_attributes = ["employeeType"]
+    authenticator = LDAPAuthenticator(config=c)
+
+    user_searches = []
+    get_connection = authenticator.get_connection
+
+    async def get_counting_connection(userdn, password):
+        conn = await get_connection(userdn, password)
+        if conn and userdn:
+            search = conn.search
+
+            async def counting_search(**kwargs):
+                user_searches.append(kwargs)
+                return await search(**kwargs)
+
+            conn.search = counting_search
+        return conn
+
+    monkeypatch.setattr(authenticator, "get_connection", get_counting_connection)
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["auth_state"]["ldap_groups"] == [
+        "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+    ]
+    assert authorized["auth_state"]["user_attributes"] == {
+        "employeeType": ["Delivery boy"]
+    }
+    # search_filter, member_of and auth_state_attributes are served by a
+    # single search
+    assert len(user_searches) == 1
+
+
+async def test_ldap_auth_bind_dn_template_concurrency(c, monkeypatch):
+    c.LDAPAuthenticator.bind_dn_template_concurrency = 3
+    authenticator = LDAPAuthenticator(config=c)
+
+    userdns = [
+        "cn=Philip J. Fry,ou=nobody,dc=planetexpress,dc=com",
+        "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com",
+        "CN=Philip J. Fry,OU=people,DC=planetexpress,DC=com",
+    ]
+    conns = {}
+    get_connection = authenticator.get_connection
+
+    async def get_connection_slowly(userdn, password):
+        if userdn == userdns[1]:
+            await asyncio.sleep(0.3)
+        conns[userdn] = await get_connection(userdn, password)
+        return conns[userdn]
+
+    monkeypatch.setattr(authenticator, "get_connection", get_connection_slowly)
+
+    # the last DN binds first, but the first DN in order that binds is used
+    userdn, conn = await authenticator.bind_first(userdns, "fry")
+    assert userdn == userdns[1]
+    assert conn is conns[userdns[1]]
+    assert not conn.closed
+    assert conns[userdns[0]] is None
+    assert conns[userdns[2]].closed
+    await conn.unbind()
+
+    assert await authenticator.bind_first(userdns, "wrong") == (None, None)
+
+
+async def test_ldap_auth_bind_dn_template_concurrency_skips(c, monkeypatch):
+    c.LDAPAuthenticator.bind_dn_template_concurrency = 2
+    authenticator = LDAPAuthenticator(config=c)
+
+    userdns = [
+        "cn=Philip J. Fry,ou=nobody,dc=planetexpress,dc=com",
+        "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com",
+        "cn=Philip J. Fry,ou=crew,dc=planetexpress,dc=com",
+        "cn=Philip J. Fry,ou=staff,dc=planetexpress,dc=com",
+    ]
+    binds = []
+    get_connection = authenticator.get_connection
+
+    async def get_connection_slowly(userdn, password):
+        binds.append(userdn)
+        if userdn == userdns[0]:
+            await asyncio.sleep(0.2)
+        return await get_connection(userdn, password)
+
+    monkeypatch.setattr(authenticator, "get_connection", get_connection_slowly)
+
+    # once the second DN is bound, the others aren't bound while waiting for
+    # the first one to fail
+    userdn, conn = await authenticator.bind_first(userdns, "fry")
+    assert userdn == userdns[1]
+    assert binds == userdns[:2]
+    await conn.unbind()
+
+
+async def test_ldap_auth_adaptive_bind_dn_template_order(c, monkeypatch):
+    c.LDAPAuthenticator.bind_dn_template = [
+        "cn={username},ou=nobody,dc=planetexpress,dc=com",
+        "cn={username},ou=people,dc=planetexpress,dc=com",
+    ]
+    c.LDAPAuthenticator.adaptive_bind_dn_template_order = True
+    authenticator = LDAPAuthenticator(config=c)
+
+    binds = []
+    get_connection = authenticator.get_connection
+
+    async def get_counted_connection(userdn, password):
+        if userdn:
+            binds.append(userdn)
+        return await get_connection(userdn, password)
+
+    monkeypatch.setattr(authenticator, "get_connection", get_counted_connection)
+
+    for username, n_binds in [("fry", 2), ("fry", 1), ("leela", 1)]:
+        binds.clear()
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": username, "password": username}
+        )
+        assert authorized["name"] == username
+        assert len(binds) == n_binds
+
+    order = authenticator.bind_dn_template_order
+    assert (order.logins, order.first_attempt_logins) == (3, 2)
+
+
+async def test_ldap_auth_connection_stats(c):
+    c.LDAPAuthenticator.search_filter = "(cn={username})"
+    authenticator = LDAPAuthenticator(config=c)
+    stats = authenticator.connection_stats
+
+    for username in ["fry", "leela", "bender", "fry"]:
+        await authenticator.get_authenticated_user(
+            None, {"username": username, "password": username}
+        )
+        await authenticator.get_authenticated_user(
+            None, {"username": username, "password": "wrong"}
+        )
+    # only the pooled connection is left open, and is idle
+    assert stats.open == authenticator.lookup_dn_pool.size == 1
+    assert stats.in_use == 0
+    assert stats.leaked == 0
+
+    conn = await authenticator.get_connection(
+        "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com", "fry"
+    )
+    assert (stats.open, stats.in_use) == (2, 1)
+    async with conn:
+        pass
+    assert conn.closed
+    assert stats.open == 1
+
+    conn = await authenticator.get_connection(
+        "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com", "fry"
+    )
+    del conn
+    gc.collect()
+    assert (stats.open, stats.leaked) == (1, 1)
+    await authenticator.lookup_dn_pool.close()
+    assert stats.open == 0
+
+
+@pytest.mark.parametrize("method", ["start_tls", "bind"])
+async def test_ldap_auth_sync_connection_error_unbinds(c, monkeypatch, method):
+    c.LDAPAuthenticator.client_mode = "sync"
+    c.LDAPAuthenticator.tls_strategy = "before_bind"
+    authenticator = LDAPAuthenticator(config=c)
+    stats = authenticator.connection_stats
+    connections = []
+
+    def fail(self, *args, **kwargs):
+        connections.append(self)
+        raise LDAPSocketReceiveError("error receiving data")
+
+    monkeypatch.setattr(ldap3.Connection, method, fail)
+    with pytest.raises(LDAPSocketReceiveError):
+        await authenticator.get_connection(
+            "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com", "fry"
+        )
+    assert len(connections) == 1
+    assert connections[0].closed
+    gc.collect()
+    assert (stats.open, stats.leaked) == (0, 0)
+
+
+async def test_ldap_auth_metrics(c):
+    c.LDAPAuthenticator.lookup_dn_cache_ttl = 0
+    c.LDAPAuthenticator.lookup_dn_negative_cache_ttl = 0
+    authenticator = LDAPAuthenticator(config=c)
+
+    def samples():
+        values = {
+            (phase, outcome): REGISTRY.get_sample_value(
+                "ldapauthenticator_phase_duration_seconds_count",
+                {"phase": phase, "outcome": outcome},
+            )
+            for phase, outcome in [
+                ("lookup_dn", "success"),
+                ("lookup_dn", "not_found"),
+                ("bind", "success"),
+                ("bind", "bad_credentials"),
+                ("groups", "success"),
+            ]
+        }
+        values["searches"] = REGISTRY.get_sample_value(
+            "ldapauthenticator_ldap_operations_total", {"operation": "search"}
+        )
+        return values
+
+    before = samples()
+    for username, password in [("fry", "fry"), ("fry", "wrong"), ("nobody", "x")]:
+        await authenticator.get_authenticated_user(
+            None, {"username": username, "password": password}
+        )
+    after = samples()
+    increase = {key: after[key] - before[key] for key in before}
+    assert increase == {
+        ("lookup_dn", "success"): 2,
+        ("lookup_dn", "not_found"): 1,
+        # the lookup_dn_search_user's pooled connection and fry
+        ("bind", "success"): 2,
+        ("bind", "bad_credentials"): 1,
+        ("groups", "success"): 1,
+        # 3 lookups and 2 allowed_groups searches
+        "searches": 5,
+    }
+
+    authenticator.enable_metrics = False
+    await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert samples() == after
+
+
+async def test_ldap_auth_coalesce_requests(c):
+    c.LDAPAuthenticator.lookup_dn_cache_ttl = 0
+    authenticator = LDAPAuthenticator(config=c)
+    operations = authenticator.connection_stats.operations
+    pool = authenticator.lookup_dn_pool
+
+    resolved = await asyncio.gather(
+        *(authenticator.resolve_username("fry") for _ in range(3))
+    )
+    userdn = "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com"
+    assert resolved == [("Philip J. Fry", userdn)] * 3
+    assert operations["search"] == 1
+    assert authenticator.singleflight.shared == 2
+
+    # the searches of each of the two allowed_groups are shared
+    found = await asyncio.gather(
+        *(
+            authenticator.get_ldap_groups(pool, userdn, "Philip J. Fry")
+            for _ in range(3)
+        )
+    )
+    assert found == [["cn=ship_crew,ou=people,dc=planetexpress,dc=com"]] * 3
+    assert operations["search"] == 3
+    assert authenticator.singleflight.shared == 6
+
+
+async def test_ldap_auth_max_concurrent_logins(c):
+    c.LDAPAuthenticator.max_concurrent_logins = 1
+    c.LDAPAuthenticator.max_queued_logins = 1
+    c.LDAPAuthenticator.login_queue_timeout = 0.2
+    authenticator = LDAPAuthenticator(config=c)
+
+    # occupy the only slot, so that the next login waits and times out
+    await authenticator._login_slots.acquire()
+    with pytest.raises(web.HTTPError) as exc_info:
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert exc_info.value.status_code == 503
+
+    # with the queue full, logins are rejected right away
+    waiting = asyncio.ensure_future(
+        authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    )
+    await asyncio.sleep(0)
+    with pytest.raises(web.HTTPError) as exc_info:
+        await asyncio.wait_for(
+            authenticator.get_authenticated_user(
+                None, {"username": "leela", "password": "leela"}
+            ),
+            timeout=0.1,
+        )
+    assert exc_info.value.status_code == 503
+
+    authenticator._login_slots.release()
+    authorized = await waiting
+    assert authorized["name"] == "fry"
+
+
+async def test_ldap_auth_failed_login_limit(c):
+    c.LDAPAuthenticator.failed_login_limit_per_username = 2
+    c.LDAPAuthenticator.failed_login_limit_per_ip = 3
+    authenticator = LDAPAuthenticator(config=c)
+    handler = SimpleNamespace(request=SimpleNamespace(remote_ip="10.0.0.1"))
+
+    for _ in range(2):
+        authorized = await authenticator.get_authenticated_user(
+            handler, {"username": "fry", "password": "wrong"}
+        )
+        assert authorized is None
+    with pytest.raises(web.HTTPError) as exc_info:
+        await authenticator.get_authenticated_user(
+            handler, {"username": "fry", "password": "fry"}
+        )
+    assert exc_info.value.status_code == 429
+
+    # other usernames can still log in, until the IP address is limited too
+    authorized = await authenticator.get_authenticated_user(
+        handler, {"username": "leela", "password": "wrong"}
+    )
+    assert authorized is None
+    with pytest.raises(web.HTTPError) as exc_info:
+        await authenticator.get_authenticated_user(
+            handler, {"username": "leela", "password": "leela"}
+        )
+    assert exc_info.value.status_code == 429
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "leela", "password": "leela"}
+    )
+    assert authorized["name"] == "leela"
+
+
+@pytest.fixture
+def silent_server():
+    """
+    The address of a server accepting connections but never responding.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        yield "127.0.0.1:{}".format(sock.getsockname()[1])
+
+
+async def test_ldap_auth_server_receive_timeout(c, silent_server):
+    c.LDAPAuthenticator.server_address = [
+        silent_server,
+        {"address": c.LDAPAuthenticator.server_address, "weight": 2},
+    ]
+    c.LDAPAuthenticator.server_receive_timeout = 0.2
+    authenticator = LDAPAuthenticator(config=c)
+    silent, _ = authenticator.get_servers().servers
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert not silent.up
+    authenticator.get_servers().close()
+
+
+async def test_ldap_auth_login_timeout(c, silent_server):
+    c.LDAPAuthenticator.server_address = silent_server
+    c.LDAPAuthenticator.server_receive_timeout = 1
+    c.LDAPAuthenticator.login_timeout = 0.2
+    # blocking operations can only be given up on from another thread
+    c.LDAPAuthenticator.executor_threads = 1
+    authenticator = LDAPAuthenticator(config=c)
+
+    with pytest.raises(web.HTTPError) as exc_info:
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert exc_info.value.status_code == 504
+    authenticator.executor.shutdown(wait=True)
+
+
+async def test_ldap_auth_server_circuit_breaker(c):
+    # nothing listens on port 1, so connections to it are refused
+    c.LDAPAuthenticator.server_address = "127.0.0.1:1"
+    c.LDAPAuthenticator.server_circuit_breaker_timeout = 60
+    authenticator = LDAPAuthenticator(config=c)
+    attempts = []
+    get_server_connection = authenticator._get_server_connection
+
+    async def _get_server_connection(server, userdn, password):
+        attempts.append(server)
+        return await get_server_connection(server, userdn, password)
+
+    authenticator._get_server_connection = _get_server_connection
+
+    for _ in range(3):
+        with pytest.raises(LDAPSocketOpenError):
+            await authenticator.get_authenticated_user(
+                None, {"username": "fry", "password": "fry"}
+            )
+    # only the first login tried to connect, the others failed fast
+    assert len(attempts) == 1
+
+
+async def test_ldap_auth_refresh_user(c):
+    c.LDAPAuthenticator.refresh_users = True
+    c.LDAPAuthenticator.refresh_batch_delay = 0.05
+    c.LDAPAuthenticator.auth_state_attributes = ["employeeType"]
+    authenticator = LDAPAuthenticator(config=c)
+    usernames = ["fry", "leela", "bender", "nobody"]
+
+    refreshed = await asyncio.gather(
+        *(
+            authenticator.refresh_user(SimpleNamespace(name=username))
+            for username in usernames
+        )
+    )
+    # the users were checked together
+    assert authenticator.refresh_batcher.batches == 1
+    for username, auth_model in zip(usernames[:3], refreshed):
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": username, "password": username}
+        )
+        assert auth_model["auth_state"] == authorized["auth_state"]
+    # no longer found in LDAP
+    assert refreshed[3] is False
+
+    # no longer allowed
+    authenticator.allowed_groups = ["cn=admin_staff,ou=people,dc=planetexpress,dc=com"]
+    assert await authenticator.refresh_user(SimpleNamespace(name="fry")) is False
+
+
+async def test_ldap_auth_refresh_user_lookup_dn_search_filter(c):
+    c.LDAPAuthenticator.refresh_users = True
+    c.LDAPAuthenticator.refresh_batch_delay = 0.05
+    c.LDAPAuthenticator.lookup_dn_search_filter = (
+        "(&(employeeType=Captain)({login_attr}={login}))"
+    )
+    authenticator = LDAPAuthenticator(config=c)
+
+    fry, leela = await asyncio.gather(
+        authenticator.refresh_user(SimpleNamespace(name="fry")),
+        authenticator.refresh_user(SimpleNamespace(name="leela")),
+    )
+    # fry isn't found by the filter, as when logging in
+    assert fry is False
+    assert leela["name"] == "leela"
+
+
+async def test_ldap_auth_refresh_user_caches(c, monkeypatch):
+    c.LDAPAuthenticator.refresh_users = True
+    c.LDAPAuthenticator.refresh_batch_delay = 0
+    c.LDAPAuthenticator.credential_cache_ttl = 60
+    c.LDAPAuthenticator.lookup_dn_cache_ttl = 60
+    authenticator = LDAPAuthenticator(config=c)
+    cache = authenticator.credential_cache
+    await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+
+    # checking the user again replaces the remembered auth model
+    _, _, remembered = cache._cache.get("fry")
+    remembered["auth_state"]["ldap_groups"] = []
+    auth_model = await authenticator.refresh_user(SimpleNamespace(name="fry"))
+    assert auth_model["auth_state"]["ldap_groups"]
+    remembered = await cache.get("fry", "fry")
+    assert remembered["auth_state"] == auth_model["auth_state"]
+
+    # denying the user forgets everything remembered about them
+    async def check_allowed(username, auth_model):
+        return False
+
+    monkeypatch.setattr(authenticator, "check_allowed", check_allowed)
+    await authenticator.get_posix_identity(User("fry", {"user_attributes": {}}))
+    assert "fry" in authenticator.lookup_dn_cache
+    assert "fry" in authenticator.posix_identity_cache
+    assert await authenticator.refresh_user(SimpleNamespace(name="fry")) is False
+    assert "fry" not in cache
+    assert "fry" not in authenticator.lookup_dn_cache
+    assert "fry" not in authenticator.posix_identity_cache
+
+
+async def test_ldap_auth_refresh_rate_limit(c):
+    c.LDAPAuthenticator.refresh_users = True
+    c.LDAPAuthenticator.refresh_batch_delay = 0
+    c.LDAPAuthenticator.refresh_rate_limit = 2
+    authenticator = LDAPAuthenticator(config=c)
+
+    for username in ["fry", "leela"]:
+        auth_model = await authenticator.refresh_user(SimpleNamespace(name=username))
+        assert auth_model["name"] == username
+    # deferred, keeping the current auth state
+    assert await authenticator.refresh_user(SimpleNamespace(name="bender")) is True
+    assert authenticator.refresh_batcher.batches == 2
+
+
+async def test_ldap_auth_group_sync(c):
+    c.LDAPAuthenticator.group_sync_interval = 3600
+    c.Authenticator.manage_groups = True
+    authenticator = LDAPAuthenticator(config=c)
+    applied = []
+
+    async def apply_group_changes(changes):
+        applied.append(changes)
+
+    authenticator.apply_group_changes = apply_group_changes
+    await authenticator.close()
+    assert authenticator._group_syncer is None
+    await authenticator.sync_groups()
+
+    admin_staff, ship_crew = authenticator.allowed_groups
+    assert applied == [
+        {
+            admin_staff: ({"hermes", "professor"}, set()),
+            ship_crew: ({"fry", "leela", "bender"}, set()),
+        }
+    ]
+    assert authenticator.group_sync.entries_read > 0
+
+    # logins are assigned the groups of the last pass
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["groups"] == ["ship_crew"]
+
+    # later passes only apply changes
+    await authenticator.sync_groups()
+    assert len(applied) == 1
+    await authenticator.close()
+
+
+async def test_ldap_auth_group_sync_requires_manage_groups(c):
+    c.LDAPAuthenticator.group_sync_interval = 3600
+    hub = Configurable(config=c)
+    hub.db = orm.new_session_factory("sqlite://")()
+    hub.db.add(orm.User(name="fry"))
+    hub.db.commit()
+    authenticator = LDAPAuthenticator(parent=hub, config=c)
+    assert authenticator._group_syncer is None
+
+    ship_crew = "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+    await authenticator.apply_group_changes({ship_crew: ({"fry"}, set())})
+    assert orm.Group.find(hub.db, "ship_crew") is None
+
+
+async def test_ldap_auth_apply_group_changes(c):
+    c.Authenticator.manage_groups = True
+    hub = Configurable(config=c)
+    hub.db = orm.new_session_factory("sqlite://")()
+    for username in ["fry", "leela"]:
+        hub.db.add(orm.User(name=username))
+    hub.db.commit()
+    authenticator = LDAPAuthenticator(parent=hub, config=c)
+    ship_crew = "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+
+    await authenticator.apply_group_changes({ship_crew: ({"fry", "leela"}, set())})
+    group = orm.Group.find(hub.db, "ship_crew")
+    assert sorted(user.name for user in group.users) == ["fry", "leela"]
+
+    await authenticator.apply_group_changes({ship_crew: ({"bender"}, {"leela"})})
+    # bender isn't a JupyterHub user yet
+    assert [user.name for user in group.users] == ["fry"]
+
+
+async def test_ldap_auth_nested_group_membership_client_side(c, stand_in):
+    use_stand_in(c, stand_in)
+    c.LDAPAuthenticator.nested_group_membership = "client_side"
+    authenticator = LDAPAuthenticator(config=c)
+
+    for username, ldap_groups in [
+        ("fry", ["cn=ship_crew,ou=people,dc=planetexpress,dc=com"]),
+        ("hermes", ["cn=admin_staff,ou=people,dc=planetexpress,dc=com"]),
+    ]:
+        auth_model = await authenticator.get_authenticated_user(
+            None, {"username": username, "password": username}
+        )
+        assert auth_model["auth_state"]["ldap_groups"] == ldap_groups
+    # the groups' parents were searched for once
+    assert authenticator.group_graph.searches == 2
+
+
+async def test_ldap_auth_nested_group_membership_in_chain(c):
+    c.LDAPAuthenticator.nested_group_membership = "in_chain"
+    c.LDAPAuthenticator.group_membership_strategy = "combined_search"
+    c.LDAPAuthenticator.coalesce_requests = False
+    authenticator = LDAPAuthenticator(config=c)
+    searches = []
+
+    class Connection:
+        async def search(self, **kwargs):
+            searches.append(kwargs)
+            return []
+
+    await authenticator.get_ldap_groups(
+        Connection(), "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com", "fry"
+    )
+    assert [search["search_filter"] for search in searches] == [
+        "(&(member:1.2.840.113556.1.4.1941:=cn=Philip J. Fry,ou=people,"
+        "dc=planetexpress,dc=com)(|(cn=admin_staff)(cn=ship_crew)))"
+    ]
+
+
+class User:
+    """
+    A JupyterHub user with an auth_state, counting its reads.
+    """
+
+    def __init__(self, name, auth_state):
+        self.name = name
+        self.auth_state = auth_state
+        self.auth_state_reads = 0
+
+    async def get_auth_state(self):
+        self.auth_state_reads += 1
+        return self.auth_state
+
+
+@pytest.fixture(scope="module")
+def posix_server():
+    people = "ou=people,dc=planetexpress,dc=com"
+    with FakeLDAPServer() as server:
+        server.directory.modify(
+            f"cn=Philip J. Fry,{people}",
+            {"uidNumber": "1001", "gidNumber": "1000", "homeDirectory": "/home/fry"},
+        )
+        for cn, gid in [("crew", 1000), ("delivery", 2000), ("cryo", 2001)]:
+            server.directory.add(
+                f"cn={cn},{people}",
+                {
+                    "objectClass": "posixGroup",
+                    "gidNumber": str(gid),
+                    "memberUid": "fry",
+                },
+            )
+        yield server
+
+
+async def test_ldap_auth_pre_spawn_start_auth_state(c):
+    authenticator = LDAPAuthenticator(config=c)
+    user = User(
+        "fry",
+        {
+            "user_attributes": {
+                "uidNumber": [1001],
+                "gidNumber": [1000],
+                "homeDirectory": ["/home/fry"],
+            }
+        },
+    )
+    for _ in range(2):
+        spawner = SimpleNamespace(environment={})
+        await authenticator.pre_spawn_start(user, spawner)
+        assert spawner.environment == {
+            "NB_USER": "fry",
+            "NB_UID": "1001",
+            "NB_GID": "1000",
+            "NB_HOMEDIR": "/home/fry",
+        }
+    # the identity was remembered, without reading the LDAP server
+    assert user.auth_state_reads == 1
+    assert not authenticator.connection_stats.operations
+
+
+async def test_ldap_auth_pre_spawn_start_lookup(c, posix_server):
+    c.LDAPAuthenticator.server_address = posix_server.host
+    c.LDAPAuthenticator.server_port = posix_server.port
+    c.LDAPAuthenticator.posix_groups_search_base = "ou=people,dc=planetexpress,dc=com"
+    authenticator = LDAPAuthenticator(config=c)
+    operations = authenticator.connection_stats.operations
+
+    # users without an auth_state, or without the attributes in it, are
+    # looked up
+    user = User("fry", None)
+    spawns = [SimpleNamespace(environment={}) for _ in range(3)]
+    await asyncio.gather(*(authenticator.pre_spawn_start(user, s) for s in spawns))
+    for spawner in spawns:
+        assert spawner.environment == {
+            "NB_USER": "fry",
+            "NB_UID": "1001",
+            "NB_GID": "1000",
+            "NB_HOMEDIR": "/home/fry",
+            "NB_SUPPLEMENTARY_GIDS": "2000,2001",
+        }
+    assert operations["search"] == 2
+
+    spawner = SimpleNamespace(environment={})
+    await authenticator.pre_spawn_start(user, spawner)
+    assert operations["search"] == 2
+
+    # unknown values are left out
+    spawner = SimpleNamespace(environment={})
+    await authenticator.pre_spawn_start(User("leela", {"user_attributes": {}}), spawner)
+    assert spawner.environment == {"NB_USER": "leela"}
+
+    # logging in again forgets the identity
+    await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert "fry" not in authenticator.posix_identity_cache
+
+
+async def test_ldap_auth_pre_spawn_start_lookup_dn_username(c, posix_server):
+    c.LDAPAuthenticator.server_address = posix_server.host
+    c.LDAPAuthenticator.server_port = posix_server.port
+    c.LDAPAuthenticator.use_lookup_dn_username = True
+    authenticator = LDAPAuthenticator(config=c)
+
+    # the username is the lookup_dn_user_dn_attribute value, not the uid
+    spawner = SimpleNamespace(environment={})
+    await authenticator.pre_spawn_start(User("Philip J. Fry", None), spawner)
+    assert spawner.environment == {
+        "NB_USER": "Philip J. Fry",
+        "NB_UID": "1001",
+        "NB_GID": "1000",
+        "NB_HOMEDIR": "/home/fry",
+    }
+
+
+async def test_ldap_auth_pre_spawn_start_refresh(c, posix_server):
+    c.LDAPAuthenticator.server_address = posix_server.host
+    c.LDAPAuthenticator.server_port = posix_server.port
+    c.LDAPAuthenticator.refresh_users = True
+    c.LDAPAuthenticator.refresh_batch_delay = 0
+    authenticator = LDAPAuthenticator(config=c)
+
+    await authenticator.pre_spawn_start(
+        User("fry", None), SimpleNamespace(environment={})
+    )
+    assert "fry" in authenticator.posix_identity_cache
+    # checking the user again forgets the identity, so that changes apply
+    assert await authenticator.refresh_user(SimpleNamespace(name="fry"))
+    assert "fry" not in authenticator.posix_identity_cache
+
+
+async def test_ldap_auth_tracing(c):
+    c.LDAPAuthenticator.executor_threads = 2
+    c.LDAPAuthenticator.allowed_groups = [
+        "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+    ]
+    authenticator = LDAPAuthenticator(config=c)
+    tracer = authenticator.tracer = RecordingTracer()
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+
+    (login,) = [span for span in tracer.spans if span.parent is None]
+    assert login.name == "ldap.login"
+    assert login.attributes == {"outcome": "success"}
+    spans = tracer.children(login)
+    # the lookup_dn search user's connection, and then the user's
+    assert [span.name for span in spans] == [
+        "ldap.connect",
+        "ldap.tls",
+        "ldap.bind",
+        "ldap.search",
+        "ldap.connect",
+        "ldap.tls",
+        "ldap.bind",
+        "ldap.search",
+        "ldap.unbind",
+    ]
+    lookup = spans[3].attributes
+    assert lookup["ldap.base"] == "ou=people,dc=planetexpress,dc=com"
+    assert lookup["ldap.scope"] == "subtree"
+    assert lookup["ldap.filter"] == "(uid=?)"
+    assert lookup["ldap.entries"] == 1
+    assert lookup["ldap.bytes"] > 0
+    assert spans[6].attributes["ldap.result"] == "success"
+    assert all(span.attributes["ldap.server"] for span in spans)
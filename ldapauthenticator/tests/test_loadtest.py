@@ -0,0 +1,48 @@
+import json
+
+from ..loadtest import main, percentile, read_users
+
+
+def test_read_users(tmp_path):
+    path = tmp_path / "users.csv"
+    path.write_text("username,password\nfry,fry\n\nleela,pass,word\n")
+    assert read_users(path) == [("fry", "fry"), ("leela", "pass")]
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([1], 99) == 1
+    assert percentile([], 50) is None
+
+
+def test_loadtest_stand_in(capsys):
+    assert main(["--stand-in", "--logins", "10", "--concurrency", "3", "--json"]) == 0
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["logins"] == 10
+    assert summary["outcomes"] == {"success": 10}
+    assert summary["ldap_operations_per_login"]["bind"] >= 1
+    assert summary["latency"]["p50"] <= summary["latency"]["p99"]
+
+
+def test_loadtest_config(tmp_path, capsys):
+    config = tmp_path / "jupyterhub_config.py"
+    config.write_text(
+        "c = get_config()\n"
+        "c.LDAPAuthenticator.bind_dn_template = "
+        "'cn={username},ou=people,dc=planetexpress,dc=com'\n"
+        "c.LDAPAuthenticator.lookup_dn = True\n"
+        "c.LDAPAuthenticator.user_search_base = 'ou=people,dc=planetexpress,dc=com'\n"
+        "c.LDAPAuthenticator.user_attribute = 'uid'\n"
+        "c.LDAPAuthenticator.lookup_dn_user_dn_attribute = 'cn'\n"
+        "c.LDAPAuthenticator.allow_all = True\n"
+    )
+    users = tmp_path / "users.csv"
+    users.write_text("fry,fry\nleela,wrong\n")
+    args = ["-f", str(config), "-u", str(users), "-n", "4", "--stand-in"]
+    assert main(args) == 0
+    report = capsys.readouterr().out
+    assert "Logins:     4 in" in report
+    assert "success: 2, rejected: 2" in report
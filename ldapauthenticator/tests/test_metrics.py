@@ -0,0 +1,53 @@
+import ssl
+
+import pytest
+from ldap3.core.exceptions import (
+    LDAPBindError,
+    LDAPSocketOpenError,
+    LDAPSocketReceiveError,
+    LDAPStartTLSError,
+)
+from prometheus_client import REGISTRY
+
+from ..metrics import Outcome, Phase, error_outcome, measure
+
+
+def duration_count(phase, outcome):
+    return REGISTRY.get_sample_value(
+        "ldapauthenticator_phase_duration_seconds_count",
+        {"phase": str(phase), "outcome": str(outcome)},
+    )
+
+
+@pytest.mark.parametrize(
+    "error, outcome",
+    [
+        (LDAPStartTLSError("start_tls failed"), Outcome.tls_error),
+        (ssl.SSLError("handshake failure"), Outcome.tls_error),
+        (LDAPSocketOpenError("socket ssl wrapping error: ..."), Outcome.tls_error),
+        (LDAPSocketOpenError("invalid server address"), Outcome.socket_error),
+        (LDAPSocketReceiveError("error receiving data"), Outcome.socket_error),
+        (LDAPBindError("automatic bind not successful"), Outcome.bad_credentials),
+        (ValueError("unexpected"), Outcome.error),
+    ],
+)
+def test_error_outcome(error, outcome):
+    assert error_outcome(error) == outcome
+
+
+def test_measure():
+    before = duration_count(Phase.groups, Outcome.socket_error)
+    with pytest.raises(LDAPSocketReceiveError):
+        with measure(Phase.groups):
+            raise LDAPSocketReceiveError("error receiving data")
+    assert duration_count(Phase.groups, Outcome.socket_error) == before + 1
+
+    before = duration_count(Phase.search_filter, Outcome.multiple_matches)
+    with measure(Phase.search_filter) as measurement:
+        measurement.entries_found(2)
+    assert duration_count(Phase.search_filter, Outcome.multiple_matches) == before + 1
+
+    before = duration_count(Phase.search_filter, Outcome.success)
+    with measure(Phase.search_filter, enabled=False):
+        pass
+    assert duration_count(Phase.search_filter, Outcome.success) == before
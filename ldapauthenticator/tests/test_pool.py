@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+from ldap3.core.exceptions import LDAPBindError, LDAPSessionTerminatedByServerError
+
+from ..pool import ConnectionPool
+
+
+class DummyConnection:
+    def __init__(self, healthy=True):
+        self.closed = False
+        self.healthy = healthy
+        self.searches = 0
+
+    async def search(self, **kwargs):
+        self.searches += 1
+        if not self.healthy:
+            self.closed = True
+            raise LDAPSessionTerminatedByServerError("session terminated by server")
+        return [kwargs["search_base"]]
+
+    async def unbind(self):
+        self.closed = True
+
+
+class Connector:
+    def __init__(self, bind=True):
+        self.connections = []
+        self.bind = bind
+
+    async def __call__(self):
+        if not self.bind:
+            return None
+        conn = DummyConnection()
+        self.connections.append(conn)
+        return conn
+
+
+async def test_pool_reuses_connections():
+    connect = Connector()
+    pool = ConnectionPool(connect, keepalive_interval=0)
+
+    assert await pool.search(search_base="a") == ["a"]
+    assert await pool.search(search_base="b") == ["b"]
+    assert len(connect.connections) == 1
+    assert pool.size == 1
+    assert pool.idle == 1
+
+
+async def test_pool_max_size():
+    connect = Connector()
+    pool = ConnectionPool(connect, max_size=2, keepalive_interval=0)
+
+    conn1 = await pool.acquire()
+    conn2 = await pool.acquire()
+    waiting = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+    assert not waiting.done()
+
+    await pool.release(conn1)
+    assert await asyncio.wait_for(waiting, 1) is conn1
+    await pool.release(conn2)
+    assert pool.size == 2
+    assert len(connect.connections) == 2
+
+
+async def test_pool_bind_failure():
+    pool = ConnectionPool(Connector(bind=False), keepalive_interval=0)
+
+    with pytest.raises(LDAPBindError):
+        await pool.search(search_base="a")
+    assert pool.size == 0
+
+
+async def test_pool_replaces_disconnected_connection():
+    connect = Connector()
+    pool = ConnectionPool(connect, keepalive_interval=0)
+    await pool.search(search_base="a")
+
+    # a server side disconnect noticed when the connection is used
+    connect.connections[0].healthy = False
+    assert await pool.search(search_base="b") == ["b"]
+    assert len(connect.connections) == 2
+    assert pool.size == 1
+
+    # a disconnect noticed before the connection is used
+    connect.connections[1].closed = True
+    assert await pool.search(search_base="c") == ["c"]
+    assert len(connect.connections) == 3
+    assert pool.size == 1
+
+
+async def test_pool_maintain():
+    connect = Connector()
+    pool = ConnectionPool(connect, min_size=1, idle_timeout=0, keepalive_interval=0)
+
+    await pool.maintain()
+    assert pool.size == 1
+
+    conns = [await pool.acquire() for _ in range(3)]
+    for conn in conns:
+        await pool.release(conn)
+    assert pool.idle == 3
+    await asyncio.sleep(0.01)
+
+    # idle connections beyond min_size are evicted, and the remaining ones
+    # replaced if they fail their health check
+    conns[-1].healthy = False
+    await pool.maintain()
+    assert pool.size == 1
+    assert pool.idle == 1
+    assert len(connect.connections) == 4
+    assert connect.connections[-1].searches == 0
+
+
+async def test_pool_keepalive():
+    connect = Connector()
+    pool = ConnectionPool(connect, keepalive_interval=0.01)
+
+    await pool.search(search_base="a")
+    await asyncio.sleep(0.05)
+    assert connect.connections[0].searches > 1
+
+    await pool.close()
+    assert pool.size == 0
+    assert connect.connections[0].closed
@@ -0,0 +1,121 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from ..servers import Server, ServerSelection, ServerSelector, parse_server
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("ldap.example.org", ("ldap.example.org", None, 1)),
+        ("ldap.example.org:1389", ("ldap.example.org", 1389, 1)),
+        ("[::1]:1389", ("::1", 1389, 1)),
+        ("::1", ("::1", None, 1)),
+        ({"address": "ldap.example.org", "weight": 3}, ("ldap.example.org", None, 3)),
+        (
+            {"address": "ldap.example.org", "port": "636"},
+            ("ldap.example.org", 636, 1),
+        ),
+    ],
+)
+def test_parse_server(value, expected):
+    server = parse_server(value)
+    assert (server["address"], server["port"], server["weight"]) == expected
+
+
+@pytest.mark.parametrize(
+    "value",
+    [{"host": "ldap.example.org"}, {"address": "a", "weight": 0}, 389],
+)
+def test_parse_server_invalid(value):
+    with pytest.raises(ValueError):
+        parse_server(value)
+
+
+def test_round_robin_weights():
+    servers = [Server("a", 389, weight=1), Server("b", 389, weight=3)]
+    selector = ServerSelector(servers)
+
+    firsts = [selector.candidates()[0].address for _ in range(8)]
+    assert Counter(firsts) == {"a": 2, "b": 6}
+    # picks of the heavier server are spread out
+    assert "aa" not in "".join(firsts)
+
+
+def test_least_latency():
+    servers = [Server("a", 389), Server("b", 389), Server("c", 389)]
+    selector = ServerSelector(servers, selection=ServerSelection.least_latency)
+
+    selector.succeeded(servers[0], 0.5)
+    selector.succeeded(servers[1], 0.1)
+    # c hasn't been measured yet, so it's tried first
+    assert [s.address for s in selector.candidates()] == ["c", "b", "a"]
+    selector.succeeded(servers[2], 0.3)
+    assert [s.address for s in selector.candidates()] == ["b", "c", "a"]
+
+
+def test_mark_down():
+    servers = [Server("a", 389), Server("b", 389)]
+    selector = ServerSelector(servers, max_failures=2)
+
+    selector.failed(servers[0], OSError())
+    assert servers[0].up
+    selector.failed(servers[0], OSError())
+    assert not servers[0].up
+    assert [s.address for s in selector.candidates()] == ["b", "a"]
+
+    # with no servers up, all are still tried
+    selector.failed(servers[1], OSError())
+    selector.failed(servers[1], OSError())
+    assert {s.address for s in selector.candidates()} == {"a", "b"}
+
+    selector.succeeded(servers[0])
+    assert servers[0].up
+    assert servers[0].failures == 0
+
+
+async def test_probe_recovery():
+    servers = [Server("a", 389), Server("b", 389)]
+    reachable = set()
+
+    async def probe(server):
+        if server.address not in reachable:
+            raise OSError("connection refused")
+
+    selector = ServerSelector(servers, probe=probe, probe_interval=0.01)
+    selector.failed(servers[0], OSError())
+    await asyncio.sleep(0.05)
+    assert not servers[0].up
+
+    reachable.add("a")
+    await asyncio.sleep(0.05)
+    assert servers[0].up
+    assert servers[0].latency is not None
+    selector.close()
+
+
+def test_circuit_breaker(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("ldapauthenticator.servers.time.monotonic", lambda: now[0])
+    servers = [Server("a", 389), Server("b", 389)]
+    selector = ServerSelector(servers, breaker_timeout=30)
+
+    selector.failed(servers[0], OSError())
+    assert [s.address for s in selector.candidates()] == ["b"]
+    selector.failed(servers[1], OSError())
+    # open, failing fast
+    assert selector.candidates() == []
+
+    # half-open, letting a single attempt through
+    now[0] = 30.0
+    assert {s.address for s in selector.candidates()} == {"a", "b"}
+    assert selector.candidates() == []
+
+    selector.failed(servers[0], OSError())
+    selector.succeeded(servers[1])
+    now[0] = 59.0
+    assert [s.address for s in selector.candidates()] == ["b"]
+    now[0] = 60.0
+    assert [s.address for s in selector.candidates()] == ["b", "a"]
@@ -0,0 +1,108 @@
+from contextlib import asynccontextmanager
+
+import ldap3
+import pytest
+
+from ..connection import SyncConnection
+from ..sync import GroupSync
+
+PEOPLE = "ou=people,dc=example,dc=org"
+GROUPS = "ou=groups,dc=example,dc=org"
+
+
+class Timer:
+    now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=[None, ldap3.OFFLINE_SLAPD_2_4])
+def directory(request):
+    """
+    A local stand-in for an LDAP server, using ldap3's mock strategy, with
+    and without a schema. With a schema, ldap3 returns modifyTimestamp
+    values as datetimes.
+    """
+    conn = ldap3.Connection(
+        ldap3.Server("stand-in", get_info=request.param),
+        client_strategy=ldap3.MOCK_SYNC,
+    )
+    for uid, name in [("fry", "Philip J. Fry"), ("leela", "Turanga Leela")]:
+        conn.strategy.add_entry(
+            f"cn={name},{PEOPLE}",
+            {"uid": uid, "modifyTimestamp": "20240101000000Z"},
+        )
+    conn.strategy.add_entry(
+        f"cn=crew,{GROUPS}",
+        {
+            "objectClass": "groupOfNames",
+            "member": [f"cn=Philip J. Fry,{PEOPLE}", f"uid=bender,{PEOPLE}"],
+            "modifyTimestamp": "20240101000000Z",
+        },
+    )
+    conn.strategy.add_entry(
+        f"cn=staff,{GROUPS}",
+        {
+            "objectClass": "posixGroup",
+            "memberUid": ["leela"],
+            "modifyTimestamp": "20240102000000Z",
+        },
+    )
+    conn.bind()
+    return conn
+
+
+def group_sync(directory, **kwargs):
+    async def run(func, *args):
+        return func(*args)
+
+    @asynccontextmanager
+    async def connection():
+        yield SyncConnection(directory, run)
+
+    return GroupSync(
+        connection,
+        member_attributes=["member", "memberUid"],
+        users_base=PEOPLE,
+        name_attribute="uid",
+        groups_base=GROUPS,
+        groups_filter="(|(objectClass=groupOfNames)(objectClass=posixGroup))",
+        page_size=1,
+        **kwargs,
+    )
+
+
+async def test_group_sync(directory):
+    timer = Timer()
+    sync = group_sync(directory, full_interval=3600, timer=timer)
+
+    changes = await sync.sync()
+    assert changes == {
+        f"cn=crew,{GROUPS}": ({"fry", "bender"}, set()),
+        f"cn=staff,{GROUPS}": ({"leela"}, set()),
+    }
+    assert sync.entries_read == 4
+    assert sync.member_groups("leela") == [f"cn=staff,{GROUPS}"]
+
+    # only the most recently changed entries are read again
+    assert await sync.sync() == {}
+    assert sync.entries_read == 1
+
+    directory.modify(
+        f"cn=crew,{GROUPS}",
+        {
+            "member": [(ldap3.MODIFY_REPLACE, [f"cn=Turanga Leela,{PEOPLE}"])],
+            "modifyTimestamp": [(ldap3.MODIFY_REPLACE, ["20240103000000Z"])],
+        },
+    )
+    changes = await sync.sync()
+    assert changes == {f"cn=crew,{GROUPS}": ({"leela"}, {"fry", "bender"})}
+    assert sync.entries_read == 2
+
+    # deleted groups are noticed by full passes
+    directory.delete(f"cn=staff,{GROUPS}")
+    assert await sync.sync() == {}
+    timer.now = 3600
+    assert await sync.sync() == {f"cn=staff,{GROUPS}": (set(), {"leela"})}
+    assert sync.entries_read == 3
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from ..tracing import OpenTelemetryTracer, RecordingTracer, Tracer, filter_template
+
+
+@pytest.mark.parametrize(
+    "search_filter, template",
+    [
+        ("(uid=fry)", "(uid=?)"),
+        (
+            "(&(objectClass=posixAccount)(uid=fry)(mail=*))",
+            "(&(objectClass=?)(uid=?)(mail=*))",
+        ),
+        ("(|(cn=ab*cd)(uidNumber>=1000))", "(|(cn=?)(uidNumber>=?))"),
+        (r"(uid=a\28b\29)", "(uid=?)"),
+        (
+            "(member:1.2.840.113556.1.4.1941:=cn=crew,dc=example,dc=org)",
+            "(member:1.2.840.113556.1.4.1941:=?)",
+        ),
+    ],
+)
+def test_filter_template(search_filter, template):
+    assert filter_template(search_filter) == template
+
+
+def test_tracer():
+    with Tracer().span("ldap.search", {"ldap.base": "dc=org"}) as span:
+        span.set_attribute("ldap.entries", 1)
+
+
+async def test_recording_tracer():
+    tracer = RecordingTracer()
+
+    async def search(n):
+        with tracer.span("ldap.search", {"n": n}) as span:
+            await asyncio.sleep(0)
+            span.set_attribute("ldap.entries", n)
+
+    with tracer.span("ldap.login") as login:
+        await asyncio.gather(search(1), search(2))
+    with pytest.raises(ValueError):
+        with tracer.span("ldap.login"):
+            raise ValueError()
+
+    failed = tracer.spans[-1]
+    assert [s.attributes for s in tracer.children(login)] == [
+        {"n": 1, "ldap.entries": 1},
+        {"n": 2, "ldap.entries": 2},
+    ]
+    assert login.parent is None and login.error is None
+    assert login.duration >= 0
+    assert failed.error == "ValueError"
+    assert tracer.children(failed) == []
+
+
+def test_opentelemetry_tracer():
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = OpenTelemetryTracer(provider.get_tracer("test"))
+
+    with tracer.span("ldap.login"):
+        with tracer.span("ldap.search", {"ldap.base": "dc=org", "ldap.bytes": None}):
+            pass
+    search, login = exporter.get_finished_spans()
+    assert search.name == "ldap.search"
+    assert dict(search.attributes) == {"ldap.base": "dc=org"}
+    assert search.parent.span_id == login.context.span_id
@@ -0,0 +1,167 @@
+"""
+Tracing of the LDAP operations made by LDAPAuthenticator, to find out where
+the time of individual slow logins goes, which aggregate metrics can't tell.
+
+A tracer is given a span for each LDAP operation: "ldap.connect", "ldap.tls",
+"ldap.bind", "ldap.search", "ldap.compare" and "ldap.unbind", nested in a
+"ldap.login" span for each login, when made as part of one. Spans carry
+these attributes where they apply:
+
+- `ldap.server`, the "host:port" of the LDAP server.
+- `ldap.base`, the DN searched below or compared.
+- `ldap.scope`, the scope of a search: "base", "level" or "subtree".
+- `ldap.filter`, the search filter with its assertion values replaced by
+  "?", so that usernames and other values aren't recorded.
+- `ldap.attribute`, the attribute compared.
+- `ldap.entries`, the number of entries a search returned.
+- `ldap.bytes`, the number of bytes received in response.
+- `ldap.result`, the result description of a bind, such as "success" or
+  "invalidCredentials".
+
+Spans are nested through contextvars, so that spans started by concurrent
+tasks of a login are nested in its span.
+"""
+
+import contextvars
+import re
+import time
+from contextlib import contextmanager
+
+_current_span = contextvars.ContextVar("ldapauthenticator_span", default=None)
+
+# an assertion value in a filter, such as "fry" in "(uid=fry)", but not the
+# "*" of a presence filter such as "(uid=*)"
+_FILTER_VALUE = re.compile(r"(~=|>=|<=|=)(?!\*\))((?:[^()\\]|\\.)*)\)")
+
+
+def filter_template(search_filter):
+    """
+    Returns a search filter with its assertion values replaced by "?", such
+    as "(&(objectClass=?)(uid=?)(mail=*))" for
+    "(&(objectClass=posixAccount)(uid=fry)(mail=*))".
+    """
+    return _FILTER_VALUE.sub(r"\1?)", search_filter)
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    The interface of tracers, doing nothing, as LDAPAuthenticator's default
+    tracer.
+
+    `span` returns a context manager for a span, nested in the span current
+    when it is entered, that yields an object whose `set_attribute` method
+    sets attributes of the span.
+    """
+
+    # False if spans are dropped, so that attributes needn't be computed
+    enabled = False
+
+    @contextmanager
+    def span(self, name, attributes=None):
+        yield _NOOP_SPAN
+
+
+class RecordedSpan:
+    """
+    A span recorded by `RecordingTracer`, with its `name`, `attributes`,
+    `parent` span if nested in one, `start` and `end` as time.perf_counter
+    values, and the class name of the exception it ended with as `error`,
+    if any.
+    """
+
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    def __repr__(self):
+        return f"<RecordedSpan {self.name} {self.attributes}>"
+
+    @property
+    def duration(self):
+        return None if self.end is None else self.end - self.start
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class RecordingTracer(Tracer):
+    """
+    A tracer keeping the spans that ended in memory, in `spans`, for tests
+    and for inspecting logins interactively.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, attributes=None):
+        span = RecordedSpan(name, attributes, _current_span.get())
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            self.spans.append(span)
+
+    def children(self, span):
+        """
+        Returns the spans nested directly in `span`, in the order they
+        started.
+        """
+        return sorted(
+            (s for s in self.spans if s.parent is span), key=lambda s: s.start
+        )
+
+    def clear(self):
+        self.spans.clear()
+
+
+class _OpenTelemetrySpan:
+    def __init__(self, span):
+        self._span = span
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self._span.set_attribute(key, value)
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+    A tracer passing spans to OpenTelemetry, as configured by the
+    opentelemetry-api and opentelemetry-sdk packages, using `tracer` if
+    provided instead of the global tracer provider's "ldapauthenticator"
+    tracer.
+    """
+
+    enabled = True
+
+    def __init__(self, tracer=None):
+        if tracer is None:
+            from opentelemetry import trace
+
+            tracer = trace.get_tracer("ldapauthenticator")
+        self._tracer = tracer
+
+    @contextmanager
+    def span(self, name, attributes=None):
+        attributes = {k: v for k, v in (attributes or {}).items() if v is not None}
+        with self._tracer.start_as_current_span(name, attributes=attributes) as span:
+            yield _OpenTelemetrySpan(span)
@@ -18,9 +18,14 @@ setup(
         "traitlets",
     ],
     extras_require={
+        "loadtest": [
+            "cryptography",
+        ],
         "test": [
+            "cryptography",
             "pytest",
             "pytest-asyncio",
+            "pytest-benchmark",
             "pytest-cov",
         ],
     },